@@ -0,0 +1,323 @@
+"""Аналитика диалогов: журнал событий, почасовые агрегаты и дашборд.
+
+TrackedConversationHandler (см. flows) пишет каждый переход состояния диалога в EventLog — журнал
+в файле (EVENTS_LOG), куда строки только дописываются. Одна строка — одно событие через
+табуляцию: время, вид, услуга, номер шага, шаг, значение. Виды событий:
+  enter  — вход в диалог (шаг — первое состояние);
+  next   — переход вперед, back — назад (шаг — новое состояние);
+  end    — диалог закончился на этом шаге: отказ, /cancel, /start, тайм-аут сессии или
+           отправка заявки с последнего шага;
+  submit — заявка принята (значение — нормализованный тип оборудования, см. equipment.normalize).
+
+Aggregator периодически дочитывает журнал с сохраненного смещения и прибавляет события к
+почасовым и суточным счетчикам в SQLite (ANALYTICS_DB). Смещение сохраняется в той же транзакции,
+что и счетчики, поэтому каждое событие учитывается ровно один раз, а старая история не
+перечитывается. Если файл журнала заменили (ротация) или обрезали, чтение начинается с
+начала нового файла. dashboard() собирает воронки и оборудование только из агрегатов:
+время ответа зависит от длины периода (суток в нем), а не от числа событий. Испорченные
+строки журнала (например, оборванные при аварийной остановке) пропускаются.
+
+Модуль не импортирует telegram: dashboard() вызывается и в веб-процессах без бота.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from equipment import normalize
+
+logger = logging.getLogger(__name__)
+
+# Сколько байт журнала читается и агрегируется за одну транзакцию
+CHUNK_SIZE = 4 * 1024 * 1024
+HOUR = 3600
+DAY = 86400
+# ConversationHandler.END: состояние завершенного диалога
+END = -1
+# Вид события -> счетчик шага: reached, back, ended
+_COLUMN = {'enter': 0, 'next': 0, 'back': 1, 'end': 2}
+
+# Агрегаты по часам и по суткам (UTC): дашборд за длинный период берет полные сутки из
+# суточных, а неполные по краям — из почасовых
+PERIODS = {'hourly': HOUR, 'daily': DAY}
+_SCHEMA = tuple(
+    statement
+    for name in PERIODS
+    for statement in (
+        f'CREATE TABLE IF NOT EXISTS funnel_{name} ('
+        'period INTEGER NOT NULL, flow TEXT NOT NULL, step TEXT NOT NULL, pos INTEGER NOT NULL, '
+        'reached INTEGER NOT NULL, back INTEGER NOT NULL, ended INTEGER NOT NULL, '
+        'PRIMARY KEY (period, flow, step)) WITHOUT ROWID',
+        f'CREATE TABLE IF NOT EXISTS equipment_{name} ('
+        'period INTEGER NOT NULL, flow TEXT NOT NULL, equipment TEXT NOT NULL, submitted INTEGER NOT NULL, '
+        'PRIMARY KEY (period, flow, equipment)) WITHOUT ROWID',
+    )
+) + ('CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY CHECK (id = 1), inode INTEGER, offset INTEGER)',)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def _clean(value):
+    return str(value).replace('\t', ' ').replace('\n', ' ')
+
+
+class EventLog:
+    """Буфер событий: дописывается в файл раз в flush_interval секунд и при остановке"""
+
+    def __init__(self, path, flush_interval=1.0, clock=time.time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._buffer = []
+        self._flusher = None
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    def emit(self, kind, flow, step='', pos=-1, value=''):
+        self._buffer.append(f'{int(self.clock())}\t{kind}\t{flow}\t{pos}\t{_clean(step)}\t{_clean(value)}\n')
+
+    def transition(self, flow, names, old_state, new_state):
+        """Переход диалога flow из old_state в new_state; names — {состояние: шаг} в порядке шагов"""
+        if new_state == END:
+            if old_state is not None:
+                self.emit('end', flow, *self._step(names, old_state))
+            return
+        step, pos = self._step(names, new_state)
+        if old_state is None:
+            kind = 'enter'
+        else:
+            kind = 'next' if pos > self._step(names, old_state)[1] else 'back'
+        self.emit(kind, flow, step, pos)
+
+    def submit(self, flow, equipment_type):
+        self.emit('submit', flow, value=normalize(equipment_type or ''))
+
+    @staticmethod
+    def _step(names, state):
+        if state in names:
+            return names[state], list(names).index(state)
+        return str(state), -1
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except OSError as e:
+            logger.error(f"Не удалось записать {len(lines)} событий в {self.path}: {e}")
+            self._buffer = lines + self._buffer
+
+    def _write(self, lines):
+        # Файл открывается на каждую запись: после ротации события пишутся уже в новый
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(lines))
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+
+
+class Aggregator:
+    """Фоновая задача: раз в interval дописывает новые события журнала в почасовые и суточные счетчики"""
+
+    def __init__(self, log_path, db_path, interval=60.0):
+        self.log_path = log_path
+        self.interval = interval
+        self._conn = connect(db_path)
+        # Проход из _run может еще выполняться в потоке, когда stop запускает последний:
+        # без блокировки оба прочитают одну контрольную точку и посчитают события дважды
+        self._lock = threading.Lock()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.run_once)
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f"Не удалось обновить аналитику: {e}")
+            except Exception:
+                # Задача не должна завершаться: иначе дашборды останутся без новых данных
+                logger.exception("Ошибка агрегации аналитики")
+
+    def run_once(self):
+        """Агрегирует события, дописанные после прошлого запуска; возвращает их число"""
+        with self._lock:
+            return self._run_once()
+
+    def _run_once(self):
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return 0
+        row = self._conn.execute('SELECT inode, offset FROM checkpoint WHERE id = 1').fetchone()
+        offset = row[1] if row and row[0] == stat.st_ino and row[1] <= stat.st_size else 0
+        total = 0
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                # Последняя строка может быть дописана не полностью: она дочитается в следующий раз
+                end = chunk.rfind(b'\n') + 1
+                if not end:
+                    break
+                f.seek(offset + end)
+                offset += end
+                total += self._apply(chunk[:end].decode('utf-8', 'replace').splitlines(), stat.st_ino, offset)
+                if len(chunk) < CHUNK_SIZE:
+                    break
+        return total
+
+    def _apply(self, lines, inode, offset):
+        funnel = Counter()
+        positions = {}
+        submitted = Counter()
+        skipped = 0
+        for line in lines:
+            parts = line.split('\t')
+            try:
+                ts, kind, flow, pos, step, value = parts
+                ts, pos = int(ts), int(pos)
+            except ValueError:
+                skipped += 1
+                continue
+            hour = ts - ts % HOUR
+            if kind == 'submit':
+                submitted[hour, flow, value] += 1
+            else:
+                funnel[hour, flow, step, kind] += 1
+                positions[flow, step] = pos
+        if skipped:
+            logger.warning(f"Пропущено испорченных строк журнала {self.log_path}: {skipped}")
+        with self._conn:
+            for name, seconds in PERIODS.items():
+                rows = {}
+                for (hour, flow, step, kind), count in funnel.items():
+                    rows.setdefault((hour - hour % seconds, flow, step), [0, 0, 0])[_COLUMN.get(kind, 0)] += count
+                totals = Counter()
+                for (hour, flow, equipment), count in submitted.items():
+                    totals[hour - hour % seconds, flow, equipment] += count
+                self._conn.executemany(
+                    f'INSERT INTO funnel_{name} (period, flow, step, pos, reached, back, ended) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (period, flow, step) DO UPDATE SET reached = reached + excluded.reached, '
+                    'back = back + excluded.back, ended = ended + excluded.ended, pos = excluded.pos',
+                    [(*key, positions[key[1], key[2]], *counts) for key, counts in rows.items()]
+                )
+                self._conn.executemany(
+                    f'INSERT INTO equipment_{name} (period, flow, equipment, submitted) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (period, flow, equipment) DO UPDATE SET submitted = submitted + excluded.submitted',
+                    [(*key, count) for key, count in totals.items()]
+                )
+            self._conn.execute('INSERT OR REPLACE INTO checkpoint (id, inode, offset) VALUES (1, ?, ?)', (inode, offset))
+        return len(lines)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        # Последние события (EventLog останавливается раньше) попадают в агрегаты сразу
+        try:
+            await asyncio.to_thread(self.run_once)
+        finally:
+            with self._lock:
+                self._conn.close()
+
+
+def _ranges(since, until):
+    """Разбивает [since, until) на полные сутки и неполные часы по краям: [(period, начало, конец)]"""
+    start = int(since) - int(since) % HOUR if since else None
+    end = int(until) if until else None
+    first_day = -(-start // DAY) * DAY if start is not None else None
+    last_day = end - end % DAY if end is not None else None
+    if first_day is not None and last_day is not None and first_day >= last_day:
+        return [('hourly', start, end)]
+    ranges = [('daily', first_day, last_day)]
+    if start is not None and start < first_day:
+        ranges.append(('hourly', start, first_day))
+    if end is not None and last_day < end:
+        ranges.append(('hourly', last_day, end))
+    return ranges
+
+
+def _union(table, columns, ranges, flow):
+    """Подзапрос по агрегатам table из нужных таблиц периодов и его параметры"""
+    parts, params = [], []
+    for name, start, end in ranges:
+        clauses = []
+        for clause, value in (('period >= ?', start), ('period < ?', end), ('flow = ?', flow or None)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        parts.append(f'SELECT {columns} FROM {table}_{name} {where}')
+    return ' UNION ALL '.join(parts), params
+
+
+def dashboard(conn, since=None, until=None, flow=None):
+    """Воронки и оборудование по услугам за период [since, until) из агрегатов
+
+    Для каждого шага: reached — сколько раз на него перешли (вход и переходы вперед),
+    back — возвраты на него, ended — сколько диалогов на нем закончилось. Границы
+    периода округляются до часа.
+    """
+    ranges = _ranges(since, until)
+    flows = {}
+
+    def entry(name):
+        return flows.setdefault(name, {'steps': [], 'submitted': 0, 'equipment': {}})
+
+    query, params = _union('funnel', 'flow, step, pos, reached, back, ended', ranges, flow)
+    cursor = conn.execute(
+        f'SELECT flow, step, MAX(pos), SUM(reached), SUM(back), SUM(ended) FROM ({query}) '
+        'GROUP BY flow, step ORDER BY flow, MAX(pos)', params
+    )
+    for name, step, _, reached, back, ended in cursor:
+        entry(name)['steps'].append({'step': step, 'reached': reached, 'back': back, 'ended': ended})
+    query, params = _union('equipment', 'flow, equipment, submitted', ranges, flow)
+    cursor = conn.execute(
+        f'SELECT flow, equipment, SUM(submitted) FROM ({query}) '
+        'GROUP BY flow, equipment ORDER BY flow, SUM(submitted) DESC', params
+    )
+    for name, equipment, submitted in cursor:
+        item = entry(name)
+        item['submitted'] += submitted
+        if equipment:
+            item['equipment'][equipment] = submitted
+    return flows
+
+
+def build_log(path, flush_interval=1.0):
+    """Создает EventLog или возвращает None, если аналитика не включена"""
+    return EventLog(path, flush_interval) if path else None
+
+
+def build_aggregator(log_path, db_path, interval=60.0):
+    """Создает Aggregator или возвращает None, если аналитика не включена"""
+    if not log_path or not db_path:
+        return None
+    return Aggregator(log_path, db_path, interval)
@@ -1,49 +1,364 @@
+# Первым импортом: при STARTUP_PROFILE замеряет время всех следующих
+import startup
+
 import asyncio
+import hmac
 import logging
 import os
+import signal
 import threading
-from flask import Flask
+import time
+from datetime import datetime
+from flask import Blueprint, Flask, Response, abort, jsonify, request, stream_with_context
+
+import analytics
+import broadcast_store
+import config
+import metrics
+import storage
+from inbox import Inbox
+from leader import FileLeaderLock
 
-app = Flask(__name__)
+# Маршруты веб-приложения; само приложение собирает create_app()
+web = Blueprint('web', __name__)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Приложение бота и его event loop (нужны webhook-маршруту для передачи обновлений)
+bot_application = None
+bot_loop = None
+# Поток бота и ошибка, с которой он завершился (для /health)
+bot_thread = None
+bot_error = None
+# Сигнал остановки: shutdown_requested — для потока бота, bot_stop_event — для main_async
+shutdown_requested = threading.Event()
+bot_stop_event = None
+# Блокировка лидера (бот работает в процессе, который ее держит) и inbox для webhook из других процессов
+leader_lock = None
+inbox = None
+
+async def run_bot(build_application, main_async):
+    """Один запуск бота: работает до bot_stop_event или до ошибки"""
+    global bot_application, bot_stop_event, bot_error
+    bot_stop_event = asyncio.Event()
+    if shutdown_requested.is_set():
+        return
+    bot_application = build_application()
+    bot_error = None
+    await main_async(bot_application, bot_stop_event)
+
 def run_async_code():
-    """Запускает асинхронный код в отдельном потоке с собственным event loop"""
-    try:
-        # Создаем новый event loop для этого потока
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Импортируем и запускаем бота
-        from main import main_async
-        loop.run_until_complete(main_async())
-    except Exception as e:
-        logger.error(f"Ошибка в боте: {e}")
+    """Запускает бота в отдельном потоке с собственным event loop и перезапускает при падении
+
+    Пауза перед перезапуском растет от RESTART_MIN_DELAY до RESTART_MAX_DELAY и
+    сбрасывается, если бот проработал дольше RESTART_MAX_DELAY.
+    """
+    global bot_loop, bot_error
+    # Создаем новый event loop для этого потока
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot_loop = loop
+    from main import build_application, main_async
+
+    delay = config.RESTART_MIN_DELAY
+    while not shutdown_requested.is_set():
+        started = time.monotonic()
+        try:
+            loop.run_until_complete(run_bot(build_application, main_async))
+            if shutdown_requested.is_set():
+                break
+            bot_error = 'main_async завершился без запроса остановки'
+        except Exception as e:
+            bot_error = repr(e)
+            logger.exception(f"Ошибка в боте: {e}")
+        if time.monotonic() - started > config.RESTART_MAX_DELAY:
+            delay = config.RESTART_MIN_DELAY
+        logger.warning(f"Перезапуск бота через {delay:g} с")
+        if shutdown_requested.wait(delay):
+            break
+        delay = min(delay * 2, config.RESTART_MAX_DELAY)
+    logger.info("Поток бота завершен")
+
+def run_when_leader():
+    """Ждет, пока процесс станет лидером, и запускает в нем бота"""
+    if leader_lock is not None:
+        if not leader_lock.acquire(shutdown_requested):
+            return
+        logger.info(f"Процесс {os.getpid()} стал лидером и запускает бота")
+    run_async_code()
+
+def start_bot():
+    """Запускает поток бота; при заданном LEADER_LOCK бот работает только в одном процессе"""
+    global bot_thread, leader_lock
+    if bot_thread is not None:
+        return
+    if config.LEADER_LOCK:
+        leader_lock = FileLeaderLock(config.LEADER_LOCK)
+    bot_thread = threading.Thread(target=run_when_leader, daemon=True)
+    bot_thread.start()
 
-@app.route('/')
+def stop_bot():
+    """Останавливает бота не дольше SHUTDOWN_TIMEOUT (сигнал процессу или выход воркера gunicorn)"""
+    logger.info(f"Останавливаем бота (не дольше {config.SHUTDOWN_TIMEOUT:.0f} с)")
+    shutdown_requested.set()
+    loop, stop_event = bot_loop, bot_stop_event
+    if loop is not None and stop_event is not None and not loop.is_closed():
+        loop.call_soon_threadsafe(stop_event.set)
+    if bot_thread is not None:
+        bot_thread.join(config.SHUTDOWN_TIMEOUT)
+        if bot_thread.is_alive():
+            logger.error("Бот не остановился вовремя, часть обновлений и сообщений может быть потеряна")
+    if leader_lock is not None:
+        leader_lock.release()
+
+def request_shutdown(signum=None, frame=None):
+    """Обработчик SIGTERM/SIGINT для запуска через python app.py"""
+    logger.info(f"Получен сигнал {signum}")
+    stop_bot()
+    raise SystemExit(0)
+
+def create_app(start=True):
+    """Создает веб-приложение; start=True — запускает бота (или ожидание роли лидера) в фоне
+
+    Под gunicorn вызывается в каждом воркере (без preload_app, т.к. потоки не переживают fork).
+    """
+    global inbox
+    app = Flask(__name__)
+    app.register_blueprint(web)
+    if config.BOT_INBOX and inbox is None:
+        inbox = Inbox(config.BOT_INBOX, max_size=config.INBOX_MAX_SIZE)
+    startup.mark('веб-приложение создано')
+    if start:
+        start_bot()
+    return app
+
+def __getattr__(name):
+    """Совместимость с прежним запуском `gunicorn app:app` и `flask run`
+
+    Модульный app создается при первом обращении и, как 'app:create_app()', запускает бота;
+    простой import app (gunicorn.conf.py, бенчмарки) приложение не создает.
+    """
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@web.route('/')
 def home():
     return "✅ Бот работает! Проверь Telegram."
 
-@app.route('/health')
+def hosts_bot():
+    """Бот работает (или должен работать) в этом процессе"""
+    return leader_lock is None or leader_lock.held
+
+def leader_liveness():
+    """Проблемы бота по отметке лидера в inbox — для процессов, где бота нет"""
+    beat = inbox.last_beat() if inbox is not None else None
+    if beat is None:
+        return ['бот не запущен ни в одном процессе']
+    pid, ts = beat
+    if time.time() - ts > config.HEALTH_MAX_LAG:
+        return [f'бот в процессе {pid} не отвечает дольше {config.HEALTH_MAX_LAG:.0f} с']
+    return []
+
+def bot_liveness():
+    """Список проблем бота: поток завершился, loop остановлен или не отвечает"""
+    problems = []
+    if bot_error is not None:
+        problems.append(f'бот упал: {bot_error}')
+    if bot_thread is None or not bot_thread.is_alive():
+        problems.append('поток бота не работает')
+    if bot_loop is None or bot_loop.is_closed() or not bot_loop.is_running():
+        problems.append('event loop бота не запущен')
+    bot_data = bot_application.bot_data if bot_application is not None else {}
+    monitor = bot_data.get('loop_monitor')
+    if monitor is None or not monitor.alive(config.HEALTH_MAX_LAG):
+        problems.append(f'event loop бота не отвечает дольше {config.HEALTH_MAX_LAG:.0f} с')
+    relay = bot_data.get('inbox_relay')
+    if relay is not None and not relay.alive:
+        problems.append('перенос webhook-обновлений из inbox остановлен')
+    return problems
+
+@web.route('/health')
 def health():
+    problems = bot_liveness() if hosts_bot() else leader_liveness()
+    if problems:
+        return "🔴 " + "; ".join(problems), 503
     return "🟢 OK"
 
-@app.route('/test')
+@web.route('/metrics')
+def metrics_endpoint():
+    """Метрики бота; в процессах без бота — снимок, который лидер публикует через inbox
+
+    Так любой воркер gunicorn отдает одни и те же счетчики, и они не «сбрасываются»
+    от того, в какой процесс попал запрос Prometheus.
+    """
+    if hosts_bot():
+        body = metrics.render()
+    else:
+        snapshot = inbox.leader_metrics() if inbox is not None else None
+        if snapshot is None or time.time() - snapshot[1] > config.HEALTH_MAX_LAG:
+            return "Метрики недоступны: бот не работает в этом процессе, свежего снимка лидера нет", 503
+        body = snapshot[2]
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@web.route('/test')
 def test():
     return "Веб-сервер работает нормально"
 
-# Запускаем бота при старте приложения
+@web.route(config.WEBHOOK_PATH, methods=['POST'])
+def webhook():
+    """Принимает обновление от Telegram и передает его боту, не дожидаясь обработки
+
+    С BOT_INBOX обновление записывается в inbox, откуда его забирает процесс бота: так
+    webhook работает в любом воркере, не обращается к event loop бота, а обновления
+    одного чата не обгоняют друг друга. Без inbox — кладется прямо в update_queue.
+    Некорректное обновление отклоняется с 400, переполненный inbox или очередь — 503.
+    """
+    if config.BOT_MODE != 'webhook':
+        abort(404)
+    if config.WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != config.WEBHOOK_SECRET:
+        abort(403)
+    data = request.get_json(force=True, silent=True)
+    if not data:
+        abort(400)
+    if inbox is None and (not hosts_bot() or bot_application is None or bot_loop is None or bot_loop.is_closed()):
+        return "Бот не запущен", 503
+
+    # Обновление разбирается здесь, чтобы некорректное не попало к боту. Импорт здесь:
+    # процессы без webhook не загружают telegram (см. startup)
+    from telegram import Update
+    try:
+        update = Update.de_json(data, bot_application.bot if inbox is None else None)
+    except Exception as e:
+        logger.warning(f"Webhook: некорректное обновление отклонено: {e!r}")
+        return "Некорректное обновление", 400
+    if inbox is not None:
+        if not inbox.put(data):
+            # Бот не успевает: Telegram повторит доставку позже
+            return "Очередь обновлений переполнена", 503, {'Retry-After': '1'}
+        return ""
+    future = asyncio.run_coroutine_threadsafe(offer_update(bot_application.update_queue, update), bot_loop)
+    if not future.result(timeout=5):
+        # Telegram повторит доставку позже
+        return "Очередь обновлений переполнена", 503, {'Retry-After': '1'}
+    return ""
+
+async def offer_update(queue, update):
+    """Кладет обновление в очередь бота; False, если очередь заполнена"""
+    try:
+        queue.put_nowait(update)
+    except asyncio.QueueFull:
+        return False
+    return True
+
+def require_admin():
+    """Пускает к служебным маршрутам только с ADMIN_TOKEN в заголовке Authorization: Bearer
+
+    Токен в строке запроса (?token=) не принимается: она попадает в журналы gunicorn и прокси.
+    Сравнение за постоянное время, чтобы токен нельзя было подобрать по времени ответа.
+    """
+    if not config.ADMIN_TOKEN:
+        abort(404)
+    header = request.headers.get('Authorization', '')
+    token = header[7:] if header.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        abort(403)
+
+def page_limit(default):
+    """Размер страницы из ?limit=, от 1 до 500 (отрицательный LIMIT SQLite понимает как «без ограничения»)"""
+    return max(1, min(request.args.get('limit', default, type=int), 500))
+
+def request_filters():
+    """Фильтры поиска заявок из параметров запроса; since/until — unix-время или дата ISO"""
+    filters = {name: request.args.get(name) for name in storage.FILTERS}
+    for name in ('since', 'until'):
+        value = filters[name]
+        if value:
+            try:
+                filters[name] = float(value)
+            except ValueError:
+                try:
+                    filters[name] = datetime.fromisoformat(value).timestamp()
+                except ValueError:
+                    abort(400)
+    return filters
+
+@web.route('/admin/requests')
+def admin_requests():
+    """Страница заявок по фильтрам; следующая страница — ?before=<next>"""
+    require_admin()
+    filters = request_filters()
+    before = request.args.get('before', type=int)
+    limit = page_limit(50)
+    conn = storage.connect(config.REQUESTS_DB)
+    try:
+        items, next_cursor = storage.search(conn, filters, before_id=before, limit=limit)
+    finally:
+        conn.close()
+    return jsonify(items=items, next=next_cursor)
+
+@web.route('/admin/requests/export')
+def admin_requests_export():
+    """Потоковая выгрузка заявок по фильтрам: ?format=csv (по умолчанию) или jsonl"""
+    require_admin()
+    filters = request_filters()
+    export_format = request.args.get('format', 'csv')
+    if export_format == 'csv':
+        export, mimetype = storage.export_csv, 'text/csv; charset=utf-8'
+    elif export_format == 'jsonl':
+        export, mimetype = storage.export_jsonl, 'application/x-ndjson; charset=utf-8'
+    else:
+        abort(400)
+
+    def generate():
+        conn = storage.connect(config.REQUESTS_DB)
+        try:
+            yield from export(conn, filters)
+        finally:
+            conn.close()
+
+    headers = {'Content-Disposition': f'attachment; filename=requests.{export_format}'}
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
+@web.route('/admin/analytics')
+def admin_analytics():
+    """Воронки услуг и заявки по типам оборудования за период (?since=&until=&flow=) из агрегатов analytics"""
+    require_admin()
+    if not config.ANALYTICS_DB:
+        abort(404)
+    filters = request_filters()
+    conn = analytics.connect(config.ANALYTICS_DB)
+    try:
+        flows = analytics.dashboard(conn, filters['since'], filters['until'], request.args.get('flow'))
+    finally:
+        conn.close()
+    return jsonify(since=filters['since'], until=filters['until'], flows=flows)
+
+@web.route('/admin/broadcasts')
+def admin_broadcasts():
+    """Последние рассылки и их прогресс (сохраненный на последней контрольной точке)"""
+    require_admin()
+    if not config.BROADCAST_DB:
+        abort(404)
+    limit = page_limit(20)
+    conn = broadcast_store.connect(config.BROADCAST_DB)
+    try:
+        items = broadcast_store.recent(conn, limit)
+    finally:
+        conn.close()
+    return jsonify(items=items)
+
 if __name__ == '__main__':
+    # Локальный запуск: встроенный сервер Flask и бот в одном процессе.
+    # В продакшене: gunicorn 'app:create_app()' -c gunicorn.conf.py
     logger.info("Запускаем бота в отдельном потоке...")
-    
-    # Запускаем бота в отдельном потоке
-    bot_thread = threading.Thread(target=run_async_code, daemon=True)
-    bot_thread.start()
-    logger.info("Бот запущен в фоновом режиме")
-    
+    app = create_app()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
     # Запускаем веб-сервер
     port = int(os.environ.get('PORT', 5000))
     logger.info(f"Запускаем веб-сервер на порту {port}")
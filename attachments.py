@@ -0,0 +1,171 @@
+"""Вложения к описанию проблемы: фото, документы и голосовые сообщения.
+
+В сессии хранятся только file_id и метаданные. В каналы вложения пересылаются по
+file_id, без скачивания и повторной загрузки: подряд идущие фото и документы
+собираются в медиагруппы (sendMediaGroup, до 10 файлов), голосовые уходят по одному.
+Альбом пользователя приходит отдельными сообщениями с общим media_group_id и
+уходит в канал одной группой.
+
+Локальный архив (ATTACHMENTS_DIR) необязателен: файл качается потоком кусками по
+CHUNK_SIZE во временный файл рядом с итоговым и переименовывается после загрузки;
+файлы больше max_bytes не качаются, а загрузка обрывается, если сервер отдает больше.
+"""
+import asyncio
+import logging
+import os
+import time
+from urllib.parse import urlparse
+
+from delivery import METHOD_KEY
+
+logger = logging.getLogger(__name__)
+
+# Размер куска при записи в архив, байт
+CHUNK_SIZE = 64 * 1024
+# Ограничение Bot API на медиагруппу
+MEDIA_GROUP_SIZE = 10
+# Виды вложений, которые можно объединить в медиагруппу (смешивать их Telegram не дает)
+GROUPABLE = ('photo', 'document')
+# Расширение файла в архиве, если у вложения нет имени
+EXTENSIONS = {'photo': '.jpg', 'voice': '.ogg', 'document': ''}
+LABELS = {'photo': 'фото', 'document': 'документы', 'voice': 'голосовые'}
+
+
+def from_message(message):
+    """Вложение сообщения как dict (его можно хранить в сессии) или None"""
+    if message.photo:
+        # Telegram присылает несколько размеров фото, последний — самый большой
+        media, kind = message.photo[-1], 'photo'
+    elif message.document is not None:
+        media, kind = message.document, 'document'
+    elif message.voice is not None:
+        media, kind = message.voice, 'voice'
+    else:
+        return None
+    attachment = {'type': kind, 'file_id': media.file_id, 'unique_id': media.file_unique_id}
+    if media.file_size:
+        attachment['size'] = media.file_size
+    if kind == 'document' and message.document.file_name:
+        attachment['name'] = message.document.file_name
+    if message.media_group_id:
+        attachment['group'] = message.media_group_id
+    return attachment
+
+
+def describe(attachments):
+    """Краткий состав вложений для текста заявки: «фото: 3, документы: 1»"""
+    counts = {}
+    for attachment in attachments:
+        counts[attachment['type']] = counts.get(attachment['type'], 0) + 1
+    return ', '.join(f'{LABELS[kind]}: {count}' for kind, count in counts.items())
+
+
+def media_payloads(attachments):
+    """Сообщения для DeliveryQueue, пересылающие вложения по file_id"""
+    payloads = []
+    batch = []
+
+    def flush():
+        if len(batch) == 1:
+            kind, file_id = batch[0]
+            payloads.append({METHOD_KEY: kind, kind: file_id})
+        elif batch:
+            payloads.append({METHOD_KEY: 'media_group',
+                             'media': [{'type': kind, 'media': file_id} for kind, file_id in batch]})
+        batch.clear()
+
+    for attachment in attachments:
+        kind = attachment['type']
+        if batch and (batch[0][0] != kind or len(batch) == MEDIA_GROUP_SIZE):
+            flush()
+        if kind in GROUPABLE:
+            batch.append((kind, attachment['file_id']))
+        else:
+            flush()
+            payloads.append({METHOD_KEY: kind, kind: attachment['file_id']})
+    flush()
+    return payloads
+
+
+class Archiver:
+    """Сохраняет вложения заявок в directory/<дата>/<user_id>_<file_unique_id><расширение>"""
+
+    def __init__(self, directory, max_bytes, timeout=30.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        """httpx-клиент создается при первой загрузке"""
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def archive(self, bot, user_id, attachments):
+        """Сохраняет вложения; возвращает пути сохраненных файлов. Ошибки только логируются"""
+        saved = []
+        folder = os.path.join(self.directory, time.strftime('%Y-%m-%d'))
+        os.makedirs(folder, exist_ok=True)
+        for attachment in attachments:
+            if attachment.get('size', 0) > self.max_bytes:
+                logger.warning(f"Вложение {attachment['unique_id']} больше {self.max_bytes} байт, не сохраняется")
+                continue
+            extension = os.path.splitext(attachment.get('name', ''))[1] or EXTENSIONS[attachment['type']]
+            path = os.path.join(folder, f"{user_id}_{attachment['unique_id']}{extension}")
+            try:
+                file = await bot.get_file(attachment['file_id'])
+                if await self._store(file.file_path, path):
+                    saved.append(path)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить вложение {attachment['unique_id']}: {e}")
+        return saved
+
+    async def _store(self, source, path):
+        """Копирует source (URL или путь локального Bot API) в path кусками; False, если файл больше max_bytes"""
+        partial = path + '.part'
+        written = 0
+        try:
+            with open(partial, 'wb') as out:
+                if urlparse(source).scheme in ('http', 'https'):
+                    async with self.client.stream('GET', source) as response:
+                        response.raise_for_status()
+                        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                            written += len(chunk)
+                            if written > self.max_bytes:
+                                break
+                            out.write(chunk)
+                else:
+                    written = await asyncio.to_thread(self._copy_local, source, out)
+            if written > self.max_bytes:
+                logger.warning(f"Загрузка {os.path.basename(path)} прервана: больше {self.max_bytes} байт")
+                return False
+            os.replace(partial, path)
+            return True
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def _copy_local(self, source, out):
+        written = 0
+        with open(source, 'rb') as src:
+            while chunk := src.read(CHUNK_SIZE):
+                written += len(chunk)
+                if written > self.max_bytes:
+                    break
+                out.write(chunk)
+        return written
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def build_archiver(directory, max_bytes):
+    """Создает Archiver или возвращает None, если архив не включен"""
+    if not directory:
+        return None
+    return Archiver(directory, max_bytes)
@@ -0,0 +1,153 @@
+"""Бенчмарк аналитики диалогов: журнал событий, инкрементальная агрегация и дашборд.
+
+Синтетические диалоги всех услуг (часть бросается на случайном шаге) за --days дней
+пишутся в журнал через EventLog. Замеряются: запись события, первая агрегация всего
+журнала, инкрементальная агрегация после дописанных --tail событий (читается только
+хвост) и ответ dashboard() за весь период и за последние сутки. Для сравнения — тот же
+дашборд, посчитанный просмотром всего журнала. Итоги дашборда сверяются с просмотром.
+
+Запуск: python benchmarks/bench_analytics.py --events 2000000
+В CI: python benchmarks/bench_analytics.py --max-dashboard-ms 50 --max-incremental-ms 500
+(код выхода 1 при превышении или расхождении итогов).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from analytics import Aggregator, EventLog, connect, dashboard  # noqa: E402
+
+STEPS = {
+    'urgent': ['equipment_type', 'equipment_model', 'problem_description', 'phone', 'email', 'inn'],
+    'repair': ['equipment_type', 'equipment_model', 'problem_description', 'phone', 'email', 'inn'],
+    'rental': ['purpose', 'equipment_type', 'equipment_model', 'phone', 'email', 'inn'],
+    'audit': ['phone', 'email', 'inn'],
+}
+EQUIPMENT = ['ИВЛ', 'УЗИ', 'КТ', 'МРТ', 'Рентген', 'Монитор пациента', 'Дефибриллятор', 'Наркозный аппарат']
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def write_dialogs(path, count, clock, rng, step_seconds):
+    """Пишет диалоги в журнал, пока не наберется count событий; возвращает число событий"""
+    events = EventLog(path, clock=clock)
+    written = 0
+    while written < count:
+        flow = rng.choice(tuple(STEPS))
+        names = {state: step for state, step in enumerate(STEPS[flow])}
+        quit_at = rng.randrange(len(names) * 3)
+        state = None
+        for next_state in names:
+            events.transition(flow, names, state, next_state)
+            state = next_state
+            if next_state == quit_at:
+                break
+            clock.now += step_seconds
+        else:
+            events.submit(flow, rng.choice(EQUIPMENT) if flow != 'audit' else '')
+        events.transition(flow, names, state, -1)
+        written = len(events._buffer)
+    asyncio.run(events.flush())
+    return written
+
+
+def scan(path):
+    """Дашборд просмотром всего журнала: шаги и заявки по оборудованию"""
+    steps, submitted = Counter(), Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            _, kind, flow, _, step, value = line.rstrip('\n').split('\t')
+            if kind == 'submit':
+                submitted[flow, value] += 1
+            else:
+                steps[flow, step, kind] += 1
+    return steps, submitted
+
+
+def timed(fn, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=2_000_000, help='событий в журнале')
+    parser.add_argument('--tail', type=int, default=20_000, help='событий, дописанных перед инкрементальной агрегацией')
+    parser.add_argument('--days', type=int, default=90, help='за сколько дней события')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-dashboard-ms', type=float, help='максимум на дашборд за весь период, мс')
+    parser.add_argument('--max-incremental-ms', type=float, help='максимум на агрегацию дописанного хвоста, мс')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    start = 1_700_000_000
+    clock = Clock(start)
+    # Шаги диалогов равномерно распределены по периоду
+    step_seconds = args.days * 86400 / (args.events + args.tail)
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, 'events.log')
+        db_path = os.path.join(tmp, 'analytics.db')
+        written, write_s = timed(lambda: write_dialogs(log_path, args.events, clock, rng, step_seconds))
+        size = os.path.getsize(log_path)
+        aggregator = Aggregator(log_path, db_path)
+        _, full_s = timed(aggregator.run_once)
+        tail = write_dialogs(log_path, args.tail, clock, rng, step_seconds)
+        aggregated, incremental_s = timed(aggregator.run_once)
+        again, _ = timed(aggregator.run_once)
+
+        conn = connect(db_path)
+        flows, dashboard_s = timed(lambda: dashboard(conn), repeat=20)
+        _, day_s = timed(lambda: dashboard(conn, since=clock.now - 86400), repeat=20)
+        rows = sum(conn.execute(f'SELECT COUNT(*) FROM {table}_{period}').fetchone()[0]
+                   for table in ('funnel', 'equipment') for period in ('hourly', 'daily'))
+        conn.close()
+        (steps, submitted), scan_s = timed(lambda: scan(log_path))
+
+    total = written + tail
+    print(f"событий в журнале:           {total} ({size / total:.0f} байт на событие)")
+    print(f"запись события:              {write_s / written * 1e6:.2f} мкс")
+    print(f"первая агрегация:            {full_s:.2f} с ({written / full_s:,.0f} событий/с)")
+    print(f"инкрементальная ({tail}):   {incremental_s * 1000:.0f} мс, повторный запуск прочитал {again} событий")
+    print(f"строк агрегатов:             {rows}")
+    print(f"дашборд за {args.days} дн.:          {dashboard_s * 1000:.2f} мс")
+    print(f"дашборд за сутки:            {day_s * 1000:.2f} мс")
+    print(f"дашборд просмотром журнала:  {scan_s * 1000:.0f} мс")
+
+    failures = []
+    if aggregated != tail or again != 0:
+        failures.append(f"инкрементальная агрегация прочитала {aggregated} событий вместо {tail}, повторная — {again}")
+    for flow, item in flows.items():
+        for entry in item['steps']:
+            expected = steps[flow, entry['step'], 'enter'] + steps[flow, entry['step'], 'next']
+            if entry['reached'] != expected or entry['ended'] != steps[flow, entry['step'], 'end']:
+                failures.append(f"{flow}/{entry['step']}: итоги не совпадают с журналом")
+        if item['submitted'] != sum(count for (name, _), count in submitted.items() if name == flow):
+            failures.append(f"{flow}: заявок не столько, сколько в журнале")
+    if args.max_dashboard_ms is not None and dashboard_s * 1000 > args.max_dashboard_ms:
+        failures.append(f"дашборд {dashboard_s * 1000:.2f} мс > {args.max_dashboard_ms}")
+    if args.max_incremental_ms is not None and incremental_s * 1000 > args.max_incremental_ms:
+        failures.append(f"инкрементальная агрегация {incremental_s * 1000:.0f} мс > {args.max_incremental_ms}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Бенчмарк архива вложений: пиковая память при сохранении большого файла.
+
+Файл отдает фейковый Bot API по HTTP. Сравнивается File.download_to_drive из PTB (файл
+целиком читается в память, затем пишется на диск) с потоковой записью attachments.Archiver
+кусками по CHUNK_SIZE. Заодно считается, сколько вызовов Bot API уходит на пересылку
+альбома в канал по file_id: одна медиагруппа на каждые 10 файлов вместо вызова на файл.
+
+Запуск: python benchmarks/bench_attachments.py --size-mb 20
+В CI: python benchmarks/bench_attachments.py --max-peak-kib 1024 (код выхода 1 при превышении).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Bot  # noqa: E402
+
+from attachments import Archiver, media_payloads  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+
+
+async def peak(coro):
+    """Пиковая память Python-объектов во время выполнения coro, байт, и время, с"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - started
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak_bytes, elapsed
+
+
+async def measure(size, tmp):
+    api = FakeBotAPI().start()
+    api.add_file('big', size)
+    bot = Bot(os.environ['TELEGRAM_BOT_TOKEN'], base_url=f'{api.url}/bot', base_file_url=f'{api.url}/file/bot')
+    archiver = Archiver(os.path.join(tmp, 'archive'), max_bytes=size)
+    try:
+        async with bot:
+            file = await bot.get_file('big')
+            whole = await peak(file.download_to_drive(os.path.join(tmp, 'whole.bin')))
+            # Клиент httpx создается заранее, чтобы не учитывать загрузку TLS-контекста
+            archiver.client
+            attachment = {'type': 'document', 'file_id': 'big', 'unique_id': 'ubig', 'size': size}
+            streamed = await peak(archiver.archive(bot, 1, [attachment]))
+    finally:
+        await archiver.close()
+        api.stop()
+    return whole, streamed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=float, default=20)
+    parser.add_argument('--album', type=int, default=25, help='файлов в альбоме для подсчета вызовов API')
+    parser.add_argument('--max-peak-kib', type=float, help='максимум пиковой памяти потокового сохранения, КиБ')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        (whole_peak, whole_s), (stream_peak, stream_s) = asyncio.run(measure(size, tmp))
+    album = [{'type': 'photo', 'file_id': f'p{n}'} for n in range(args.album)]
+
+    print(f"файл:                  {size / 1024 / 1024:.1f} МиБ")
+    print(f"download_to_drive:     пик {whole_peak / 1024:.0f} КиБ, {whole_s * 1000:.0f} мс")
+    print(f"Archiver (потоком):    пик {stream_peak / 1024:.0f} КиБ, {stream_s * 1000:.0f} мс")
+    print(f"альбом из {args.album} фото:     {len(media_payloads(album))} вызовов API вместо {args.album}")
+    if args.max_peak_kib is not None and stream_peak / 1024 > args.max_peak_kib:
+        print(f"FAIL: пик {stream_peak / 1024:.0f} КиБ > {args.max_peak_kib} КиБ")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
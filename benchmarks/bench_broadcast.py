@@ -0,0 +1,177 @@
+"""Бенчмарк рассылок: темп отправки против лимитов фейкового Bot API и продолжение после остановки.
+
+Фейковый Bot API (FakeBotAPI с global_limit и chat_limit=1) отвечает 429 на каждое сообщение
+сверх --limit в скользящую секунду и 403 на чаты из --blocked доли получателей. Каждый вызов
+стоит --latency-ms. История заявок — --recipients клиентов разных услуг и оборудования.
+Сравниваются:
+  наивная рассылка — send_message всем получателям сразу (asyncio.gather): сколько сообщений
+  отклонено 429 и потеряно;
+  Broadcaster с rate + burst = --limit — рассылка по сегменту, которая на --stop-at доле
+  останавливается (как при перезапуске бота) и продолжается новым Broadcaster с той же базой.
+Проверяется, что ни одного 429 не было, каждый получатель сегмента получил сообщение ровно один
+раз и за любую секунду ушло не больше --limit сообщений; считается загрузка лимита (темп /
+rate). Лимит по умолчанию в 10 раз больше лимита Telegram, чтобы замер шел секунды, а не минуты.
+
+Запуск: python benchmarks/bench_broadcast.py --recipients 3000 --limit 300
+В CI: python benchmarks/bench_broadcast.py --min-utilization 0.9 (код выхода 1 при 429,
+повторах, потерях или недогрузке).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Bot  # noqa: E402
+from telegram.error import RetryAfter, TelegramError  # noqa: E402
+
+import storage  # noqa: E402
+from broadcast import Broadcaster, connect, recent, select_recipients  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest  # noqa: E402
+
+ADMIN_CHAT = 1
+SERVICES = ['urgent', 'repair', 'rental', 'audit']
+EQUIPMENT = ['УЗИ', 'КТ', 'МРТ', 'ИВЛ', 'Рентген']
+
+
+def fill_requests(path, recipients, rng):
+    """История заявок: у каждого клиента 1–3 заявки разных услуг и оборудования"""
+    conn = storage.connect(path)
+    rows = []
+    for chat_id in range(100000, 100000 + recipients):
+        for _ in range(rng.randint(1, 3)):
+            service = rng.choice(SERVICES)
+            rows.append((time.time(), service, chat_id, chat_id, None if service == 'audit' else rng.choice(EQUIPMENT)))
+    with conn:
+        conn.executemany('INSERT INTO requests (created, service_type, user_id, chat_id, equipment_type) '
+                         'VALUES (?, ?, ?, ?, ?)', rows)
+    conn.close()
+
+
+def make_bot(api, latency):
+    return Bot(os.environ['TELEGRAM_BOT_TOKEN'], request=FakeRequest(api, latency))
+
+
+async def naive(chats, limit, latency):
+    """Рассылка без ограничения темпа: все сообщения сразу"""
+    api = FakeBotAPI(global_limit=limit, chat_limit=1)
+    results = Counter()
+
+    async def send(chat_id):
+        try:
+            await bot.send_message(chat_id, 'Новые аппараты в аренду')
+            results['sent'] += 1
+        except RetryAfter:
+            results['retry_after'] += 1
+        except TelegramError:
+            results['failed'] += 1
+
+    async with make_bot(api, latency) as bot:
+        started = time.perf_counter()
+        await asyncio.gather(*(send(chat_id) for chat_id in chats))
+        results['seconds'] = time.perf_counter() - started
+    return results
+
+
+async def wait_done(broadcaster, stop_at=None, total=None, job=None):
+    while broadcaster._tasks:
+        if stop_at is not None and job.sent + job.failed >= stop_at * total:
+            return
+        await asyncio.sleep(0.01)
+
+
+async def managed(args, api, db_path, requests_db, segment):
+    """Рассылка Broadcaster с остановкой на stop_at и продолжением; возвращает (отправлено до остановки, секунды, rate)"""
+    latency = args.latency_ms / 1000
+    burst = max(1, args.limit // 10)
+    settings = dict(rate=args.limit - burst, burst=burst, concurrency=args.concurrency, progress_interval=1.0)
+    async with make_bot(api, latency) as bot:
+        started = time.perf_counter()
+        broadcaster = Broadcaster(db_path, bot, requests_db, **settings).start()
+        job = await broadcaster.create(ADMIN_CHAT, segment, text='Новые аппараты в аренду')
+        progress = await bot.send_message(ADMIN_CHAT, job.progress())
+        broadcaster.launch(job, progress.message_id)
+        await wait_done(broadcaster, args.stop_at, job.total, job)
+        await broadcaster.stop()
+        stopped_at = job.sent + job.failed
+        # Перезапуск: новый Broadcaster продолжает рассылку из базы
+        broadcaster = Broadcaster(db_path, bot, requests_db, **settings).start()
+        await wait_done(broadcaster)
+        elapsed = time.perf_counter() - started
+        await broadcaster.stop()
+    return stopped_at, elapsed, settings['rate']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=3000, help='клиентов в истории заявок')
+    parser.add_argument('--limit', type=int, default=300, help='лимит фейкового API, сообщений в секунду')
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка одного вызова Bot API, мс')
+    parser.add_argument('--blocked', type=float, default=0.02, help='доля получателей, заблокировавших бота')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--stop-at', type=float, default=0.4, help='на какой доле рассылки остановить бота')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-utilization', type=float, help='минимальная загрузка лимита (темп / rate)')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    segment = {'service_type': 'rental'}
+    with tempfile.TemporaryDirectory() as tmp:
+        requests_db = os.path.join(tmp, 'requests.db')
+        db_path = os.path.join(tmp, 'broadcast.db')
+        fill_requests(requests_db, args.recipients, rng)
+        chats = select_recipients(requests_db, **segment)
+        blocked = {str(chat_id) for chat_id in rng.sample(chats, int(len(chats) * args.blocked))}
+
+        baseline = asyncio.run(naive(chats, args.limit, args.latency_ms / 1000))
+        api = FakeBotAPI(global_limit=args.limit, chat_limit=1)
+        api.blocked = blocked
+        stopped_at, elapsed, rate = asyncio.run(managed(args, api, db_path, requests_db, segment))
+        conn = connect(db_path)
+        item = recent(conn, 1)[0]
+        conn.close()
+
+    received = Counter(chat_id for _, chat_id in api.sent if chat_id != str(ADMIN_CHAT))
+    duplicates = sum(count - 1 for count in received.values() if count > 1)
+    missing = len({str(chat_id) for chat_id in chats} - blocked - set(received))
+    throughput = sum(received.values()) / elapsed
+    progress = len([1 for method, params in api.calls if method == 'editMessageText'])
+
+    print(f"получателей сегмента {segment}: {len(chats)}, заблокировали бота: {len(blocked)}")
+    print(f"наивная рассылка:   доставлено {baseline['sent']}, отклонено 429: {baseline['retry_after']}, "
+          f"за {baseline['seconds']:.1f} с")
+    print(f"Broadcaster:        {item['status']}, доставлено {item['sent']}, не доставлено {item['failed']}, "
+          f"остановка после {stopped_at}")
+    print(f"  429 от API:       {api.rejected}")
+    print(f"  повторы / потери: {duplicates} / {missing}")
+    print(f"  максимум за 1 с:  {api.max_per_second()} (лимит {args.limit})")
+    print(f"  темп:             {throughput:.0f} сообщений/с при rate {rate} "
+          f"(загрузка {throughput / rate:.2f}), {elapsed:.1f} с")
+    print(f"  прогресс:         {progress} правок сообщения администратору")
+
+    failures = []
+    if api.rejected:
+        failures.append(f"{api.rejected} ответов 429")
+    if duplicates or missing:
+        failures.append(f"повторов {duplicates}, потерь {missing}")
+    if api.max_per_second() > args.limit:
+        failures.append(f"за секунду {api.max_per_second()} > {args.limit}")
+    if item['status'] != 'done' or item['sent'] + item['failed'] != len(chats):
+        failures.append(f"рассылка не завершена: {item}")
+    if args.min_utilization is not None and throughput / rate < args.min_utilization:
+        failures.append(f"загрузка {throughput / rate:.2f} < {args.min_utilization}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
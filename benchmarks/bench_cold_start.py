@@ -0,0 +1,132 @@
+"""Бенчмарк холодного старта: от запуска процесса до ответа на первый /start.
+
+Запускается настоящий процесс `python app.py` (Flask + поток бота, BOT_MODE=polling)
+против фейкового Bot API, в котором уже лежит обновление с /start. Время считается от
+создания процесса до момента, когда фейковый API получил sendMessage в этот чат.
+Каждый вызов Bot API отвечает с задержкой --latency-ms, как настоящий сервер Telegram.
+
+Запуск: python benchmarks/bench_cold_start.py --runs 5
+Профиль запуска процесса бота (STARTUP_PROFILE=1): python benchmarks/bench_cold_start.py --runs 1 --profile
+В CI: python benchmarks/bench_cold_start.py --runs 5 --max-ms 1500 (код выхода 1 при превышении).
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI, make_text_update  # noqa: E402
+
+USER_ID = 424242
+
+
+class SlowBotAPI(FakeBotAPI):
+    """Фейковый Bot API с сетевой задержкой каждого ответа"""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    def handle(self, method, params):
+        time.sleep(self.latency)
+        return super().handle(method, params)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def answered(api):
+    return any(str(params.get('chat_id')) == str(USER_ID) for params in api.calls_of('sendMessage'))
+
+
+def cold_start(tmp, latency, profile, timeout=60):
+    """Один запуск app.py; возвращает секунды до первого ответа"""
+    api = SlowBotAPI(latency).start()
+    api.push_update(make_text_update(1, USER_ID, '/start'))
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN='123:fake',
+        BOT_API_URL=api.url,
+        BOT_MODE='polling',
+        PORT=str(free_port()),
+        PERSISTENCE_URL='',
+        LEADER_LOCK=os.path.join(tmp, 'bot.lock'),
+        BOT_INBOX=os.path.join(tmp, 'inbox.db'),
+        DELIVERY_SPOOL=os.path.join(tmp, 'outbox.db'),
+        REQUESTS_DB=os.path.join(tmp, 'requests.db'),
+        SLA_DB=os.path.join(tmp, 'sla.db'),
+        EVENTS_LOG=os.path.join(tmp, 'events.log'),
+        ANALYTICS_DB=os.path.join(tmp, 'analytics.db'),
+        BROADCAST_DB=os.path.join(tmp, 'broadcast.db'),
+        DELIVERY_DRAIN_TIMEOUT='0.1',
+        STARTUP_PROFILE='1' if profile else '',
+    )
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'app.py')], env=env, cwd=tmp,
+        stdout=subprocess.DEVNULL, stderr=None if profile else subprocess.DEVNULL
+    )
+    try:
+        while not answered(api):
+            if process.poll() is not None:
+                raise RuntimeError(f'app.py завершился с кодом {process.returncode} до ответа')
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f'нет ответа на /start за {timeout} с')
+            time.sleep(0.002)
+        return time.perf_counter() - started
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка ответа Bot API, мс')
+    parser.add_argument('--profile', action='store_true', help='вывести профиль запуска процесса бота')
+    parser.add_argument('--max-ms', type=float, help='максимальная медиана до первого ответа, мс')
+    parser.add_argument('--json', help='записать результаты в файл')
+    args = parser.parse_args()
+
+    times = []
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            elapsed = cold_start(tmp, args.latency_ms / 1000, args.profile)
+        times.append(elapsed * 1000)
+        print(f"запуск {run + 1}: {times[-1]:.0f} мс")
+    result = {
+        'runs': args.runs,
+        'latency_ms': args.latency_ms,
+        'min_ms': min(times),
+        'median_ms': statistics.median(times),
+        'max_ms': max(times),
+    }
+    print(f"до первого ответа на /start: мин {result['min_ms']:.0f} / медиана {result['median_ms']:.0f} / "
+          f"макс {result['max_ms']:.0f} мс (задержка Bot API {args.latency_ms:g} мс)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.max_ms is not None and result['median_ms'] > args.max_ms:
+        print(f"FAIL: медиана {result['median_ms']:.0f} мс > {args.max_ms:g} мс")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Бенчмарк: последовательная и параллельная обработка обновлений при медленных ответах.
+
+Часть пользователей получает ответы Bot API с большой задержкой (slow_delay), остальные —
+быстро. Обновления идут через update_queue и ChatOrderedProcessor, как в боте; сравнивается
+UPDATE_WORKERS=1 (по сути последовательная обработка) и заданный размер пула. Проверяется,
+что все заявки приняты, т.е. порядок сообщений каждого пользователя не нарушен.
+
+Запуск: python benchmarks/bench_concurrency.py --users 300 --workers 16
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Update  # noqa: E402
+
+import config  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest, make_text_update  # noqa: E402
+from main import build_application, start_application, stop_application  # noqa: E402
+
+FLOW = ['/start', '🔧 РЕМОНТ', 'КТ', 'Model-{user}', 'Не включается', '+7999{user:07d}', 'user{user}@clinic.example', 'Пропустить']
+
+
+class SlowRequest(FakeRequest):
+    """Фейковый Bot API с сетевой задержкой: fast_delay для всех, slow_delay для slow_chats"""
+
+    def __init__(self, api, slow_chats, fast_delay, slow_delay):
+        super().__init__(api)
+        self.slow_chats = slow_chats
+        self.fast_delay = fast_delay
+        self.slow_delay = slow_delay
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        chat_id = request_data.json_parameters.get('chat_id') if request_data is not None else None
+        slow = chat_id is not None and int(chat_id) in self.slow_chats
+        await asyncio.sleep(self.slow_delay if slow else self.fast_delay)
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+async def run(users, workers, slow_share, fast_delay, slow_delay, tmp):
+    config.PERSISTENCE_URL = ''
+    config.DELIVERY_SPOOL = os.path.join(tmp, f'outbox-{workers}.db')
+    config.REQUESTS_DB = os.path.join(tmp, f'requests-{workers}.db')
+    config.SLA_DB = os.path.join(tmp, f'sla-{workers}.db')
+    config.EVENTS_LOG = os.path.join(tmp, f'events-{workers}.log')
+    config.ANALYTICS_DB = os.path.join(tmp, f'analytics-{workers}.db')
+    config.BROADCAST_DB = os.path.join(tmp, f'broadcast-{workers}.db')
+    config.DELIVERY_DRAIN_TIMEOUT = 0.1
+    config.UPDATE_WORKERS = workers
+    user_ids = [200000 + n for n in range(users)]
+    slow_chats = set(user_ids[:int(users * slow_share)])
+    api = FakeBotAPI()
+    application = build_application(request=SlowRequest(api, slow_chats, fast_delay, slow_delay))
+    # Сообщения пользователей чередуются, как в реальном потоке обновлений
+    updates = [
+        make_text_update(step * users + n + 1, user_id, text.format(user=user_id))
+        for step, text in enumerate(FLOW)
+        for n, user_id in enumerate(user_ids)
+    ]
+    async with application:
+        await start_application(application)
+        started = time.perf_counter()
+        for data in updates:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        await application.update_queue.join()
+        await application.update_processor.join()
+        elapsed = time.perf_counter() - started
+        await stop_application(application)
+    accepted = sum(1 for params in api.calls_of('sendMessage') if str(params.get('text', '')).startswith('✅'))
+    return len(updates) / elapsed, accepted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--slow-share', type=float, default=0.1, help='доля пользователей с медленными ответами')
+    parser.add_argument('--fast-delay', type=float, default=0.002)
+    parser.add_argument('--slow-delay', type=float, default=0.2)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {
+            workers: asyncio.run(run(args.users, workers, args.slow_share, args.fast_delay, args.slow_delay, tmp))
+            for workers in (1, args.workers)
+        }
+    baseline = results[1][0]
+    for workers, (rps, accepted) in results.items():
+        print(f'workers={workers:<4} {rps:8.0f} обновлений/с ({rps / baseline:.1f}x), '
+              f'принято заявок {accepted} из {args.users}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Бенчмарк распознавания оборудования на большом синтетическом каталоге синонимов.
+
+Сравнивает прежний линейный поиск подстрок по всем синонимам с EquipmentMatcher
+(без кэша и с LRU). Перед замером проверяет распознавание на рабочем каталоге
+(EQUIPMENT_CATALOG) по списку REGRESSIONS: опечатки в коротких названиях и ложные
+совпадения с обычными словами; при расхождении код выхода 1.
+Запуск: python benchmarks/bench_equipment.py --synonyms 20000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from equipment import EquipmentMatcher  # noqa: E402
+
+ALPHABET = 'абвгдежзиклмнопрстуфхцчшщэюя'
+# Ввод → ожидаемый тип по рабочему каталогу
+REGRESSIONS = [
+    ('УЗИ', 'узи'),
+    ('узм', 'узи'),
+    ('ивл', 'ивл'),
+    ('ива', None),
+    ('аппарат ива', None),
+    ('у з и', 'узи'),
+]
+
+
+def random_word(rng):
+    return ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 12)))
+
+
+def make_catalog(rng, synonyms, per_type=20):
+    return {f'тип{i}': [random_word(rng) for _ in range(per_type)] for i in range(synonyms // per_type)}
+
+
+def make_inputs(rng, catalog, count):
+    words = [word for variants in catalog.values() for word in variants]
+    inputs = []
+    for _ in range(count):
+        kind = rng.random()
+        word = rng.choice(words)
+        if kind < 0.5:
+            inputs.append(f'аппарат {word} модель')
+        elif kind < 0.8:
+            i = rng.randrange(len(word))
+            inputs.append(word[:i] + rng.choice(ALPHABET) + word[i + 1:])
+        else:
+            inputs.append(random_word(rng))
+    return inputs
+
+
+def linear_scan(catalog, user_input):
+    """Прежний алгоритм check_equipment_type"""
+    user_input = user_input.lower().strip()
+    for main_type, variants in catalog.items():
+        if any(variant in user_input for variant in variants):
+            return main_type
+    return None
+
+
+def timed(func, inputs):
+    started = time.perf_counter()
+    for text in inputs:
+        func(text)
+    return (time.perf_counter() - started) / len(inputs)
+
+
+def check_regressions():
+    """Список расхождений с REGRESSIONS на рабочем каталоге"""
+    matcher = EquipmentMatcher(config.EQUIPMENT_CATALOG, check_interval=3600)
+    return [(text, expected, matcher.match(text)) for text, expected in REGRESSIONS
+            if matcher.match(text) != expected]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--synonyms', type=int, default=20000)
+    parser.add_argument('--inputs', type=int, default=2000)
+    args = parser.parse_args()
+    mismatches = check_regressions()
+    for text, expected, got in mismatches:
+        print(f'FAIL: {text!r} → {got!r}, ожидалось {expected!r}')
+    if mismatches:
+        sys.exit(1)
+    print(f'рабочий каталог: {len(REGRESSIONS)} проверок распознавания пройдено')
+    rng = random.Random(42)
+    catalog = make_catalog(rng, args.synonyms)
+    inputs = make_inputs(rng, catalog, args.inputs)
+    # Повторяющийся поток: те же вводы встречаются снова, как у реальных пользователей
+    repeated = inputs * 5
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False)
+    try:
+        started = time.perf_counter()
+        uncached = EquipmentMatcher(f.name, check_interval=3600, cache_size=0)
+        build = time.perf_counter() - started
+        cached = EquipmentMatcher(f.name, check_interval=3600)
+
+        results = [
+            ('линейный поиск', timed(lambda text: linear_scan(catalog, text), inputs)),
+            ('автомат', timed(uncached.match, inputs)),
+            ('автомат + LRU', timed(cached.match, repeated)),
+        ]
+    finally:
+        os.unlink(f.name)
+
+    print(f'синонимов: {args.synonyms}, сборка каталога: {build:.2f} с')
+    for name, per_input in results:
+        print(f'{name:16} {per_input * 1e6:10.1f} мкс/ввод')
+    hits = sum(uncached.match(text) is not None for text in inputs)
+    print(f'распознано (с опечатками): {hits}/{len(inputs)}, '
+          f'линейным поиском: {sum(linear_scan(catalog, text) is not None for text in inputs)}/{len(inputs)}')
+
+
+if __name__ == '__main__':
+    main()
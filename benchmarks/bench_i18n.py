@@ -0,0 +1,105 @@
+"""Микробенчмарк локализации: разбор нажатия и сборка текстов.
+
+Сравнивается:
+- поиск кнопки по надписи: перебор надписей каталога против обратного индекса Catalog.actions;
+- текст заявки для канала: string.Formatter с подстановкой значений по умолчанию (как было
+  до i18n.Template) против шаблона, разобранного один раз.
+Заодно проверяется, что во всех каталогах есть все тексты и кнопки основного языка.
+
+Запуск: python benchmarks/bench_i18n.py --iterations 200000
+В CI: python benchmarks/bench_i18n.py --strict (код выхода 1, если переводов не хватает)
+"""
+import argparse
+import json
+import logging
+import os
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+import config  # noqa: E402
+import i18n  # noqa: E402
+from main import REQUEST_DEFAULTS, URGENT_FLOW  # noqa: E402
+
+SOURCE = URGENT_FLOW.request_template.source
+FIELDS = {
+    'username': 'user1', 'first_name': 'User', 'equipment_type': 'УЗИ', 'equipment_model': 'Model-1',
+    'problem_description': None, 'phone': '+79991234567', 'email': None, 'inn': '7707083893',
+    'time': '2026-10-19 09:00',
+}
+
+
+class Formatter(string.Formatter):
+    """Прежний способ: шаблон разбирается при каждом вызове"""
+
+    def get_value(self, key, args, kwargs):
+        value = kwargs.get(key)
+        return REQUEST_DEFAULTS.get(key, 'Не указано') if value is None else value
+
+    def convert_field(self, value, conversion):
+        if conversion == 'u':
+            return str(value).upper()
+        return super().convert_field(value, conversion)
+
+
+def scan(catalog, label):
+    for button_id, text in catalog.buttons.items():
+        if text == label:
+            return button_id
+    return None
+
+
+def timed(func, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--strict', action='store_true', help='ошибка, если в каталоге нет переводов')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    catalogs = i18n.catalogs()
+    catalog = catalogs['en']
+    # Надпись из последнего ряда клавиатуры — худший случай для перебора
+    label = catalog.label('purpose_replacement')
+    formatter = Formatter()
+    template = URGENT_FLOW.request_template
+    assert formatter.vformat(SOURCE, (), FIELDS) == template.render(FIELDS)
+
+    scan_us = timed(lambda: scan(catalog, label), args.iterations)
+    index_us = timed(lambda: catalog.action(label), args.iterations)
+    format_us = timed(lambda: formatter.vformat(SOURCE, (), FIELDS), args.iterations // 10)
+    template_us = timed(lambda: template.render(FIELDS), args.iterations // 10)
+
+    print(f"кнопка: перебор        {scan_us:.3f} мкс")
+    print(f"кнопка: индекс         {index_us:.3f} мкс (x{scan_us / index_us:.0f})")
+    print(f"заявка: Formatter      {format_us:.2f} мкс")
+    print(f"заявка: Template       {template_us:.2f} мкс (x{format_us / template_us:.1f})")
+
+    # Каталоги подставляют недостающее из основного языка, поэтому ключи сверяются по самим файлам
+    files = {}
+    for locale in catalogs:
+        with open(os.path.join(config.LOCALES_DIR, f'{locale}.json'), encoding='utf-8') as f:
+            files[locale] = json.load(f)
+    failures = []
+    for locale, data in files.items():
+        missing = sorted((files[i18n.DEFAULT_LOCALE]['texts'].keys() - data['texts'].keys())
+                         | (files[i18n.DEFAULT_LOCALE]['buttons'].keys() - data['buttons'].keys()))
+        print(f"{locale}: текстов {len(data['texts'])}, кнопок {len(data['buttons'])}, без перевода {len(missing)}")
+        if missing:
+            failures.append(f"{locale}: нет перевода {', '.join(missing)}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if args.strict and failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Бенчмарк интерфейсов: вызовы Bot API и ожидание пользователя на одну заявку в режимах reply и inline.
+
+Одни и те же пользователи (--seed) оформляют заявки всех услуг в обоих режимах
+(UI_MODE, см. inline.py), часть из них ошибается в телефоне или ИНН (--error-rate) и
+исправляет ошибку. Используется настоящий Application с фейковым Bot API (FakeRequest),
+каждый вызов которого стоит --latency-ms. Считаются только вызовы в чат пользователя
+(отправка заявок в каналы одинакова в обоих режимах): всего и по методам на одну
+принятую заявку, действия пользователя (сообщения и нажатия) и суммарное время, которое
+пользователь ждет ответов бота.
+
+Запуск: python benchmarks/bench_inline.py --users 200
+В CI: python benchmarks/bench_inline.py --max-inline-calls 7 (код выхода 1 при превышении,
+если не все заявки приняты или инлайн-режим не экономит вызовы).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Update  # noqa: E402
+
+import config  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest, make_callback_update, make_text_update  # noqa: E402
+from main import AUDIT_FLOW, RENTAL_FLOW, REPAIR_FLOW, URGENT_FLOW, build_application, start_application, stop_application  # noqa: E402
+
+FLOWS = {flow.name: flow for flow in (URGENT_FLOW, REPAIR_FLOW, RENTAL_FLOW, AUDIT_FLOW)}
+# Вариант выбора каждой услуги: id кнопки и надпись
+CHOICES = {'urgent': ('ultrasound', 'УЗИ'), 'repair': ('ct', 'КТ'), 'rental': ('purpose_license', 'Для лицензии')}
+VALID_INNS = ['7707083893', '500100732259', None]
+
+
+def make_answers(rng, user_id, error_rate):
+    """Ответы пользователя: услуга, поля (первая попытка и исправление) и ошибся ли он"""
+    flow = rng.choice(tuple(FLOWS))
+    fields = []
+    if flow == 'rental':
+        fields.append(('equipment_type', 'УЗИ', None))
+    if flow != 'audit':
+        fields.append(('equipment_model', f'Model-{user_id}', None))
+    if flow in ('urgent', 'repair'):
+        fields.append(('problem_description', 'Не включается', None))
+    phone = f'+7 999 {user_id % 10000000:07d}'
+    fields.append(('phone', '12345', phone) if rng.random() < error_rate else ('phone', phone, None))
+    fields.append(('email', f'user{user_id}@clinic.example', None))
+    inn = rng.choice(VALID_INNS)
+    fields.append(('inn', '1234567890', inn or 'Пропустить') if rng.random() < error_rate else ('inn', inn, None))
+    return flow, fields
+
+
+def reply_script(flow, fields):
+    script = [('text', '/start'), ('text', FLOWS[flow].label)]
+    if flow in CHOICES:
+        script.append(('text', CHOICES[flow][1]))
+    for _, first, fixed in fields:
+        script.append(('text', first or 'Пропустить'))
+        if fixed is not None:
+            script.append(('text', fixed))
+    return script
+
+
+def inline_script(flow, fields):
+    script = [('text', '/start'), ('tap', f'svc:{flow}')]
+    if flow in CHOICES:
+        script.append(('tap', f'opt:0:{CHOICES[flow][0]}'))
+    # Необязательный ИНН в конце формы можно не указывать
+    lines = [first for _, first, _ in fields if first is not None]
+    script.append(('text', '\n'.join(lines)))
+    fixes = [fixed for _, _, fixed in fields if fixed is not None]
+    if fixes:
+        script.append(('text', '\n'.join(fixes)))
+    return script
+
+
+class Simulation:
+    def __init__(self, mode, scripts, latency, tmp):
+        config.UI_MODE = mode
+        config.PERSISTENCE_URL = ''
+        config.DELIVERY_SPOOL = os.path.join(tmp, f'outbox-{mode}.db')
+        config.REQUESTS_DB = os.path.join(tmp, f'requests-{mode}.db')
+        config.SLA_DB = os.path.join(tmp, f'sla-{mode}.db')
+        config.EVENTS_LOG = os.path.join(tmp, f'events-{mode}.log')
+        config.ANALYTICS_DB = os.path.join(tmp, f'analytics-{mode}.db')
+        config.BROADCAST_DB = os.path.join(tmp, f'broadcast-{mode}.db')
+        config.DELIVERY_DRAIN_TIMEOUT = 0.1
+        self.api = FakeBotAPI()
+        self.application = build_application(request=FakeRequest(self.api, latency))
+        self.scripts = scripts
+        self.waited = 0.0
+        self.actions = 0
+        self._update_ids = iter(range(1, 10 ** 9))
+
+    async def act(self, user_id, kind, data):
+        if kind == 'tap':
+            raw = make_callback_update(next(self._update_ids), user_id, data, self.api.last_message[user_id])
+        else:
+            raw = make_text_update(next(self._update_ids), user_id, data)
+        started = time.perf_counter()
+        await self.application.process_update(Update.de_json(raw, self.application.bot))
+        self.waited += time.perf_counter() - started
+        self.actions += 1
+
+    async def walk(self, user_id, script):
+        for kind, data in script:
+            await self.act(user_id, kind, data)
+
+    async def run(self):
+        async with self.application:
+            await start_application(self.application)
+            await asyncio.gather(*(self.walk(user_id, script) for user_id, script in self.scripts.items()))
+            await stop_application(self.application)
+
+    def user_calls(self):
+        """Вызовы Bot API в чаты пользователей (без getMe и отправки заявок в каналы)"""
+        return Counter(method for method, params in self.api.calls
+                       if method != 'getMe' and not str(params.get('chat_id', '')).startswith('-'))
+
+    def accepted(self):
+        return sum(1 for method, params in self.api.calls
+                   if method in ('sendMessage', 'editMessageText') and str(params.get('text', '')).startswith('✅ <b>'))
+
+
+def measure(mode, answers, latency, tmp):
+    make_script = inline_script if mode == 'inline' else reply_script
+    sim = Simulation(mode, {user_id: make_script(*answer) for user_id, answer in answers.items()}, latency, tmp)
+    asyncio.run(sim.run())
+    accepted = sim.accepted()
+    calls = sim.user_calls()
+    per_request = max(accepted, 1)
+    return {
+        'accepted': accepted,
+        'calls': sum(calls.values()) / per_request,
+        'methods': {method: count / per_request for method, count in sorted(calls.items())},
+        'actions': sim.actions / per_request,
+        'waited_ms': sim.waited / per_request * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.2, help='доля ошибок в телефоне и ИНН')
+    parser.add_argument('--latency-ms', type=float, default=50, help='задержка одного вызова Bot API, мс')
+    parser.add_argument('--max-inline-calls', type=float, help='максимум вызовов Bot API на заявку в инлайн-режиме')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    answers = {100000 + n: make_answers(rng, 100000 + n, args.error_rate) for n in range(args.users)}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('reply', 'inline'):
+            results[mode] = measure(mode, answers, args.latency_ms / 1000, tmp)
+
+    for mode, result in results.items():
+        methods = ', '.join(f'{method} {count:.2f}' for method, count in result['methods'].items())
+        print(f"{mode}:")
+        print(f"  принято заявок:        {result['accepted']} из {args.users}")
+        print(f"  вызовов API на заявку: {result['calls']:.2f} ({methods})")
+        print(f"  действий пользователя: {result['actions']:.2f}")
+        print(f"  ожидание ответов:      {result['waited_ms']:.0f} мс на заявку")
+    reply, inline = results['reply'], results['inline']
+    print(f"инлайн-режим: вызовов в {reply['calls'] / inline['calls']:.2f} раза меньше, "
+          f"ожидание в {reply['waited_ms'] / inline['waited_ms']:.2f} раза меньше")
+
+    failures = []
+    for mode, result in results.items():
+        if result['accepted'] != args.users:
+            failures.append(f"{mode}: приняты не все заявки: {result['accepted']} из {args.users}")
+    if inline['calls'] >= reply['calls']:
+        failures.append(f"инлайн-режим не экономит вызовы: {inline['calls']:.2f} >= {reply['calls']:.2f}")
+    if args.max_inline_calls is not None and inline['calls'] > args.max_inline_calls:
+        failures.append(f"вызовов на заявку в инлайн-режиме {inline['calls']:.2f} > {args.max_inline_calls}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
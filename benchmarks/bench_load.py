@@ -0,0 +1,204 @@
+"""Нагрузочный тест: тысячи пользователей одновременно проходят диалоги всех услуг.
+
+Используется настоящий Application из main.build_application с фейковым Bot API
+(FakeRequest, без сети). Сценарии случайны, но воспроизводимы (--seed): выбор услуги,
+кнопки «Назад», неверные телефоны и ИНН с повторным вводом. Выводятся пропускная
+способность, задержка обработки одного обновления (p50/p99) и память на один
+незавершенный диалог.
+
+Запуск: python benchmarks/bench_load.py --users 2000
+В CI: python benchmarks/bench_load.py --users 1000 --min-rps 500 --max-p99-ms 50 --max-kib 20
+(код выхода 1, если пороги не выполнены или не все заявки приняты).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Update  # noqa: E402
+
+import config  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest, make_text_update  # noqa: E402
+from main import AUDIT_FLOW, RENTAL_FLOW, REPAIR_FLOW, URGENT_FLOW, build_application, start_application, stop_application  # noqa: E402
+
+BACK = 'Назад'
+INVALID_INNS = ['1234567890', '123', '7707083894', 'ИНН нет']
+VALID_INNS = ['7707083893', '500100732259', 'Пропустить']
+
+
+def contacts(rng, user_id):
+    script = []
+    if rng.random() < 0.1:
+        script.append('12345')
+    script.append(f'+7 999 {user_id % 10000000:07d}')
+    script.append(f'user{user_id}@clinic.example')
+    if rng.random() < 0.3:
+        script.append(rng.choice(INVALID_INNS))
+    script.append(rng.choice(VALID_INNS))
+    return script
+
+
+def with_back(rng, first, second):
+    """Ответ на шаг first, затем иногда «Назад» и повтор first перед шагом second"""
+    if rng.random() < 0.2:
+        return [first, BACK, first, second]
+    return [first, second]
+
+
+def make_script(rng, user_id):
+    """Сообщения одного пользователя от /start до отправки заявки"""
+    flow = rng.choice(('urgent', 'repair', 'rental', 'audit'))
+    model = f'Model-{user_id}'
+    if flow == 'urgent':
+        script = ['/start', URGENT_FLOW.label, rng.choice(['УЗИ', 'ИВЛ', 'Эндоскопия', 'НДА', 'аппарат узи'])]
+        script += with_back(rng, model, 'Не включается')
+    elif flow == 'repair':
+        script = ['/start', REPAIR_FLOW.label, rng.choice(['КТ', 'МРТ', 'Рентген', 'УЗИ', 'Другое оборудование'])]
+        script += with_back(rng, model, 'Ошибка при запуске')
+    elif flow == 'rental':
+        script = ['/start', RENTAL_FLOW.label, rng.choice(['Для лицензии', 'Временная подмена'])]
+        script += with_back(rng, 'УЗИ', model)
+    else:
+        script = ['/start', AUDIT_FLOW.label]
+    if rng.random() < 0.1:
+        # Ушел в меню с первого шага и вернулся
+        script[2:2] = [BACK, script[1]]
+    return script + contacts(rng, user_id)
+
+
+class Simulation:
+    def __init__(self, users, seed, tmp):
+        config.PERSISTENCE_URL = ''
+        config.DELIVERY_SPOOL = os.path.join(tmp, 'outbox.db')
+        config.REQUESTS_DB = os.path.join(tmp, 'requests.db')
+        config.SLA_DB = os.path.join(tmp, 'sla.db')
+        config.EVENTS_LOG = os.path.join(tmp, 'events.log')
+        config.ANALYTICS_DB = os.path.join(tmp, 'analytics.db')
+        config.BROADCAST_DB = os.path.join(tmp, 'broadcast.db')
+        config.DELIVERY_DRAIN_TIMEOUT = 0.1
+        self.api = FakeBotAPI()
+        self.application = build_application(request=FakeRequest(self.api))
+        rng = random.Random(seed)
+        self.scripts = {100000 + n: make_script(rng, 100000 + n) for n in range(users)}
+        self.latencies = []
+        self._update_ids = iter(range(1, 10 ** 9))
+
+    async def send(self, user_id, text):
+        update = Update.de_json(make_text_update(next(self._update_ids), user_id, text), self.application.bot)
+        started = time.perf_counter()
+        await self.application.process_update(update)
+        self.latencies.append(time.perf_counter() - started)
+
+    async def walk(self, user_id, messages):
+        for text in messages:
+            await self.send(user_id, text)
+            # Даем поработать другим пользователям, как при реальном чередовании обновлений
+            await asyncio.sleep(0)
+
+    async def run_all(self, part=None):
+        """Все пользователи параллельно; part — доля сценария (для замера памяти)"""
+        await asyncio.gather(*(
+            self.walk(user_id, script if part is None else script[:max(2, int(len(script) * part))])
+            for user_id, script in self.scripts.items()
+        ))
+
+    def accepted(self):
+        return sum(1 for params in self.api.calls_of('sendMessage')
+                   if str(params.get('text', '')).startswith('✅'))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def measure_throughput(users, seed, tmp):
+    sim = Simulation(users, seed, tmp)
+    async with sim.application:
+        await start_application(sim.application)
+        started = time.perf_counter()
+        await sim.run_all()
+        elapsed = time.perf_counter() - started
+        await stop_application(sim.application)
+    return {
+        'users': users,
+        'updates': len(sim.latencies),
+        'seconds': elapsed,
+        'rps': len(sim.latencies) / elapsed,
+        'p50_ms': percentile(sim.latencies, 0.5) * 1000,
+        'p99_ms': percentile(sim.latencies, 0.99) * 1000,
+        'accepted': sim.accepted(),
+    }
+
+
+async def measure_memory(users, seed, tmp):
+    """Прирост памяти, пока все пользователи стоят посреди диалога, в КиБ на пользователя"""
+    sim = Simulation(users, seed, tmp)
+    async with sim.application:
+        await start_application(sim.application)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        await sim.run_all(part=0.5)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        # Журнал вызовов фейкового API и замеры задержек — не память бота
+        sim.api.calls.clear()
+        sim.latencies.clear()
+        growth = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                     if not stat.traceback[0].filename.endswith(('fake_bot_api.py', 'bench_load.py')))
+        await stop_application(sim.application)
+    return growth / users / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--min-rps', type=float, help='минимальная пропускная способность, обновлений/с')
+    parser.add_argument('--max-p99-ms', type=float, help='максимальная задержка p99, мс')
+    parser.add_argument('--max-kib', type=float, help='максимум памяти на незавершенный диалог, КиБ')
+    parser.add_argument('--json', help='записать результаты в файл')
+    args = parser.parse_args()
+    # Журнал каждой заявки на тысячах пользователей искажает замер
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(measure_throughput(args.users, args.seed, tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        result['kib_per_conversation'] = asyncio.run(measure_memory(args.users, args.seed, tmp))
+
+    print(f"пользователей:        {result['users']}")
+    print(f"обновлений:           {result['updates']} за {result['seconds']:.2f} с")
+    print(f"пропускная способность: {result['rps']:.0f} обновлений/с")
+    print(f"задержка p50 / p99:   {result['p50_ms']:.2f} / {result['p99_ms']:.2f} мс")
+    print(f"память на диалог:     {result['kib_per_conversation']:.1f} КиБ")
+    print(f"принято заявок:       {result['accepted']} из {result['users']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    failures = []
+    if result['accepted'] != result['users']:
+        failures.append(f"приняты не все заявки: {result['accepted']} из {result['users']}")
+    if args.min_rps is not None and result['rps'] < args.min_rps:
+        failures.append(f"пропускная способность {result['rps']:.0f} < {args.min_rps:.0f}")
+    if args.max_p99_ms is not None and result['p99_ms'] > args.max_p99_ms:
+        failures.append(f"p99 {result['p99_ms']:.2f} мс > {args.max_p99_ms} мс")
+    if args.max_kib is not None and result['kib_per_conversation'] > args.max_kib:
+        failures.append(f"память {result['kib_per_conversation']:.1f} КиБ > {args.max_kib} КиБ")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
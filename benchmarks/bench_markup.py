@@ -0,0 +1,71 @@
+"""Микробенчмарк: сборка клавиатур на каждый ответ против общих экземпляров из ui.
+
+Повторяет последовательность ответов бота на полный проход срочной заявки и
+сериализует reply_markup так же, как это делает Bot API-клиент перед отправкой.
+
+Запуск: python benchmarks/bench_markup.py --updates 100000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import ReplyKeyboardMarkup  # noqa: E402
+from telegram.request._requestparameter import RequestParameter  # noqa: E402
+
+import ui  # noqa: E402
+
+# Клавиатуры ответов на проход /start → срочная подмена → ... → ИНН
+REPLAY = [('main_menu', True), ('urgent_type', True), ('back_only', False), ('back_only', False),
+          ('back_only', False), ('back_only', False), ('skip', False)]
+
+
+def fresh(keyboard_id, resize):
+    return ReplyKeyboardMarkup(ui.keyboard(keyboard_id), one_time_keyboard=True, resize_keyboard=resize)
+
+
+def cached(keyboard_id, resize):
+    return ui.markup(keyboard_id, resize)
+
+
+def replay(factory, updates, keep=None):
+    for i in range(updates):
+        keyboard_id, resize = REPLAY[i % len(REPLAY)]
+        reply_markup = factory(keyboard_id, resize)
+        payload = RequestParameter.from_input('reply_markup', reply_markup).json_value
+        if keep is not None:
+            keep.append((reply_markup, payload))
+
+
+def measure(factory, updates):
+    started = time.perf_counter()
+    replay(factory, updates)
+    elapsed = time.perf_counter() - started
+
+    # Память: объекты ответов удерживаются, чтобы учесть все выделения на обновление
+    sample = min(updates, 10000)
+    kept = []
+    tracemalloc.start()
+    replay(factory, sample, kept)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed / updates, allocated / sample
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=100000)
+    args = parser.parse_args()
+    ui.prebuild()
+
+    results = {name: measure(factory, args.updates) for name, factory in (('каждый раз', fresh), ('кэш ui', cached))}
+    for name, (per_update, allocated) in results.items():
+        print(f'{name:12} {per_update * 1e6:8.2f} мкс/ответ  {allocated:8.0f} байт/ответ')
+    (fresh_time, fresh_bytes), (cached_time, cached_bytes) = results.values()
+    print(f'экономия CPU: x{fresh_time / cached_time:.1f}, памяти: {fresh_bytes - cached_bytes:.0f} байт/ответ')
+
+if __name__ == '__main__':
+    main()
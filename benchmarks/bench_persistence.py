@@ -0,0 +1,74 @@
+"""Бенчмарк: обновлений в секунду с включенным и выключенным хранением состояний.
+
+Каждый пользователь проходит срочную подмену со своими телефоном и моделью, чтобы заявки
+не отсеивались как повторные (dedup) и замер шел по полному пути отправки. Каждый прогон
+работает со своим временным каталогом: очередь доставки, заявки и SLA не переходят
+из одного прогона в другой.
+
+Запуск: python benchmarks/bench_persistence.py --users 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Update  # noqa: E402
+
+import config  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest, make_text_update  # noqa: E402
+from main import build_application, start_application, stop_application  # noqa: E402
+from persistence import build_persistence  # noqa: E402
+
+def urgent_flow(user):
+    """Тексты срочной подмены от пользователя user с уникальными телефоном и моделью"""
+    return ['/start', '⚡️ СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ', 'УЗИ', f'Mindray DC-{user}', 'Не включается',
+            f'+7999{user:07d}', 'clinic@example.ru', 'Пропустить']
+
+
+async def run(users, persistence_url, tmp):
+    config.PERSISTENCE_URL = ''
+    config.DELIVERY_SPOOL = os.path.join(tmp, 'outbox.db')
+    config.REQUESTS_DB = os.path.join(tmp, 'requests.db')
+    config.SLA_DB = os.path.join(tmp, 'sla.db')
+    config.EVENTS_LOG = os.path.join(tmp, 'events.log')
+    config.ANALYTICS_DB = os.path.join(tmp, 'analytics.db')
+    config.BROADCAST_DB = os.path.join(tmp, 'broadcast.db')
+    persistence = build_persistence(persistence_url, update_interval=1, debounce=0.2)
+    application = build_application(persistence=persistence, request=FakeRequest(FakeBotAPI()))
+    flows = [urgent_flow(user) for user in range(users)]
+    steps = len(flows[0])
+    updates = [
+        make_text_update(user * steps + step, 100000 + user, flows[user][step])
+        for step in range(steps)
+        for user in range(users)
+    ]
+    async with application:
+        await start_application(application)
+        started = time.perf_counter()
+        for data in updates:
+            await application.process_update(Update.de_json(data, application.bot))
+        elapsed = time.perf_counter() - started
+        await stop_application(application)
+    return len(updates) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = asyncio.run(run(args.users, '', tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        with_sqlite = asyncio.run(run(args.users, f'sqlite:///{tmp}/state.db', tmp))
+    print(f'без хранения:   {baseline:10.0f} обновлений/с')
+    print(f'SQLite (WAL):   {with_sqlite:10.0f} обновлений/с ({with_sqlite / baseline:.0%})')
+
+
+if __name__ == '__main__':
+    main()
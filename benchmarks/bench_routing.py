@@ -0,0 +1,117 @@
+"""Бенчмарк маршрутизации на большом синтетическом наборе правил.
+
+Правила — как у сети с региональными сервисными центрами: услуга × тип оборудования ×
+группа регионов, плюс ночные дежурства и общие правила услуг. Сравнивается перебор всех
+правил по порядку со скомпилированной таблицей Router (результаты должны совпадать).
+Запуск: python benchmarks/bench_routing.py --regions 85 --kinds 20
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from equipment import normalize  # noqa: E402
+from inn import region_code  # noqa: E402
+from routing import Router, _Rotation, _Rule  # noqa: E402
+
+SERVICES = ('urgent', 'repair', 'rental', 'audit')
+
+
+def make_config(regions, kinds, group=5):
+    codes = [f'{code:02d}' for code in range(1, regions + 1)]
+    rules = []
+    for service in SERVICES[:3]:
+        for kind in range(kinds):
+            for start in range(0, len(codes), group):
+                rules.append({'name': f'{service}-{kind}-{start}', 'service': service, 'equipment': [f'тип{kind}'],
+                              'regions': codes[start:start + group], 'chats': [f'-100{len(rules)}']})
+    rules.append({'name': 'urgent-night', 'service': 'urgent', 'hours': '20:00-08:00', 'on_call': 'duty'})
+    rules += [{'name': service, 'service': service, 'chats': [f'-200{n}']} for n, service in enumerate(SERVICES)]
+    return {'on_call': {'duty': {'start': '2026-01-05T09:00', 'chats': ['-3001', '-3002']}}, 'rules': rules}
+
+
+def linear_route(config, service, equipment, inn, now):
+    """Прежний подход: проверить все правила подряд"""
+    rotations = {name: _Rotation(data) for name, data in config['on_call'].items()}
+    rules = [_Rule(data, rotations) for data in config['rules']]
+    kind = normalize(equipment) if equipment else None
+    region = region_code(inn) if inn else None
+
+    def route():
+        targets, seen = [], set()
+        for rule in rules:
+            if rule.services is not None and service not in rule.services:
+                continue
+            if rule.equipment is not None and kind not in rule.equipment:
+                continue
+            if not rule.matches(region, now):
+                continue
+            for chat_id in rule.targets(now):
+                if chat_id not in seen:
+                    seen.add(chat_id)
+                    targets.append((rule.name, chat_id))
+            if rule.final:
+                break
+        return targets
+    return route
+
+
+def make_inn(region):
+    """ИНН юрлица с заданным кодом региона и верной контрольной цифрой"""
+    digits = [int(ch) for ch in f'{region}{random.randint(0, 9999999):07d}']
+    check = sum(w * d for w, d in zip((2, 4, 10, 3, 5, 9, 4, 6, 8), digits)) % 11 % 10
+    return ''.join(map(str, digits)) + str(check)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', type=int, default=85)
+    parser.add_argument('--kinds', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    random.seed(1)
+
+    config = make_config(args.regions, args.kinds)
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(config, f)
+    try:
+        started = time.perf_counter()
+        router = Router(f.name, check_interval=3600)
+        compile_ms = (time.perf_counter() - started) * 1000
+    finally:
+        os.unlink(f.name)
+
+    base = datetime(2026, 10, 19)
+    requests = [
+        (random.choice(SERVICES), f'тип{random.randrange(args.kinds)}',
+         make_inn(random.randint(1, args.regions)), base + timedelta(minutes=random.randrange(24 * 60)))
+        for _ in range(args.requests)
+    ]
+    linear = [linear_route(config, *request) for request in requests[:200]]
+    started = time.perf_counter()
+    expected = [route() for route in linear]
+    linear_us = (time.perf_counter() - started) / len(linear) * 1e6
+
+    started = time.perf_counter()
+    for request in requests:
+        router.route(*request)
+    compiled_us = (time.perf_counter() - started) / len(requests) * 1e6
+    mismatches = sum(router.route(*request) != result for request, result in zip(requests, expected))
+
+    print(f"правил:               {len(config['rules'])} (компиляция {compile_ms:.0f} мс)")
+    print(f"перебор по порядку:   {linear_us:.1f} мкс на заявку")
+    print(f"Router:               {compiled_us:.1f} мкс на заявку ({linear_us / compiled_us:.0f}x)")
+    print(f"расхождений:          {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
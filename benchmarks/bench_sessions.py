@@ -0,0 +1,164 @@
+"""Бенчмарк памяти брошенных заявок: 100 000 пользователей уходят посреди диалога.
+
+Каждый пользователь отправляет /start, выбирает услугу и отвечает на первый вопрос, после
+чего пропадает. Замеряется прирост памяти процесса (RSS, Linux) на одну брошенную сессию,
+затем SessionSweeper с часами, переведенными на SESSION_TIMEOUT вперед, должен удалить все
+сессии и диалоги. Отдельно (tracemalloc) сравнивается размер самих данных заявки: Session
+со слотами и dict с теми же полями.
+
+Запуск: python benchmarks/bench_sessions.py --users 100000
+В CI: python benchmarks/bench_sessions.py --users 20000 --max-kib 2 (код выхода 1 при превышении).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from telegram import Update  # noqa: E402
+
+import config  # noqa: E402
+from fake_bot_api import FakeBotAPI, FakeRequest, make_text_update  # noqa: E402
+from main import AUDIT_FLOW, RENTAL_FLOW, REPAIR_FLOW, URGENT_FLOW, build_application, start_application, stop_application  # noqa: E402
+from session import Session  # noqa: E402
+
+# Услуга и ответ на ее первый вопрос
+FIRST_STEPS = [
+    (URGENT_FLOW.label, 'УЗИ'),
+    (REPAIR_FLOW.label, 'КТ'),
+    (RENTAL_FLOW.label, 'Для лицензии'),
+    (AUDIT_FLOW.label, '+7 999 123-45-67'),
+]
+
+
+def traced():
+    return tracemalloc.get_traced_memory()[0]
+
+
+def rss():
+    """Резидентная память процесса, байт"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def conversations(application):
+    return sum(len(handler._conversations) for handler in application.handlers[0]
+               if hasattr(handler, '_conversations'))
+
+
+async def abandon(application, api, users):
+    update_ids = iter(range(1, 10 ** 9))
+    for n in range(users):
+        user_id = 100000 + n
+        label, answer = FIRST_STEPS[n % len(FIRST_STEPS)]
+        for text in ('/start', label, answer):
+            data = make_text_update(next(update_ids), user_id, text)
+            await application.process_update(Update.de_json(data, application.bot))
+        if n % 1000 == 999:
+            # Журнал вызовов фейкового API — не память бота
+            api.calls.clear()
+    api.calls.clear()
+
+
+async def measure_bot(users, tmp):
+    config.PERSISTENCE_URL = ''
+    config.DELIVERY_SPOOL = os.path.join(tmp, 'outbox.db')
+    config.REQUESTS_DB = os.path.join(tmp, 'requests.db')
+    config.SLA_DB = os.path.join(tmp, 'sla.db')
+    config.EVENTS_LOG = os.path.join(tmp, 'events.log')
+    config.ANALYTICS_DB = os.path.join(tmp, 'analytics.db')
+    config.BROADCAST_DB = os.path.join(tmp, 'broadcast.db')
+    config.DELIVERY_DRAIN_TIMEOUT = 0.1
+    api = FakeBotAPI()
+    application = build_application(request=FakeRequest(api))
+    async with application:
+        await start_application(application)
+        sweeper = application.bot_data['session_sweeper']
+        before = rss()
+        started = time.perf_counter()
+        await abandon(application, api, users)
+        elapsed = time.perf_counter() - started
+        abandoned = rss()
+        result = {
+            'users': users,
+            'seconds': elapsed,
+            'sessions': len(application.user_data),
+            'conversations': conversations(application),
+            'kib_per_session': (abandoned - before) / users / 1024,
+        }
+        # Часы уходят вперед на SESSION_TIMEOUT: все сессии становятся просроченными
+        real_clock = sweeper.clock
+        sweeper.clock = lambda: real_clock() + config.SESSION_TIMEOUT + 1
+        started = time.perf_counter()
+        result['expired'] = sweeper.sweep()
+        result['sweep_ms'] = (time.perf_counter() - started) * 1000
+        result['sessions_after_sweep'] = len(application.user_data)
+        result['conversations_after_sweep'] = conversations(application)
+        await stop_application(application)
+    return result
+
+
+def measure_representation(users):
+    """Данные брошенной заявки: Session против dict с теми же полями, байт на пользователя"""
+    def filled(session):
+        session.service_type = 'urgent'
+        session.funnel_step = 1
+        session.equipment_type = 'УЗИ'
+        return session
+
+    tracemalloc.start()
+    before = traced()
+    sessions = [filled(Session()) for _ in range(users)]
+    slots = traced() - before
+    del sessions
+    before = traced()
+    dicts = [{'service_type': 'urgent', 'funnel_step': 1, 'equipment_type': 'УЗИ', 'touched': time.time()}
+             for _ in range(users)]
+    plain = traced() - before
+    del dicts
+    tracemalloc.stop()
+    return slots / users, plain / users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--max-kib', type=float, help='максимум памяти бота на брошенную сессию, КиБ')
+    parser.add_argument('--json', help='записать результаты в файл')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(measure_bot(args.users, tmp))
+    result['session_bytes'], result['dict_bytes'] = measure_representation(args.users)
+
+    print(f"брошенных заявок:     {result['users']} ({result['seconds']:.1f} с)")
+    print(f"сессий / диалогов:    {result['sessions']} / {result['conversations']}")
+    print(f"память на сессию:     {result['kib_per_session']:.2f} КиБ "
+          f"(всего {result['kib_per_session'] * result['users'] / 1024:.0f} МиБ)")
+    print(f"данные заявки:        Session {result['session_bytes']:.0f} Б, dict {result['dict_bytes']:.0f} Б")
+    print(f"очистка:              {result['expired']} сессий за {result['sweep_ms']:.0f} мс, "
+          f"осталось сессий {result['sessions_after_sweep']}, диалогов {result['conversations_after_sweep']}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    failures = []
+    if result['sessions_after_sweep'] or result['conversations_after_sweep']:
+        failures.append('после очистки остались сессии или диалоги')
+    if args.max_kib is not None and result['kib_per_session'] > args.max_kib:
+        failures.append(f"память {result['kib_per_session']:.2f} КиБ > {args.max_kib} КиБ")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
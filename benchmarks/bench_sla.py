@@ -0,0 +1,149 @@
+"""Бенчмарк контроля SLA: стоимость таймеров при десятках тысяч неподтвержденных заявок.
+
+SlaTracker работает с настоящей SQLite-базой тикетов, но с подмененными JobQueue (задачи
+только записываются) и очередью отправки. Для каждого размера (--sizes) замеряются:
+регистрация заявки (open), срабатывание задачи, когда срок еще не наступил (тик), и
+когда истекли все сроки (напоминания по неподтвержденной половине заявок), загрузка
+сроков после перезапуска и число задач, поставленных в JobQueue при регистрации. Для сравнения —
+тик, который просматривает все ожидающие таймеры.
+
+Запуск: python benchmarks/bench_sla.py --sizes 1000,10000,50000
+В CI: python benchmarks/bench_sla.py --max-open-us 200 --max-tick-us 50 (код выхода 1 при превышении).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123:fake')
+
+from sla import SlaTracker  # noqa: E402
+
+SLA_SECONDS = 900
+
+
+class FakeJob:
+    def schedule_removal(self):
+        pass
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.scheduled = 0
+
+    def run_once(self, callback, when, name=None):
+        self.scheduled += 1
+        return FakeJob()
+
+
+class FakeDelivery:
+    def __init__(self):
+        self.sent = 0
+
+    def enqueue(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def tracker(path, clock):
+    return SlaTracker(path, FakeJobQueue(), FakeDelivery(), SLA_SECONDS, ['urgent'], clock=clock)
+
+
+def scan_tick(pending, now):
+    """Тик без кучи: просмотр всех ожидающих таймеров"""
+    return [ticket for ticket, deadline in pending.items() if deadline <= now]
+
+
+async def measure(size, tmp, seed):
+    rng = random.Random(seed)
+    clock = Clock()
+    path = os.path.join(tmp, f'sla-{size}.db')
+    sla = tracker(path, clock).start()
+
+    started = time.perf_counter()
+    tickets = []
+    for _ in range(size):
+        clock.now += 0.01
+        tickets.append(sla.open('urgent', ['-100']))
+    open_s = (time.perf_counter() - started) / size
+    # Сроки растут вместе со временем регистрации: задача ставится один раз, на первую заявку
+    jobs = sla.job_queue.scheduled
+    for ticket in rng.sample(tickets, size // 2):
+        sla.acknowledge(ticket, 'bench')
+
+    ticks = 1000
+    started = time.perf_counter()
+    for _ in range(ticks):
+        await sla._fire()
+    tick_s = (time.perf_counter() - started) / ticks
+    pending = dict(sla._pending)
+    started = time.perf_counter()
+    for _ in range(10):
+        scan_tick(pending, clock.now)
+    scan_s = (time.perf_counter() - started) / 10
+
+    restarted = tracker(path, clock)
+    started = time.perf_counter()
+    restarted.start()
+    restart_s = time.perf_counter() - started
+    await restarted.stop()
+
+    clock.now += SLA_SECONDS + 1
+    started = time.perf_counter()
+    await sla._fire()
+    fire_s = (time.perf_counter() - started) / max(sla.delivery.sent, 1)
+    escalated = sla.delivery.sent
+    await sla.stop()
+    return {'open_us': open_s * 1e6, 'tick_us': tick_s * 1e6, 'scan_us': scan_s * 1e6,
+            'escalate_us': fire_s * 1e6, 'escalated': escalated, 'restart_ms': restart_s * 1000, 'jobs': jobs}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,50000', help='числа заявок через запятую')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-open-us', type=float, help='максимум на регистрацию заявки, мкс (самый большой размер)')
+    parser.add_argument('--max-tick-us', type=float, help='максимум на тик без истекших сроков, мкс (самый большой размер)')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            results[size] = asyncio.run(measure(size, tmp, args.seed))
+
+    print(f"{'заявок':>8} {'open, мкс':>10} {'тик, мкс':>9} {'скан, мкс':>10} {'напом., мкс':>12} "
+          f"{'перезапуск, мс':>15} {'задач JobQueue':>15}")
+    for size, r in results.items():
+        print(f"{size:>8} {r['open_us']:>10.1f} {r['tick_us']:>9.2f} {r['scan_us']:>10.0f} {r['escalate_us']:>12.1f} "
+              f"{r['restart_ms']:>15.1f} {r['jobs']:>15}")
+
+    largest = results[sizes[-1]]
+    failures = []
+    expected = sizes[-1] - sizes[-1] // 2
+    if largest['escalated'] != expected:
+        failures.append(f"напоминаний {largest['escalated']}, ожидалось {expected} (неподтвержденная половина)")
+    if args.max_open_us is not None and largest['open_us'] > args.max_open_us:
+        failures.append(f"open {largest['open_us']:.1f} мкс > {args.max_open_us}")
+    if args.max_tick_us is not None and largest['tick_us'] > args.max_tick_us:
+        failures.append(f"тик {largest['tick_us']:.2f} мкс > {args.max_tick_us}")
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
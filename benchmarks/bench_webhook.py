@@ -0,0 +1,194 @@
+"""Сквозная проверка режима webhook: gunicorn с несколькими воркерами против фейкового Bot API.
+
+Запускается настоящий gunicorn ('app:create_app()', gunicorn.conf.py) с BOT_MODE=webhook и
+--workers воркерами: бот работает в воркере-лидере, webhook принимает любой воркер и
+передает обновления через inbox. Фейковый Bot API после setWebhook сам доставляет
+обновления POST-запросами на /webhook, как Telegram. Сначала на webhook отправляются
+некорректное обновление (ожидается 400) и обновление с неверным секретом (403), затем
+--users пользователей присылают /start. Замеряется время от отправки обновления до ответа
+бота. Проверяется, что ответили всем, что /health каждого воркера — 200, а /metrics
+в любом воркере показывает одни и те же счетчики лидера; в конце — остановка по SIGTERM.
+
+Запуск: python benchmarks/bench_webhook.py --workers 2 --users 200 [--app app:app]
+В CI: python benchmarks/bench_webhook.py --max-p99-ms 500 (код выхода 1 при ошибке или превышении).
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_bot_api import FakeBotAPI, make_text_update  # noqa: E402
+
+SECRET = 'bench-secret'
+FIRST_USER = 500000
+UPDATES_METRIC = re.compile(r'^bot_updates_total\{type="message"\} (\d+)$', re.M)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def http(url, data=None, headers=None):
+    """(статус, тело) GET или POST-запроса с JSON"""
+    body = json.dumps(data).encode() if data is not None else None
+    request = urllib.request.Request(url, body, dict(headers or {}, **{'Content-Type': 'application/json'}))
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def wait_for(condition, timeout, process, what):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn завершился с кодом {process.returncode}: {what}')
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'не дождались за {timeout} с: {what}')
+        time.sleep(0.01)
+
+
+def first_replies(api):
+    """chat_id -> время (monotonic) первой отправки в этот чат"""
+    replies = {}
+    with api._lock:
+        for sent, chat_id in api.sent:
+            replies.setdefault(chat_id, sent)
+    return replies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=2, help='воркеров gunicorn')
+    parser.add_argument('--users', type=int, default=200, help='пользователей, присылающих /start')
+    parser.add_argument('--scrapes', type=int, default=10, help='запросов /metrics и /health')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--app', default='app:create_app()', help="приложение для gunicorn (или прежнее 'app:app')")
+    parser.add_argument('--max-p99-ms', type=float, help='максимум p99 от отправки обновления до ответа, мс')
+    args = parser.parse_args()
+
+    failures = []
+    latencies = []
+    api = FakeBotAPI().start()
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            TELEGRAM_BOT_TOKEN='123:fake',
+            BOT_API_URL=api.url,
+            BOT_MODE='webhook',
+            WEBHOOK_URL=f'{base}/webhook',
+            WEBHOOK_SECRET=SECRET,
+            PORT=str(port),
+            WEB_CONCURRENCY=str(args.workers),
+            PERSISTENCE_URL='',
+            LEADER_LOCK=os.path.join(tmp, 'bot.lock'),
+            BOT_INBOX=os.path.join(tmp, 'inbox.db'),
+            DELIVERY_SPOOL=os.path.join(tmp, 'outbox.db'),
+            REQUESTS_DB=os.path.join(tmp, 'requests.db'),
+            SLA_DB=os.path.join(tmp, 'sla.db'),
+            EVENTS_LOG=os.path.join(tmp, 'events.log'),
+            ANALYTICS_DB=os.path.join(tmp, 'analytics.db'),
+            BROADCAST_DB=os.path.join(tmp, 'broadcast.db'),
+            DELIVERY_DRAIN_TIMEOUT='0.1',
+        )
+        log_path = os.path.join(tmp, 'gunicorn.log')
+        log = open(log_path, 'w')
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', args.app],
+            env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT
+        )
+        try:
+            wait_for(lambda: api.webhook is not None, args.timeout, process, 'setWebhook')
+            if api.webhook != {'url': env['WEBHOOK_URL'], 'secret_token': SECRET}:
+                failures.append(f'setWebhook с неверными параметрами: {api.webhook}')
+
+            # Тело, которое не разобрать в Update, не должно попасть в inbox и остановить бота
+            status, _ = http(f'{base}/webhook', {'update_id': 1, 'message': {'text': 'hi'}},
+                             {'X-Telegram-Bot-Api-Secret-Token': SECRET})
+            if status != 400:
+                failures.append(f'некорректное обновление: {status} вместо 400')
+            status, _ = http(f'{base}/webhook', make_text_update(2, FIRST_USER - 1, '/start'),
+                             {'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+            if status != 403:
+                failures.append(f'неверный секрет: {status} вместо 403')
+
+            pushed = {}
+            started = time.monotonic()
+            for i in range(args.users):
+                user_id = FIRST_USER + i
+                pushed[str(user_id)] = time.monotonic()
+                api.push_update(make_text_update(10 + i, user_id, '/start'))
+            wait_for(lambda: len(set(first_replies(api)) & set(pushed)) == len(pushed), args.timeout, process,
+                     f'ответы всем {args.users} пользователям')
+            elapsed = time.monotonic() - started
+            replies = first_replies(api)
+            latencies = sorted((replies[chat_id] - pushed[chat_id]) * 1000 for chat_id in pushed)
+            if str(FIRST_USER - 1) in replies:
+                failures.append('ответ на обновление с неверным секретом')
+
+            # /health и /metrics попадают в случайные воркеры: лидер и остальные должны отвечать одинаково.
+            # Снимок метрик лидер публикует раз в секунду — ждем, пока в нем окажутся все обновления
+            time.sleep(1.5)
+            health = [http(f'{base}/health')[0] for _ in range(args.scrapes)]
+            counters = []
+            for _ in range(args.scrapes):
+                status, body = http(f'{base}/metrics')
+                found = UPDATES_METRIC.search(body) if status == 200 else None
+                counters.append(int(found.group(1)) if found else None)
+            if any(status != 200 for status in health):
+                failures.append(f'/health: {health}')
+            if any(count != args.users for count in counters):
+                failures.append(f'bot_updates_total по запросам /metrics: {counters} вместо {args.users}')
+        except RuntimeError as e:
+            failures.append(str(e))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                code = process.wait(args.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                code = process.wait()
+            log.close()
+            api.stop()
+        if failures:
+            with open(log_path) as f:
+                print(''.join(f.readlines()[-30:]))
+    if code != 0:
+        failures.append(f'gunicorn завершился с кодом {code}')
+
+    if latencies:
+        p50 = statistics.median(latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        rejected = sum(1 for status in api.webhook_responses if status != 200)
+        print(f"воркеров gunicorn: {args.workers}, пользователей: {args.users}")
+        print(f"ответы на /start:  {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f}/с)")
+        print(f"до ответа p50 / p99 / макс: {p50:.0f} / {p99:.0f} / {latencies[-1]:.0f} мс")
+        print(f"доставок webhook:  {len(api.webhook_responses)}, повторов (не 200): {rejected}")
+        print(f"/health:           {health}")
+        print(f"bot_updates_total: {counters}")
+        if args.max_p99_ms is not None and p99 > args.max_p99_ms:
+            failures.append(f'p99 {p99:.0f} мс > {args.max_p99_ms:g} мс')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
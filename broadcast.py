@@ -0,0 +1,366 @@
+"""Рассылки клиентам по истории заявок.
+
+Администратор (BROADCAST_ADMINS) в личном чате с ботом:
+  /broadcast service=rental equipment="узи" — ответом (reply) на сообщение, которое нужно
+      разослать (копируется как есть: текст, фото, форматирование), или с текстом рассылки
+      со второй строки команды; без фильтров — всем, кто оставлял заявки;
+  /broadcast — состояние последних рассылок;
+  /broadcast cancel <номер> — остановить рассылку.
+
+Получатели — чаты всех, кто оставлял заявки (storage, REQUESTS_DB) выбранной услуги и типа
+оборудования (сравнение через equipment.normalize). При запуске список сохраняется в базе
+рассылок (BROADCAST_DB, см. broadcast_store) и дальше не меняется.
+
+Отправка идет через общий TokenBucket: не больше rate сообщений в секунду и запас burst,
+то есть не больше rate + burst за любую секунду (вместе не больше лимита Telegram ~30).
+Одновременно в полете до concurrency отправок, поэтому темп держится и при медленной сети.
+Повторы в один чат (после 429 или ошибки сети) разнесены по лимиту Telegram на чат; на 429
+вся рассылка останавливается на retry_after.
+
+Результаты по получателям сохраняются пачками раз в checkpoint_interval — с них рассылка
+продолжается после перезапуска. При аварийном завершении процесса сообщения, отправленные
+после последнего сохранения, уйдут повторно. Прогресс раз в progress_interval обновляется
+в сообщении администратору.
+"""
+import asyncio
+import json
+import logging
+import shlex
+import sqlite3
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import metrics
+import storage
+from broadcast_store import FAILED, PENDING, SENT, connect, recent, select
+from delivery import TokenBucket
+from equipment import normalize
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на сообщения в один чат, в секунду
+CHAT_RATE = 1.0
+# Фильтр команды -> колонка заявки
+SEGMENT_KEYS = {'service': 'service_type', 'equipment': 'equipment_type'}
+# Сколько получателей читается из базы за раз
+PAGE_SIZE = 1000
+USAGE = (
+    'Рассылка по истории заявок:\n'
+    '/broadcast service=rental equipment="узи" — ответом на сообщение для рассылки '
+    'или с текстом со второй строки\n'
+    '/broadcast — последние рассылки\n'
+    '/broadcast cancel <номер> — остановить рассылку'
+)
+
+def select_recipients(requests_db, service_type=None, equipment_type=None):
+    """Чаты клиентов, оставлявших заявки услуги service_type на оборудование equipment_type"""
+    wanted = normalize(equipment_type) if equipment_type else None
+    conn = storage.connect(requests_db)
+    try:
+        rows = conn.execute(
+            'SELECT DISTINCT chat_id, equipment_type FROM requests WHERE chat_id IS NOT NULL'
+            + (' AND service_type = ?' if service_type else ''),
+            (service_type,) if service_type else ()
+        )
+        chats = {chat_id for chat_id, equipment in rows if wanted is None or normalize(equipment or '') == wanted}
+    finally:
+        conn.close()
+    return sorted(chats)
+
+
+def parse_segment(args):
+    """Фильтры команды (service=... equipment=...) -> аргументы select_recipients или None"""
+    segment = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        if not sep or key not in SEGMENT_KEYS or not value:
+            return None
+        segment[SEGMENT_KEYS[key]] = value
+    return segment
+
+
+def describe(segment):
+    return ', '.join(f'{key}={value}' for key, value in segment.items()) or 'все клиенты'
+
+
+class Job:
+    """Рассылка в работе: счетчики в памяти и результаты, еще не сохраненные в базу"""
+
+    __slots__ = ('id', 'admin_chat', 'segment', 'text', 'source_message', 'total', 'sent', 'failed',
+                 'progress_message', 'results', 'cancelled')
+
+    def __init__(self, row):
+        for column in self.__slots__[:-2]:
+            setattr(self, column, row[column])
+        self.results = []
+        self.cancelled = False
+
+    def progress(self, status='running', rate=None):
+        done = self.sent + self.failed
+        counts = f'доставлено {self.sent} из {self.total}'
+        if self.failed:
+            counts += f', не доставлено {self.failed}'
+        if status == 'done':
+            return f'✅ Рассылка #{self.id} ({describe(self.segment)}) завершена: {counts}'
+        if status == 'cancelled':
+            return f'⏹ Рассылка #{self.id} ({describe(self.segment)}) остановлена: {counts}'
+        text = f'📣 Рассылка #{self.id} ({describe(self.segment)}): {counts}'
+        if rate:
+            text += f', осталось ≈ {max(1, round((self.total - done) / rate / 60))} мин'
+        return text
+
+
+class Broadcaster:
+    """Выполняет рассылки с общим ограничением темпа и сохранением прогресса"""
+
+    def __init__(self, path, bot, requests_db, rate=20.0, burst=5, concurrency=50, max_attempts=5,
+                 checkpoint_interval=1.0, progress_interval=5.0, chat_rate=CHAT_RATE):
+        self.bot = bot
+        self.requests_db = requests_db
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.checkpoint_interval = checkpoint_interval
+        self.progress_interval = progress_interval
+        self.chat_rate = chat_rate
+        self._conn = connect(path)
+        self._jobs = {}
+        self._tasks = {}
+        self._stopping = False
+
+    def start(self):
+        """Продолжает рассылки, прерванные перезапуском"""
+        for item in select(self._conn, "WHERE status = 'running' ORDER BY id", ()):
+            job = Job(item)
+            logger.info(f"Продолжаем рассылку #{job.id}: осталось {job.total - job.sent - job.failed}")
+            self.launch(job)
+        return self
+
+    async def create(self, admin_chat, segment, text=None, source_message=None):
+        """Сохраняет рассылку и ее получателей; возвращает Job или None, если получателей нет"""
+        chats = await asyncio.to_thread(select_recipients, self.requests_db, **segment)
+        if not chats:
+            return None
+        with self._conn:
+            job_id = self._conn.execute(
+                'INSERT INTO broadcasts (created, admin_chat, segment, text, source_message, status, total) '
+                "VALUES (?, ?, ?, ?, ?, 'running', ?)",
+                (time.time(), admin_chat, json.dumps(segment, ensure_ascii=False), text, source_message, len(chats))
+            ).lastrowid
+            self._conn.executemany('INSERT INTO recipients (broadcast, chat_id) VALUES (?, ?)',
+                                   ((job_id, chat_id) for chat_id in chats))
+        return Job(select(self._conn, 'WHERE id = ?', (job_id,))[0])
+
+    def launch(self, job, progress_message=None):
+        """Запускает отправку; progress_message — сообщение администратору для прогресса"""
+        if progress_message is not None:
+            job.progress_message = progress_message
+            with self._conn:
+                self._conn.execute('UPDATE broadcasts SET progress_message = ? WHERE id = ?', (progress_message, job.id))
+        self._jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    def cancel(self, job_id):
+        """Останавливает рассылку; False, если она не выполняется"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def describe_recent(self, limit=5):
+        """Состояние последних рассылок для администратора"""
+        lines = []
+        for item in recent(self._conn, limit):
+            job = self._jobs.get(item['id']) or Job(item)
+            lines.append(job.progress(item['status'], self.rate if item['status'] == 'running' else None))
+        return '\n'.join(lines)
+
+    def _pending(self, job):
+        """Неотправленные получатели по PAGE_SIZE, по возрастанию chat_id"""
+        last = None
+        while True:
+            page = [chat_id for chat_id, in self._conn.execute(
+                'SELECT chat_id FROM recipients WHERE broadcast = ? AND status = ? AND chat_id > ? '
+                'ORDER BY chat_id LIMIT ?', (job.id, PENDING, last if last is not None else -2 ** 63, PAGE_SIZE)
+            )]
+            if not page:
+                return
+            yield from page
+            last = page[-1]
+
+    async def _run(self, job):
+        reporter = asyncio.create_task(self._report(job))
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        try:
+            for chat_id in self._pending(job):
+                await slots.acquire()
+                if job.cancelled or self._stopping:
+                    break
+                task = asyncio.create_task(self._deliver(job, chat_id))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+                task.add_done_callback(lambda _: slots.release())
+            if in_flight:
+                await asyncio.wait(set(in_flight))
+        finally:
+            for task in in_flight:
+                task.cancel()
+            reporter.cancel()
+            await asyncio.gather(reporter, *in_flight, return_exceptions=True)
+            self._checkpoint(job)
+            self._jobs.pop(job.id, None)
+            self._tasks.pop(job.id, None)
+        if self._stopping:
+            return
+        status = 'cancelled' if job.cancelled else 'done'
+        with self._conn:
+            self._conn.execute('UPDATE broadcasts SET status = ?, finished = ? WHERE id = ?', (status, time.time(), job.id))
+        logger.info(f"Рассылка #{job.id} {status}: доставлено {job.sent} из {job.total}, не доставлено {job.failed}")
+        await self._show_progress(job, status)
+
+    async def _deliver(self, job, chat_id):
+        # Свой лимит на чат нужен для повторов: между попытками в один чат не меньше 1 / chat_rate
+        chat = TokenBucket(self.chat_rate, 1)
+        for attempt in range(1, self.max_attempts + 1):
+            await chat.acquire()
+            await self.bucket.acquire()
+            # Остановленная рассылка не отправляет и то, что уже ждало своей очереди
+            if job.cancelled:
+                return
+            try:
+                if job.source_message is not None:
+                    await self.bot.copy_message(chat_id, job.admin_chat, job.source_message)
+                else:
+                    await self.bot.send_message(chat_id, job.text)
+            except RetryAfter as e:
+                metrics.BROADCAST_MESSAGES.inc('retry_after')
+                logger.warning(f"Лимит Telegram в рассылке #{job.id}, ждем {e.retry_after} с")
+                self.bucket.pause(e.retry_after)
+                continue
+            except (BadRequest, Forbidden) as e:
+                # Пользователь заблокировал бота или удалил аккаунт: повтор не поможет
+                metrics.BROADCAST_MESSAGES.inc(type(e).__name__.lower())
+                logger.info(f"Рассылка #{job.id} не доставлена в {chat_id}: {e}")
+                self._record(job, chat_id, FAILED)
+                return
+            except TelegramError as e:
+                # Сеть, ChatMigrated и прочие ошибки API: повторяем с паузой до max_attempts
+                metrics.BROADCAST_MESSAGES.inc('network' if isinstance(e, NetworkError) else type(e).__name__.lower())
+                logger.warning(f"Ошибка отправки рассылки #{job.id} в {chat_id} (попытка {attempt}): {e}")
+                await asyncio.sleep(min(60.0, 2 ** (attempt - 1)))
+                continue
+            except Exception:
+                # Без записи результата получатель остался бы PENDING и получил рассылку повторно
+                metrics.BROADCAST_MESSAGES.inc('unexpected')
+                logger.exception(f"Рассылка #{job.id} не доставлена в {chat_id}")
+                self._record(job, chat_id, FAILED)
+                return
+            metrics.BROADCAST_MESSAGES.inc('sent')
+            self._record(job, chat_id, SENT)
+            return
+        self._record(job, chat_id, FAILED)
+
+    def _record(self, job, chat_id, status):
+        job.results.append((status, job.id, chat_id))
+        if status == SENT:
+            job.sent += 1
+        else:
+            job.failed += 1
+
+    def _checkpoint(self, job):
+        """Сохраняет результаты получателей и счетчики рассылки одной транзакцией"""
+        if not job.results:
+            return
+        results, job.results = job.results, []
+        with self._conn:
+            self._conn.executemany('UPDATE recipients SET status = ? WHERE broadcast = ? AND chat_id = ?', results)
+            self._conn.execute('UPDATE broadcasts SET sent = ?, failed = ? WHERE id = ?', (job.sent, job.failed, job.id))
+
+    async def _report(self, job):
+        shown = time.monotonic()
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                self._checkpoint(job)
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось сохранить прогресс рассылки #{job.id}: {e}")
+            if time.monotonic() - shown >= self.progress_interval:
+                shown = time.monotonic()
+                await self._show_progress(job)
+
+    async def _show_progress(self, job, status='running'):
+        if job.progress_message is None:
+            return
+        # Правка сообщения тоже расходует общий лимит отправки
+        await self.bucket.acquire()
+        try:
+            await self.bot.edit_message_text(job.progress(status, self.rate), chat_id=job.admin_chat,
+                                             message_id=job.progress_message)
+        except TelegramError as e:
+            if 'not modified' not in str(e):
+                logger.warning(f"Не удалось обновить прогресс рассылки #{job.id}: {e}")
+
+    async def stop(self, timeout=5.0):
+        """Перестает начинать отправки, ждет начатые (не дольше timeout) и сохраняет прогресс"""
+        self._stopping = True
+        tasks = list(self._tasks.values())
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._conn.close()
+
+
+async def on_command(update, context):
+    """/broadcast администратора: запуск, состояние и остановка рассылок"""
+    message = update.effective_message
+    broadcaster = context.bot_data.get('broadcaster')
+    if broadcaster is None:
+        await message.reply_text('Рассылки отключены (BROADCAST_DB)')
+        return
+    first_line, _, text = message.text.partition('\n')
+    try:
+        args = shlex.split(first_line)[1:]
+    except ValueError:
+        await message.reply_text(USAGE)
+        return
+    if not args:
+        await message.reply_text(broadcaster.describe_recent() or 'Рассылок еще не было')
+        return
+    if args[0] == 'cancel':
+        if len(args) == 2 and args[1].isdigit() and broadcaster.cancel(int(args[1])):
+            await message.reply_text(f'Рассылка #{args[1]} останавливается')
+        else:
+            await message.reply_text('Нет такой выполняющейся рассылки')
+        return
+    segment = parse_segment(args)
+    source = message.reply_to_message.message_id if message.reply_to_message is not None else None
+    text = text.strip()
+    if segment is None or (source is None and not text):
+        await message.reply_text(USAGE)
+        return
+    job = await broadcaster.create(message.chat.id, segment, text=None if source else text, source_message=source)
+    if job is None:
+        await message.reply_text(f'Получателей нет ({describe(segment)})')
+        return
+    logger.info(f"Рассылка #{job.id} ({describe(segment)}) на {job.total} чатов от {update.effective_user.id}")
+    progress = None
+    try:
+        progress = await message.reply_text(job.progress(rate=broadcaster.rate))
+    except TelegramError as e:
+        # Рассылка сохранена и должна начаться и без сообщения о прогрессе
+        logger.warning(f"Не удалось отправить прогресс рассылки #{job.id}: {e}")
+    broadcaster.launch(job, progress.message_id if progress is not None else None)
+
+
+def build_broadcaster(path, bot, requests_db, rate=20.0, burst=5, concurrency=50, progress_interval=5.0):
+    """Создает Broadcaster или возвращает None, если рассылки не включены"""
+    if not path or not requests_db:
+        return None
+    return Broadcaster(path, bot, requests_db, rate=rate, burst=burst, concurrency=concurrency,
+                       progress_interval=progress_interval)
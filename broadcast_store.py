@@ -0,0 +1,47 @@
+"""База рассылок (BROADCAST_DB): схема, подключение и чтение.
+
+Модуль не импортирует telegram: базу читает и веб-процесс без бота (/admin/broadcasts),
+а рассылки выполняет broadcast.Broadcaster в процессе бота.
+"""
+import json
+import sqlite3
+
+# Состояния получателя
+PENDING, SENT, FAILED = 0, 1, 2
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS broadcasts ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, admin_chat INTEGER NOT NULL, '
+    'segment TEXT NOT NULL, text TEXT, source_message INTEGER, status TEXT NOT NULL, '
+    'total INTEGER NOT NULL, sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, '
+    'progress_message INTEGER, finished REAL)',
+    'CREATE TABLE IF NOT EXISTS recipients ('
+    'broadcast INTEGER NOT NULL, chat_id INTEGER NOT NULL, status INTEGER NOT NULL DEFAULT 0, '
+    'PRIMARY KEY (broadcast, chat_id)) WITHOUT ROWID',
+)
+_COLUMNS = ('id', 'created', 'admin_chat', 'segment', 'text', 'source_message', 'status',
+            'total', 'sent', 'failed', 'progress_message', 'finished')
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+def select(conn, clause, params):
+    """Рассылки (dict с колонками broadcasts) по условию и порядку clause"""
+    cursor = conn.execute(f'SELECT {", ".join(_COLUMNS)} FROM broadcasts {clause}', params)
+    items = [dict(zip(_COLUMNS, row)) for row in cursor]
+    for item in items:
+        item['segment'] = json.loads(item['segment'])
+    return items
+
+
+def recent(conn, limit=20):
+    """Последние рассылки (dict с колонками broadcasts), новые первыми"""
+    return select(conn, 'ORDER BY id DESC LIMIT ?', (limit,))
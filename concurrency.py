@@ -0,0 +1,93 @@
+"""Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+ChatOrderedProcessor подключается к Application как update processor. Application
+отдает ему обновления по одному (max_concurrent_updates=1), а он сразу запускает
+обработку отдельной задачей и возвращает управление, так что медленный ответ одному
+пользователю не задерживает остальных:
+- обновления одного чата выстраиваются в цепочку и проходят ConversationHandler
+  строго по порядку;
+- одновременно выполняется не больше workers обработчиков;
+- принято, но не обработано не больше max_pending обновлений. При переполнении
+  processor перестает забирать обновления из update_queue; когда заполнится и она
+  (размер задается при сборке Application), polling ждет, а webhook отвечает 503.
+"""
+import asyncio
+import logging
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def ordering_key(update):
+    """Чат (или пользователь), в пределах которого важен порядок обновлений"""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return user.id if user is not None else None
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Пул из workers обработчиков с очередью не больше max_pending и порядком по чатам"""
+
+    def __init__(self, workers=8, max_pending=1000):
+        super().__init__(1)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = None
+        self._admission = None
+        self._tails = {}
+        self._tasks = set()
+        self._warned = 0.0
+
+    async def initialize(self):
+        self._pool = asyncio.Semaphore(self.workers)
+        self._admission = asyncio.Semaphore(self.max_pending)
+
+    async def do_process_update(self, update, coroutine):
+        if self._admission.locked() and time.monotonic() - self._warned > 10:
+            self._warned = time.monotonic()
+            logger.warning(f"Очередь обработки заполнена ({self.max_pending}), прием обновлений приостановлен")
+        await self._admission.acquire()
+        key = ordering_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(key, previous, coroutine))
+        if key is not None:
+            self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, previous, coroutine):
+        try:
+            if previous is not None:
+                # wait, а не gather: отмена этой задачи не должна отменять предыдущую
+                await asyncio.wait([previous])
+            async with self._pool:
+                await coroutine
+        finally:
+            # Если задачу отменили до запуска обработчика, корутину нужно закрыть явно
+            coroutine.close()
+            self._admission.release()
+            if key is not None and self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    @property
+    def pending(self):
+        """Принятые, но еще не обработанные обновления"""
+        return len(self._tasks)
+
+    async def join(self, timeout=None):
+        """Дожидается обработки всех принятых обновлений (не дольше timeout)"""
+        if not self._tasks:
+            return True
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        return not pending
+
+    async def shutdown(self):
+        if self._tasks:
+            logger.warning(f"Прерываем обработку {len(self._tasks)} обновлений")
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,140 @@
+import os
+
+# Настройки запуска бота (задаются через переменные окружения)
+
+# Режим получения обновлений: 'polling' (getUpdates) или 'webhook' (POST на Flask)
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').strip().lower()
+
+# Публичный URL, который Telegram будет вызывать в режиме webhook
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+# Путь маршрута Flask, принимающего обновления
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+
+# Интерфейс диалогов: 'reply' (вопрос за вопросом с обычной клавиатурой) или 'inline'
+# (инлайн-кнопки и форма в одном редактируемом сообщении, см. inline.py)
+UI_MODE = os.environ.get('UI_MODE', 'reply').strip().lower()
+
+# Адрес Bot API: пусто — официальный сервер, иначе локальный (например, fake_bot_api.py)
+BOT_API_URL = os.environ.get('BOT_API_URL', '').rstrip('/')
+
+# Хранилище состояний диалогов: sqlite:///state.db, redis://host:6379/0 или пусто (только память)
+PERSISTENCE_URL = os.environ.get('PERSISTENCE_URL', '')
+# Как часто Application передает изменения в хранилище, сек
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL', '5'))
+# Задержка перед записью накопленного пакета изменений, сек
+PERSISTENCE_DEBOUNCE = float(os.environ.get('PERSISTENCE_DEBOUNCE', '1'))
+
+# Файл очереди неотправленных заявок
+DELIVERY_SPOOL = os.environ.get('DELIVERY_SPOOL', 'outbox.db')
+# Лимит сообщений в один канал: в среднем в минуту и подряд без ожидания
+DELIVERY_CHAT_PER_MINUTE = float(os.environ.get('DELIVERY_CHAT_PER_MINUTE', '20'))
+DELIVERY_CHAT_BURST = int(os.environ.get('DELIVERY_CHAT_BURST', '5'))
+# Число попыток отправки и сколько ждать отправки очереди при остановке, сек
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', '8'))
+DELIVERY_DRAIN_TIMEOUT = float(os.environ.get('DELIVERY_DRAIN_TIMEOUT', '10'))
+
+# Каталог синонимов оборудования для срочной подмены и период проверки его изменений, сек
+EQUIPMENT_CATALOG = os.environ.get('EQUIPMENT_CATALOG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'equipment.json'))
+EQUIPMENT_RELOAD_INTERVAL = float(os.environ.get('EQUIPMENT_RELOAD_INTERVAL', '5'))
+
+# Правила маршрутизации заявок по чатам (формат — в routing.py); пусто — каждая услуга в свой канал
+ROUTES_FILE = os.environ.get('ROUTES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'routes.json'))
+# Как часто проверять, изменился ли файл правил, сек
+ROUTES_RELOAD_INTERVAL = float(os.environ.get('ROUTES_RELOAD_INTERVAL', '5'))
+
+# Сколько вложений (фото, документов, голосовых) принимать к одной заявке
+ATTACHMENTS_LIMIT = int(os.environ.get('ATTACHMENTS_LIMIT', '20'))
+# Локальный архив вложений: пусто — не сохранять (в каналы они пересылаются по file_id)
+ATTACHMENTS_DIR = os.environ.get('ATTACHMENTS_DIR', '')
+# Файлы больше этого размера в архив не сохраняются, байт (Bot API отдает не больше 20 МБ)
+ATTACHMENTS_MAX_BYTES = int(os.environ.get('ATTACHMENTS_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Каталоги сообщений и кнопок: <язык>.json (ru — основной, см. i18n.py)
+LOCALES_DIR = os.environ.get('LOCALES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'locales'))
+
+# Реестр организаций для обогащения заявок по ИНН: URL с {inn}, например https://registry.local/org/{inn}
+INN_REGISTRY_URL = os.environ.get('INN_REGISTRY_URL', '')
+INN_REGISTRY_TOKEN = os.environ.get('INN_REGISTRY_TOKEN', '')
+INN_REGISTRY_TIMEOUT = float(os.environ.get('INN_REGISTRY_TIMEOUT', '2'))
+# Кэш ответов реестра: число записей и время жизни, сек
+INN_CACHE_SIZE = int(os.environ.get('INN_CACHE_SIZE', '10000'))
+INN_CACHE_TTL = float(os.environ.get('INN_CACHE_TTL', '86400'))
+
+# Проверять ли MX-запись домена email (нужен пакет dnspython) и таймаут проверки, сек
+EMAIL_CHECK_MX = os.environ.get('EMAIL_CHECK_MX', '').lower() in ('1', 'true', 'yes')
+EMAIL_MX_TIMEOUT = float(os.environ.get('EMAIL_MX_TIMEOUT', '2'))
+
+# Хранилище отправленных заявок и размер пачки записи
+REQUESTS_DB = os.environ.get('REQUESTS_DB', 'requests.db')
+REQUESTS_BATCH_SIZE = int(os.environ.get('REQUESTS_BATCH_SIZE', '100'))
+
+# Токен доступа к служебным маршрутам /admin/... (пусто — маршруты отключены)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Повторная заявка с теми же услугой, телефоном, ИНН и моделью в течение окна не отправляется, сек
+DEDUP_WINDOW = float(os.environ.get('DEDUP_WINDOW', '600'))
+# Не больше SUBMIT_LIMIT заявок от пользователя за SUBMIT_PERIOD сек (0 — без ограничения)
+SUBMIT_LIMIT = int(os.environ.get('SUBMIT_LIMIT', '5'))
+SUBMIT_PERIOD = float(os.environ.get('SUBMIT_PERIOD', '3600'))
+# Общее хранилище для этих проверок (redis://...) при нескольких процессах; пусто — память процесса
+DEDUP_URL = os.environ.get('DEDUP_URL', '')
+
+# Период проверки задержки event loop бота и после скольких секунд без проверки /health считает бота зависшим
+LOOP_MONITOR_INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', '0.5'))
+HEALTH_MAX_LAG = float(os.environ.get('HEALTH_MAX_LAG', '10'))
+
+# Сколько обновлений обрабатывается одновременно и сколько может ждать обработки
+UPDATE_WORKERS = int(os.environ.get('UPDATE_WORKERS', '16'))
+UPDATE_QUEUE_SIZE = int(os.environ.get('UPDATE_QUEUE_SIZE', '1000'))
+
+# Остановка: сколько ждать обработки полученных обновлений и всей остановки бота, сек
+UPDATES_DRAIN_TIMEOUT = float(os.environ.get('UPDATES_DRAIN_TIMEOUT', '10'))
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', '25'))
+# Перезапуск упавшего бота: начальная и максимальная пауза, сек
+RESTART_MIN_DELAY = float(os.environ.get('RESTART_MIN_DELAY', '1'))
+RESTART_MAX_DELAY = float(os.environ.get('RESTART_MAX_DELAY', '60'))
+
+# Блокировка, по которой из процессов веб-сервера выбирается один, где работает бот
+LEADER_LOCK = os.environ.get('LEADER_LOCK', 'bot.lock')
+# Через эту базу процессы без бота передают ему webhook-обновления (пусто — отключено)
+BOT_INBOX = os.environ.get('BOT_INBOX', 'inbox.db')
+INBOX_POLL_INTERVAL = float(os.environ.get('INBOX_POLL_INTERVAL', '0.1'))
+# Сколько необработанных обновлений может ждать в inbox; дальше webhook отвечает 503 и Telegram повторяет позже
+INBOX_MAX_SIZE = int(os.environ.get('INBOX_MAX_SIZE', str(UPDATE_QUEUE_SIZE)))
+
+# Профиль холодного старта в журнале: время импорта модулей и этапов запуска (1 — включить)
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+# Через сколько секунд бездействия брошенная заявка удаляется: SessionSweeper завершает
+# диалог и удаляет данные пользователя (0 — хранить бессрочно)
+SESSION_TIMEOUT = float(os.environ.get('SESSION_TIMEOUT', '3600'))
+# Как часто искать неактивные сессии, сек
+SESSION_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', '60'))
+
+# Контроль SLA (см. sla.py): база тикетов заявок (пусто — отключено), за сколько секунд
+# заявку должны взять в работу, для каких услуг (через запятую) и куда слать напоминания
+# кроме чатов самой заявки (пусто — только туда)
+SLA_DB = os.environ.get('SLA_DB', 'sla.db')
+SLA_SECONDS = float(os.environ.get('SLA_SECONDS', '900'))
+SLA_SERVICES = [name.strip() for name in os.environ.get('SLA_SERVICES', 'urgent').split(',') if name.strip()]
+SLA_ESCALATION_CHAT = os.environ.get('SLA_ESCALATION_CHAT', '')
+
+# Аналитика диалогов (см. analytics.py): журнал событий (пусто — отключено), база почасовых
+# агрегатов (пусто — журнал пишется, но не агрегируется ботом) и как часто ее обновлять, сек
+EVENTS_LOG = os.environ.get('EVENTS_LOG', 'events.log')
+ANALYTICS_DB = os.environ.get('ANALYTICS_DB', 'analytics.db')
+ANALYTICS_INTERVAL = float(os.environ.get('ANALYTICS_INTERVAL', '60'))
+
+# Рассылки клиентам по истории заявок (см. broadcast.py): база рассылок (пусто — отключено)
+# и кто может их запускать — id пользователей Telegram через запятую (пусто — никто)
+BROADCAST_DB = os.environ.get('BROADCAST_DB', 'broadcast.db')
+BROADCAST_ADMINS = [int(user_id) for user_id in os.environ.get('BROADCAST_ADMINS', '').split(',') if user_id.strip()]
+# Темп рассылки, сообщений в секунду, и запас: за любую секунду уходит не больше их суммы
+# (лимит Telegram — около 30 сообщений в секунду на бота, включая заявки и ответы в диалогах)
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '20'))
+BROADCAST_BURST = int(os.environ.get('BROADCAST_BURST', '5'))
+# Сколько отправок рассылки идет одновременно и как часто обновлять прогресс у администратора, сек
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', '50'))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get('BROADCAST_PROGRESS_INTERVAL', '5'))
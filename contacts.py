@@ -0,0 +1,119 @@
+"""Проверка и нормализация контактных данных.
+
+Телефоны приводятся к E.164: номера зоны +7 (Россия и Казахстан) принимаются в любой
+привычной записи (8 999..., 999..., +7 999...), номера других стран — с кодом страны
+через + или из контакта, которым поделился пользователь. Email проверяется
+по синтаксису и, если включено EMAIL_CHECK_MX, по наличию MX-записи домена через
+подключаемый резолвер с кэшем. Все шаблоны компилируются при импорте.
+"""
+import asyncio
+import logging
+import re
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_PHONE_ALLOWED = re.compile(r'^[\d\s()+\-.]+$')
+_NON_DIGITS = re.compile(r'\D')
+# Длина международного номера в цифрах, с кодом страны (E.164 — не больше 15)
+E164_MIN_DIGITS, E164_MAX_DIGITS = 8, 15
+_EMAIL = re.compile(
+    r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@(?=[A-Za-z0-9.-]{1,253}$)(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}$"
+)
+
+
+def normalize_phone(text):
+    """Возвращает номер в формате E.164 (+7XXXXXXXXXX для зоны +7) или None"""
+    text = text.strip()
+    if not text or not _PHONE_ALLOWED.match(text):
+        return None
+    digits = _NON_DIGITS.sub('', text)
+    if text.startswith('+') and not digits.startswith('7'):
+        # Другие страны: только с кодом страны, проверяется лишь длина номера
+        if digits.startswith('0') or not E164_MIN_DIGITS <= len(digits) <= E164_MAX_DIGITS:
+            return None
+        return f'+{digits}'
+    if len(digits) == 11 and digits[0] in '78':
+        digits = digits[1:]
+    elif len(digits) != 10:
+        return None
+    # Коды зоны +7 начинаются с 3, 4, 8, 9 (Россия) или 6, 7 (Казахстан)
+    if digits[0] not in '346789':
+        return None
+    return f'+7{digits}'
+
+
+def contact_phone(contact):
+    """Номер из контакта Telegram для normalize_phone: он всегда полный, но бывает без +"""
+    phone = contact.phone_number.strip()
+    return phone if phone.startswith('+') else f'+{phone}'
+
+
+def normalize_email(text):
+    """Возвращает email с доменом в нижнем регистре или None, если синтаксис неверен"""
+    text = text.strip()
+    if len(text) > 254 or not _EMAIL.match(text):
+        return None
+    local, domain = text.rsplit('@', 1)
+    return f'{local}@{domain.lower()}'
+
+
+class DnsMxResolver:
+    """Проверка MX-записей через dnspython"""
+
+    def __init__(self, timeout=2.0):
+        try:
+            import dns.asyncresolver
+        except ImportError as e:
+            raise RuntimeError('Для EMAIL_CHECK_MX установите пакет dnspython') from e
+        self._resolver = dns.asyncresolver.Resolver()
+        self._resolver.lifetime = timeout
+
+    async def has_mx(self, domain):
+        import dns.exception
+        import dns.resolver
+        try:
+            await self._resolver.resolve(domain, 'MX')
+            return True
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers):
+            return False
+        except dns.exception.Timeout:
+            # Не наказываем пользователя за медленный DNS
+            return True
+
+
+class EmailChecker:
+    """Проверка домена email через резолвер с кэшем ответов"""
+
+    def __init__(self, resolver, timeout=2.0, cache=None):
+        self.resolver = resolver
+        self.timeout = timeout
+        self.cache = cache if cache is not None else TTLCache(10000, 3600)
+
+    async def domain_accepts_mail(self, domain):
+        found, value = self.cache.get(domain)
+        if found:
+            return value
+        try:
+            value = await asyncio.wait_for(self.resolver.has_mx(domain), self.timeout)
+        except Exception as e:
+            logger.warning(f"Проверка MX для {domain} не удалась: {e}")
+            return True
+        self.cache.set(domain, value)
+        return value
+
+
+_default_checker = None
+
+
+def default_checker():
+    """Общий EmailChecker, если включено EMAIL_CHECK_MX, иначе None"""
+    global _default_checker
+    import config
+    if not config.EMAIL_CHECK_MX:
+        return None
+    if _default_checker is None:
+        _default_checker = EmailChecker(DnsMxResolver(config.EMAIL_MX_TIMEOUT), timeout=config.EMAIL_MX_TIMEOUT)
+    return _default_checker
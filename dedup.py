@@ -0,0 +1,133 @@
+"""Защита канала от повторных и слишком частых заявок.
+
+Перед отправкой заявки в канал проверяются:
+1. отпечаток (услуга, телефон, ИНН, модель) — такая же заявка в пределах окна
+   DEDUP_WINDOW считается повтором и в канал не уходит;
+2. число принятых заявок пользователя за SUBMIT_PERIOD — сверх SUBMIT_LIMIT
+   заявки не принимаются.
+MemoryGuard хранит все в памяти процесса (O(1) на проверку, размер ограничен),
+RedisGuard — в общем Redis, чтобы ограничения действовали для нескольких процессов.
+"""
+import hashlib
+import time
+from collections import OrderedDict, deque
+
+# Результаты проверки
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'
+THROTTLED = 'throttled'
+
+
+def fingerprint(service_type, phone, inn, model):
+    """Отпечаток заявки; модель сравнивается без учета регистра и лишних пробелов"""
+    model = ' '.join((model or '').lower().split())
+    key = '\x1f'.join((service_type or '', phone or '', inn or '', model))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class MemoryGuard:
+    """Скользящие окна в памяти.
+
+    Отпечатки лежат в OrderedDict в порядке времени: устаревшие снимаются с начала,
+    поэтому очистка амортизированно O(1). Для пользователя хранится не больше
+    user_limit отметок времени. Оба словаря ограничены maxsize записей.
+    """
+
+    def __init__(self, window=600, user_limit=5, user_period=3600, maxsize=100000, clock=time.monotonic):
+        self.window = window
+        self.user_limit = user_limit
+        self.user_period = user_period
+        self.maxsize = maxsize
+        self.clock = clock
+        self._seen = OrderedDict()
+        self._users = OrderedDict()
+
+    def _expire(self, now):
+        seen = self._seen
+        while seen:
+            key, stamp = next(iter(seen.items()))
+            if now - stamp < self.window and len(seen) <= self.maxsize:
+                break
+            seen.popitem(last=False)
+        users = self._users
+        while users:
+            key, stamps = next(iter(users.items()))
+            if now - stamps[-1] < self.user_period and len(users) <= self.maxsize:
+                break
+            users.popitem(last=False)
+
+    async def check(self, key, user_id):
+        """Возвращает ACCEPTED, DUPLICATE или THROTTLED; принятая заявка запоминается"""
+        now = self.clock()
+        self._expire(now)
+        if key in self._seen:
+            return DUPLICATE
+        stamps = self._users.get(user_id)
+        if self.user_limit and stamps is not None and len(stamps) == self.user_limit \
+                and now - stamps[0] < self.user_period:
+            return THROTTLED
+
+        if self.window:
+            self._seen[key] = now
+        if not self.user_limit:
+            return ACCEPTED
+        if stamps is None:
+            stamps = self._users[user_id] = deque(maxlen=self.user_limit)
+        else:
+            self._users.move_to_end(user_id)
+        stamps.append(now)
+        return ACCEPTED
+
+    async def close(self):
+        pass
+
+
+class RedisGuard:
+    """Те же проверки в Redis: отпечаток — ключ с TTL, заявки пользователя — sorted set"""
+
+    def __init__(self, url, window=600, user_limit=5, user_period=3600, prefix='clinic_bot:dedup'):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError('Для DEDUP_URL=redis://... установите пакет redis') from e
+        self._client = redis.from_url(url, decode_responses=True)
+        self.window = window
+        self.user_limit = user_limit
+        self.user_period = user_period
+        self._prefix = prefix
+
+    async def check(self, key, user_id):
+        now = time.time()
+        seen_key = f'{self._prefix}:seen:{key}'
+        user_key = f'{self._prefix}:user:{user_id}'
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.exists(seen_key)
+            pipe.zremrangebyscore(user_key, 0, now - self.user_period)
+            pipe.zcard(user_key)
+            seen, _, count = await pipe.execute()
+        if seen:
+            return DUPLICATE
+        if self.user_limit and count >= self.user_limit:
+            return THROTTLED
+        # SET NX защищает от гонки двух процессов с одинаковой заявкой
+        if self.window and not await self._client.set(seen_key, user_id, nx=True, ex=max(1, int(self.window))):
+            return DUPLICATE
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.zadd(user_key, {f'{now}:{key}': now})
+            pipe.expire(user_key, max(1, int(self.user_period)))
+            await pipe.execute()
+        return ACCEPTED
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def build_guard(url='', window=600, user_limit=5, user_period=3600, maxsize=100000):
+    """MemoryGuard или RedisGuard по URL общего хранилища; None, если оба ограничения нулевые"""
+    if not window and not user_limit:
+        return None
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisGuard(url, window=window, user_limit=user_limit, user_period=user_period)
+    if url:
+        raise ValueError(f'Неподдерживаемый DEDUP_URL: {url}')
+    return MemoryGuard(window=window, user_limit=user_limit, user_period=user_period, maxsize=maxsize)
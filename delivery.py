@@ -0,0 +1,267 @@
+"""Фоновая отправка заявок в каналы.
+
+Обработчики только ставят сообщение в очередь (delivery.enqueue) и сразу отвечают
+пользователю. Для каждого чата работает свой воркер: он соблюдает лимит Telegram на
+сообщения в чат, повторяет отправку с нарастающей задержкой при 429, сетевых/5xx и
+прочих ошибках Bot API, а при переводе группы в супергруппу (ChatMigrated) продолжает
+отправку в новый чат. Сообщения до успешной отправки лежат в SQLite и переживают перезапуск.
+Payload хранится как JSON, поэтому reply_markup в нем — dict инлайн-клавиатуры.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+from telegram import InlineKeyboardMarkup, InputMediaDocument, InputMediaPhoto
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключ payload с именем правила маршрутизации (для метрик); в Bot API не передается
+ROUTE_KEY = '_route'
+# Ключ payload с методом отправки: send_<метод> бота, по умолчанию message
+METHOD_KEY = '_method'
+# Ключ payload с номером заявки для контроля SLA (см. sla); в Bot API не передается
+TICKET_KEY = '_ticket'
+# Элементы медиагруппы в payload хранятся как {'type': ..., 'media': file_id}
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'document': InputMediaDocument}
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше capacity событий подряд, затем rate событий в секунду"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Сколько секунд ждать до появления свободного токена"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+    async def acquire(self):
+        while True:
+            delay = self.delay()
+            if delay <= 0:
+                self.consume()
+                return
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Запрещает отправку на seconds секунд (ответ 429 с retry_after)"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class Outbox:
+    """Дисковый буфер неотправленных сообщений"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT NOT NULL, '
+            'payload TEXT NOT NULL, created REAL NOT NULL, failed INTEGER NOT NULL DEFAULT 0)'
+        )
+        self._conn.commit()
+
+    def add(self, chat_id, payload):
+        return self.add_many([(chat_id, payload)])[0]
+
+    def add_many(self, messages):
+        """Добавляет [(chat_id, payload)] одной транзакцией; возвращает id записей"""
+        now = time.time()
+        with self._conn:
+            return [
+                self._conn.execute(
+                    'INSERT INTO outbox (chat_id, payload, created) VALUES (?, ?, ?)',
+                    (str(chat_id), json.dumps(payload, ensure_ascii=False), now)
+                ).lastrowid
+                for chat_id, payload in messages
+            ]
+
+    def remove(self, message_id):
+        with self._conn:
+            self._conn.execute('DELETE FROM outbox WHERE id = ?', (message_id,))
+
+    def mark_failed(self, message_id):
+        with self._conn:
+            self._conn.execute('UPDATE outbox SET failed = 1 WHERE id = ?', (message_id,))
+
+    def pending(self):
+        rows = self._conn.execute('SELECT id, chat_id, payload FROM outbox WHERE failed = 0 ORDER BY id').fetchall()
+        return [(message_id, chat_id, json.loads(payload)) for message_id, chat_id, payload in rows]
+
+    def close(self):
+        self._conn.close()
+
+
+class DeliveryQueue:
+    """Очередь исходящих сообщений с отдельным воркером на каждый чат"""
+
+    def __init__(self, bot, spool_path, chat_rate=20 / 60, chat_burst=5, max_attempts=8,
+                 base_delay=1.0, max_delay=300.0):
+        self.bot = bot
+        self.outbox = Outbox(spool_path)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # on_sent(ticket, chat_id, message_id) вызывается после отправки сообщения с TICKET_KEY
+        self.on_sent = None
+        self._queues = {}
+        self._workers = {}
+        self._buckets = {}
+        # chat_id группы -> id супергруппы, в которую она переведена
+        self._migrated = {}
+
+    def start(self):
+        """Поднимает из буфера сообщения, не отправленные до перезапуска"""
+        pending = self.outbox.pending()
+        for message_id, chat_id, payload in pending:
+            self._put(chat_id, message_id, payload)
+        if pending:
+            logger.info(f"Восстановлено неотправленных сообщений: {len(pending)}")
+
+    def enqueue(self, chat_id, text, **kwargs):
+        """Ставит сообщение в очередь и сразу возвращает управление"""
+        return self.enqueue_many([(None, chat_id)], text, **kwargs)[0]
+
+    def enqueue_many(self, targets, text, followups=(), **kwargs):
+        """Ставит сообщение в очереди нескольких чатов; targets — [(правило маршрутизации или None, chat_id)]
+
+        followups — payload сообщений, которые уходят в каждый чат следом за текстом
+        (например, вложения заявки, см. attachments.media_payloads). Все записи попадают
+        в буфер одной транзакцией, а отправляются параллельно: у каждого чата свой воркер.
+        """
+        messages = []
+        for route, chat_id in targets:
+            payload = dict(kwargs, text=text)
+            if route is not None:
+                payload[ROUTE_KEY] = route
+            messages.append((str(chat_id), payload))
+            messages.extend((str(chat_id), dict(followup)) for followup in followups)
+        message_ids = self.outbox.add_many(messages)
+        for (chat_id, payload), message_id in zip(messages, message_ids):
+            self._put(chat_id, message_id, payload)
+        return message_ids
+
+    def _put(self, chat_id, message_id, payload):
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = asyncio.Queue()
+            self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            self._workers[chat_id] = asyncio.create_task(self._worker(chat_id, queue))
+        queue.put_nowait((message_id, payload))
+
+    async def _worker(self, chat_id, queue):
+        bucket = self._buckets[chat_id]
+        while True:
+            message_id, payload = await queue.get()
+            try:
+                await self._deliver(chat_id, bucket, message_id, payload)
+            except Exception:
+                # Воркер не должен завершаться: иначе следующие сообщения чата не будут отправлены
+                logger.exception(f"Ошибка воркера отправки в {chat_id}, сообщение {message_id}")
+            finally:
+                queue.task_done()
+
+    async def _send(self, chat_id, payload):
+        params = {key: value for key, value in payload.items() if key not in (ROUTE_KEY, METHOD_KEY, TICKET_KEY)}
+        method = payload.get(METHOD_KEY, 'message')
+        if method == 'media_group':
+            params['media'] = [INPUT_MEDIA[item['type']](item['media']) for item in params['media']]
+        if isinstance(params.get('reply_markup'), dict):
+            params['reply_markup'] = InlineKeyboardMarkup.de_json(params['reply_markup'], self.bot)
+        started = time.perf_counter()
+        try:
+            return await getattr(self.bot, f'send_{method}')(chat_id=chat_id, **params)
+        finally:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started, chat_id)
+
+    async def _deliver(self, chat_id, bucket, message_id, payload):
+        route = payload.get(ROUTE_KEY)
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire()
+            target = self._migrated.get(chat_id, chat_id)
+            try:
+                message = await self._send(target, payload)
+            except RetryAfter as e:
+                metrics.SEND_ERRORS.inc(chat_id, 'retry_after')
+                logger.warning(f"Лимит Telegram для {chat_id}, ждем {e.retry_after} с")
+                bucket.pause(e.retry_after)
+                continue
+            except (BadRequest, Forbidden) as e:
+                metrics.SEND_ERRORS.inc(chat_id, type(e).__name__.lower())
+                # Повтор не поможет: сообщение остается в буфере с пометкой для ручного разбора
+                logger.error(f"Сообщение {message_id} в {chat_id} отклонено: {e}")
+                self.outbox.mark_failed(message_id)
+                if route is not None:
+                    metrics.ROUTE_FAILED.inc(route)
+                return
+            except ChatMigrated as e:
+                metrics.SEND_ERRORS.inc(chat_id, 'chat_migrated')
+                logger.warning(f"Чат {chat_id} переведен в супергруппу {e.new_chat_id}, отправляем туда "
+                               f"(обновите id чата в настройках)")
+                self._migrated[chat_id] = e.new_chat_id
+                continue
+            except TelegramError as e:
+                error = 'network' if isinstance(e, NetworkError) else type(e).__name__.lower()
+                metrics.SEND_ERRORS.inc(chat_id, error)
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                logger.warning(f"Ошибка отправки в {target} (попытка {attempt}): {e}; повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                metrics.SEND_ERRORS.inc(chat_id, 'unexpected')
+                # Ошибка не Bot API (например, испорченный payload): повтор не поможет
+                logger.exception(f"Сообщение {message_id} в {chat_id} не отправлено: {e}")
+                self.outbox.mark_failed(message_id)
+                if route is not None:
+                    metrics.ROUTE_FAILED.inc(route)
+                return
+            self.outbox.remove(message_id)
+            if route is not None:
+                metrics.ROUTE_SENT.inc(route)
+            if TICKET_KEY in payload and self.on_sent is not None:
+                try:
+                    self.on_sent(payload[TICKET_KEY], target, message.message_id)
+                except Exception as e:
+                    logger.error(f"Не удалось записать сообщение заявки #{payload[TICKET_KEY]}: {e}")
+            return
+        if route is not None:
+            metrics.ROUTE_FAILED.inc(route)
+        logger.error(f"Сообщение {message_id} в {chat_id} не отправлено за {self.max_attempts} попыток, повтор после перезапуска")
+
+    async def stop(self, timeout=10.0):
+        """Дожидается отправки очереди (не дольше timeout), затем останавливает воркеров"""
+        if self._queues:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues.values())), timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Очередь отправки не опустела, остаток будет отправлен после перезапуска")
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self.outbox.close()
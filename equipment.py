@@ -0,0 +1,285 @@
+"""Распознавание типа оборудования по свободному вводу пользователя.
+
+Синонимы загружаются из JSON-файла {тип: [синонимы]} и перечитываются при его
+изменении. Ввод нормализуется (регистр, ё, пунктуация, латиница → кириллица), затем:
+1. автомат Ахо–Корасик находит любой синоним как подстроку за один проход по тексту,
+   независимо от размера каталога;
+2. если совпадений нет — поиск с опечатками (расстояние Левенштейна до 1–2) по индексу
+   удалений символов, без перебора всего каталога. Опечатки допускаются только в словах
+   от FUZZY_MIN_LENGTH букв и только для синонимов, записанных кириллицей: короткие
+   синонимы и транслитерированные английские («ventilator» → «вентилатор») совпадают
+   с обычными словами («ива», «вентилятор»), поэтому внутри фразы ищутся только точно;
+3. если весь ввод — одно короткое слово («узм»), допускается одна замена буквы на
+   соседнюю по раскладке ЙЦУКЕН: «узм» → УЗИ, но не «ива» → ИВЛ.
+Результаты для недавних вводов кэшируются (LRU).
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Минимальная длина слова, в котором допускаются опечатки
+FUZZY_MIN_LENGTH = 4
+
+_NON_WORD = re.compile(r'[^0-9a-zа-я]+')
+_KEYBOARD_ROWS = ('йцукенгшщзхъ', 'фывапролджэ', 'ячсмитьбю')
+_LATIN = re.compile(r'[a-z]')
+_DIGRAPHS = (('sch', 'щ'), ('sh', 'ш'), ('ch', 'ч'), ('zh', 'ж'), ('kh', 'х'), ('ts', 'ц'),
+             ('ya', 'я'), ('yu', 'ю'), ('yo', 'е'))
+_LETTERS = str.maketrans({
+    'a': 'а', 'b': 'б', 'c': 'к', 'd': 'д', 'e': 'е', 'f': 'ф', 'g': 'г', 'h': 'х', 'i': 'и',
+    'j': 'й', 'k': 'к', 'l': 'л', 'm': 'м', 'n': 'н', 'o': 'о', 'p': 'п', 'q': 'к', 'r': 'р',
+    's': 'с', 't': 'т', 'u': 'у', 'v': 'в', 'w': 'в', 'x': 'кс', 'y': 'ы', 'z': 'з',
+})
+
+
+def normalize(text):
+    """Нижний регистр, ё → е, латиница → кириллица, любые разделители → один пробел"""
+    text = text.lower().replace('ё', 'е')
+    text = _NON_WORD.sub(' ', text).strip()
+    if any('a' <= ch <= 'z' for ch in text):
+        for latin, cyrillic in _DIGRAPHS:
+            text = text.replace(latin, cyrillic)
+        text = text.translate(_LETTERS)
+    return text
+
+
+def bounded_distance(a, b, limit):
+    """Расстояние Левенштейна между a и b или limit + 1, если оно больше limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            current.append(value)
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _keyboard_neighbours():
+    """Буква → соседние клавиши раскладки ЙЦУКЕН (по ряду и в соседних рядах со сдвигом)"""
+    neighbours = {}
+    for row, keys in enumerate(_KEYBOARD_ROWS):
+        for i, key in enumerate(keys):
+            near = {keys[j] for j in (i - 1, i + 1) if 0 <= j < len(keys)}
+            if row > 0:
+                near.update(_KEYBOARD_ROWS[row - 1][i:i + 2])
+            if row + 1 < len(_KEYBOARD_ROWS):
+                near.update(_KEYBOARD_ROWS[row + 1][max(i - 1, 0):i + 1])
+            neighbours[key] = near
+    return neighbours
+
+
+_NEIGHBOURS = _keyboard_neighbours()
+
+
+def is_adjacent_typo(word, pattern):
+    """word отличается от pattern ровно одной буквой, и она соседняя по клавиатуре"""
+    if len(word) != len(pattern):
+        return False
+    diff = [(a, b) for a, b in zip(word, pattern) if a != b]
+    return len(diff) == 1 and diff[0][0] in _NEIGHBOURS.get(diff[0][1], ())
+
+
+def _deletions(word, depth):
+    """Все варианты word без не более чем depth символов"""
+    result = {word}
+    frontier = {word}
+    for _ in range(depth):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+
+class _Automaton:
+    """Автомат Ахо–Корасик над нормализованными синонимами"""
+
+    def __init__(self, patterns):
+        # patterns: {синоним: (тип, приоритет)}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for pattern, value in patterns.items():
+            node = 0
+            for ch in pattern:
+                nxt = self.goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                node = nxt
+            self.output[node] = (len(pattern), value)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                # Наследуем лучший (самый длинный) результат по суффиксной ссылке
+                inherited = self.output[self.fail[child]]
+                if inherited is not None and (self.output[child] is None or inherited[0] > self.output[child][0]):
+                    self.output[child] = inherited
+
+    def search(self, text):
+        """Возвращает (тип, приоритет) самого длинного найденного синонима или None"""
+        best = None
+        node = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            found = output[node]
+            if found is not None and (best is None or found[0] > best[0]
+                                      or (found[0] == best[0] and found[1][1] < best[1][1])):
+                best = found
+        return best[1] if best else None
+
+
+class EquipmentMatcher:
+    """Скомпилированный каталог синонимов с перезагрузкой при изменении файла"""
+
+    def __init__(self, path, check_interval=5.0, cache_size=4096):
+        self.path = path
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._compiled = None
+        self.reload()
+
+    def reload(self):
+        """Перечитывает файл каталога и пересобирает автомат и индексы"""
+        with open(self.path, encoding='utf-8') as f:
+            catalog = json.load(f)
+        self.load(catalog)
+        self._mtime = os.stat(self.path).st_mtime
+        logger.info(f"Каталог оборудования загружен: {len(catalog)} типов из {self.path}")
+
+    def load(self, catalog):
+        patterns = {}
+        fuzzy = {}
+        short = []
+        for priority, (main_type, variants) in enumerate(catalog.items()):
+            for variant in [main_type, *variants]:
+                pattern = normalize(variant)
+                if not pattern or pattern in patterns:
+                    continue
+                patterns[pattern] = (main_type, priority)
+                # Опечатки ищем только в однословных кириллических синонимах от FUZZY_MIN_LENGTH букв
+                if ' ' in pattern or _LATIN.search(variant.lower()):
+                    continue
+                if len(pattern) >= FUZZY_MIN_LENGTH:
+                    for deletion in _deletions(pattern, self._max_typos(pattern)):
+                        fuzzy.setdefault(deletion, []).append(pattern)
+                elif len(pattern) == FUZZY_MIN_LENGTH - 1:
+                    # Короткие синонимы («узи», «ивл») — только для ввода из одного слова
+                    short.append(pattern)
+        # Короткие синонимы («узи», «нда») ищем только целым словом, чтобы не ловить «стандарт»
+        keyed = {}
+        for pattern, value in patterns.items():
+            keyed[f' {pattern} ' if len(pattern) <= 3 else pattern] = value
+            squashed = pattern.replace(' ', '')
+            if squashed != pattern:
+                keyed.setdefault(squashed, value)
+        automaton = _Automaton(keyed)
+        lookup = lru_cache(maxsize=self.cache_size)(
+            lambda text: self._match(text, automaton, patterns, fuzzy, short)
+        )
+        self._compiled = lookup
+
+    @staticmethod
+    def _max_typos(word):
+        return 1 if len(word) <= 6 else 2
+
+    @staticmethod
+    def _match(text, automaton, patterns, fuzzy, short):
+        normalized = normalize(text)
+        if not normalized:
+            return None
+        found = automaton.search(f' {normalized} ')
+        if found is None and ' ' in normalized:
+            # «ИВ Л», «у з и»: пробуем текст без пробелов
+            found = automaton.search(f" {normalized.replace(' ', '')} ")
+        if found is not None:
+            return found[0]
+
+        if ' ' not in normalized and len(normalized) < FUZZY_MIN_LENGTH:
+            for candidate in short:
+                if is_adjacent_typo(normalized, candidate):
+                    return patterns[candidate][0]
+            return None
+
+        best = None
+        for token in normalized.split(' '):
+            if len(token) < FUZZY_MIN_LENGTH:
+                continue
+            candidates = set()
+            for deletion in _deletions(token, EquipmentMatcher._max_typos(token)):
+                candidates.update(fuzzy.get(deletion, ()))
+            for candidate in candidates:
+                limit = EquipmentMatcher._max_typos(candidate)
+                distance = bounded_distance(token, candidate, limit)
+                if distance <= limit:
+                    rank = (distance, patterns[candidate][1])
+                    if best is None or rank < best[0]:
+                        best = (rank, patterns[candidate][0])
+        return best[1] if best else None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                if os.stat(self.path).st_mtime != self._mtime:
+                    self.reload()
+            except (OSError, ValueError) as e:
+                logger.error(f"Не удалось перечитать каталог оборудования: {e}")
+
+    def match(self, text):
+        """Возвращает основной тип оборудования для ввода пользователя или None"""
+        self._maybe_reload()
+        return self._compiled(text)
+
+
+_default_matcher = None
+_default_lock = threading.Lock()
+
+
+def default_matcher():
+    """Общий экземпляр каталога из EQUIPMENT_CATALOG (создается при первом обращении)
+
+    Вызывается и из потоков executor, поэтому создание защищено блокировкой: каталог
+    собирается один раз, даже если первые обращения пришли одновременно.
+    """
+    global _default_matcher
+    if _default_matcher is None:
+        with _default_lock:
+            if _default_matcher is None:
+                import config
+                _default_matcher = EquipmentMatcher(config.EQUIPMENT_CATALOG,
+                                                    check_interval=config.EQUIPMENT_RELOAD_INTERVAL)
+    return _default_matcher
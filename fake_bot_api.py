@@ -0,0 +1,388 @@
+"""Локальный фейковый Bot API для проверки бота без обращения к Telegram.
+
+Запуск: python fake_bot_api.py --port 8081
+Затем бот запускается с BOT_API_URL=http://127.0.0.1:8081 и любым TELEGRAM_BOT_TOKEN.
+Файлы для getFile регистрируются через add_file и отдаются по /file/bot<токен>/<путь>.
+С global_limit/chat_limit сервер, как Telegram, отвечает 429 (retry_after) на отправку
+сверх лимита сообщений за скользящую секунду — всего и в один чат; чаты из blocked
+отвечают 403, как пользователь, заблокировавший бота.
+После setWebhook сервер, как Telegram, сам отправляет обновления из push_update POST-запросами
+на адрес webhook (с X-Telegram-Bot-Api-Secret-Token) по одному и по порядку, повторяя
+доставку при ошибке соединения, 5xx и 429; getUpdates в это время отвечает 409.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from telegram.request import BaseRequest
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+# Методы, на которые действуют лимиты отправки
+SEND_METHODS = frozenset(('sendMessage', 'sendPhoto', 'sendDocument', 'sendVoice', 'sendMediaGroup',
+                          'copyMessage', 'editMessageText'))
+
+
+class FakeBotAPI:
+    """Минимальный HTTP-сервер, отвечающий на методы Bot API и запоминающий вызовы"""
+
+    def __init__(self, host='127.0.0.1', port=0, global_limit=None, chat_limit=None):
+        self.calls = []
+        self.updates = []
+        # file_id -> размер файла, байт
+        self.files = {}
+        # chat_id -> message_id последнего отправленного ботом сообщения (для make_callback_update)
+        self.last_message = {}
+        # Лимиты сообщений в секунду (None — без лимита), заблокировавшие бота чаты,
+        # время (monotonic) и чат каждой принятой отправки и число ответов 429
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.blocked = set()
+        self.sent = []
+        self.rejected = 0
+        self._window = deque()
+        self._chat_windows = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+        # Webhook ({'url', 'secret_token'} или None), статусы ответов на доставку и очередь доставки
+        self.webhook = None
+        self.webhook_responses = []
+        self._outgoing = queue.Queue()
+        self._deliverer = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(self._address, self._make_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._deliverer is not None:
+            self._outgoing.put(None)
+            self._deliverer.join(5)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_update(self, update):
+        """Ставит обновление в очередь для getUpdates или, если установлен webhook, доставки на него"""
+        with self._lock:
+            if self.webhook is None:
+                self.updates.append(update)
+                return
+        self._outgoing.put(update)
+
+    def add_file(self, file_id, size):
+        """Регистрирует файл для getFile; содержимое генерируется при скачивании"""
+        self.files[file_id] = size
+
+    def calls_of(self, method):
+        with self._lock:
+            return [params for name, params in self.calls if name == method]
+
+    def handle(self, method, params):
+        """Возвращает (HTTP-статус, тело ответа) для вызова метода"""
+        with self._lock:
+            self.calls.append((method, params))
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': BOT_USER}
+        if method == 'getUpdates':
+            if self.webhook is not None:
+                return 409, {'ok': False, 'error_code': 409, 'description': "Conflict: can't use getUpdates "
+                             'method while webhook is active; use deleteWebhook to delete the webhook first'}
+            return 200, {'ok': True, 'result': self._take_updates(params)}
+        if method in ('setWebhook', 'deleteWebhook', 'getWebhookInfo'):
+            return self._webhook_method(method, params)
+        if method in SEND_METHODS:
+            refused = self._check_limits(str(params.get('chat_id', '0')))
+            if refused is not None:
+                return refused
+        if method == 'copyMessage':
+            return 200, {'ok': True, 'result': {'message_id': next(self._message_ids)}}
+        if method in ('sendMessage', 'sendPhoto', 'sendDocument', 'sendVoice'):
+            message = self._message(params)
+            with self._lock:
+                self.last_message[message['chat']['id']] = message['message_id']
+            return 200, {'ok': True, 'result': message}
+        if method == 'editMessageText':
+            return 200, {'ok': True, 'result': dict(self._message(params), message_id=int(params.get('message_id', 0)))}
+        if method == 'getFile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                return 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+            return 200, {'ok': True, 'result': {'file_id': file_id, 'file_unique_id': f'u{file_id}',
+                                                 'file_size': self.files[file_id], 'file_path': f'files/{file_id}'}}
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            return 200, {'ok': True, 'result': [self._message(params) for _ in media]}
+        return 200, {'ok': True, 'result': True}
+
+    def _webhook_method(self, method, params):
+        if method == 'getWebhookInfo':
+            webhook = self.webhook or {}
+            return 200, {'ok': True, 'result': {'url': webhook.get('url', ''), 'has_custom_certificate': False,
+                                                'pending_update_count': self._outgoing.qsize()}}
+        with self._lock:
+            if method == 'deleteWebhook':
+                self.webhook = None
+            else:
+                self.webhook = {'url': params.get('url'), 'secret_token': params.get('secret_token')}
+                # Обновления, накопленные для getUpdates, теперь доставляются на webhook
+                pending, self.updates = self.updates, []
+        if method == 'setWebhook':
+            for update in pending:
+                self._outgoing.put(update)
+            if self._deliverer is None:
+                self._deliverer = threading.Thread(target=self._deliver_updates, daemon=True)
+                self._deliverer.start()
+        return 200, {'ok': True, 'result': True}
+
+    def _deliver_updates(self):
+        """Поток доставки на webhook: по одному обновлению, следующее — после ответа на предыдущее"""
+        while True:
+            update = self._outgoing.get()
+            if update is None:
+                return
+            while True:
+                with self._lock:
+                    webhook = self.webhook
+                if webhook is None:
+                    self.push_update(update)
+                    break
+                status = self._post_update(webhook, update)
+                with self._lock:
+                    self.webhook_responses.append(status)
+                # Как Telegram: повтор при недоступности, 5xx и 429; прочие ответы — доставлено или отклонено
+                if status is not None and status < 500 and status != 429:
+                    break
+                time.sleep(0.2)
+
+    @staticmethod
+    def _post_update(webhook, update):
+        """HTTP-статус ответа webhook или None, если соединиться не удалось"""
+        headers = {'Content-Type': 'application/json'}
+        if webhook.get('secret_token'):
+            headers['X-Telegram-Bot-Api-Secret-Token'] = webhook['secret_token']
+        request = urllib.request.Request(webhook['url'], json.dumps(update).encode(), headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return None
+
+    def _check_limits(self, chat_id):
+        """Ответ 429/403, если отправка в chat_id нарушает лимиты; иначе отправка учитывается"""
+        if chat_id in self.blocked:
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+        now = time.monotonic()
+        with self._lock:
+            chat_window = self._chat_windows[chat_id]
+            for window in (self._window, chat_window):
+                while window and window[0] <= now - 1:
+                    window.popleft()
+            if ((self.global_limit is not None and len(self._window) >= self.global_limit)
+                    or (self.chat_limit is not None and len(chat_window) >= self.chat_limit)):
+                self.rejected += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+            self._window.append(now)
+            chat_window.append(now)
+            self.sent.append((now, chat_id))
+        return None
+
+    def max_per_second(self):
+        """Наибольшее число принятых отправок за скользящую секунду"""
+        with self._lock:
+            times = [sent for sent, _ in self.sent]
+        best = start = 0
+        for end, now in enumerate(times):
+            while times[start] <= now - 1:
+                start += 1
+            best = max(best, end - start + 1)
+        return best
+
+    def _take_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), 0.5)
+        while True:
+            with self._lock:
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+                pending = list(self.updates)
+            if pending or time.monotonic() >= deadline:
+                return pending
+            time.sleep(0.05)
+
+    def _message(self, params):
+        chat_id = params.get('chat_id', '0')
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def _make_handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8', 'replace')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = dict(parse_qsl(body))
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                status, payload = api.handle(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент закрыл соединение, не дождавшись ответа (например, бот останавливается)
+                    pass
+
+            def do_GET(self):
+                if '/file/bot' not in self.path:
+                    return self.do_POST()
+                file_id = self.path.rsplit('/', 1)[-1]
+                size = api.files.get(file_id)
+                if size is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                chunk = b'x' * 65536
+                try:
+                    for start in range(0, size, len(chunk)):
+                        self.wfile.write(chunk[:size - start])
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+
+class FakeRequest(BaseRequest):
+    """HTTP-клиент Bot API, который вызывает FakeBotAPI напрямую, без сети (для бенчмарков)
+
+    latency — имитация задержки сети на каждый вызов, сек.
+    """
+
+    def __init__(self, api, latency=0.0):
+        self.api = api
+        self.latency = latency
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = request_data.json_parameters if request_data is not None else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        status, payload = self.api.handle(url.rsplit('/', 1)[-1], params)
+        return status, json.dumps(payload).encode()
+
+
+def make_text_update(update_id, user_id, text, language_code=None):
+    """Собирает JSON обновления с текстовым сообщением от пользователя"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    if language_code:
+        user['language_code'] = language_code
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+
+def make_callback_update(update_id, user_id, data, message_id, language_code=None):
+    """Собирает JSON обновления с нажатием инлайн-кнопки под сообщением бота message_id"""
+    user = make_text_update(update_id, user_id, '', language_code)['message']['from']
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': BOT_USER,
+        'text': '',
+    }
+    return {'update_id': update_id,
+            'callback_query': {'id': str(update_id), 'from': user, 'chat_instance': str(user_id),
+                               'message': message, 'data': data}}
+
+
+def make_media_update(update_id, user_id, kind, file_id, caption=None, media_group_id=None, size=1024,
+                      language_code=None):
+    """Собирает JSON обновления с фото, документом или голосовым сообщением"""
+    data = make_text_update(update_id, user_id, '', language_code)
+    message = data['message']
+    del message['text']
+    media = {'file_id': file_id, 'file_unique_id': f'u{file_id}', 'file_size': size}
+    if kind == 'photo':
+        message['photo'] = [dict(media, width=90, height=90, file_size=size // 10), dict(media, width=1280, height=960)]
+    elif kind == 'document':
+        message['document'] = dict(media, file_name=f'{file_id}.log')
+    else:
+        message['voice'] = dict(media, duration=5)
+    if caption:
+        message['caption'] = caption
+    if media_group_id:
+        message['media_group_id'] = media_group_id
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Фейковый Bot API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(args.host, args.port).start()
+    logger.info(f"Фейковый Bot API слушает {api.url}")
+    try:
+        api._thread.join()
+    except KeyboardInterrupt:
+        api.stop()
@@ -0,0 +1,369 @@
+"""Табличный движок диалогов заявок.
+
+Каждая услуга описывается Flow со списком шагов Step: текст вопроса, клавиатура,
+поле сессии (см. session.Session), валидатор и особые кнопки. Переходы «Назад»/«дальше» вычисляются из
+порядка шагов. Все шаги обслуживает один обработчик handle_step; на сообщение приходится
+поиск надписи в обратном индексе каталога языка и поиск id кнопки в dict особых кнопок шага.
+Тексты задаются ключами каталога (см. i18n), клавиатуры — идентификаторами из ui.KEYBOARDS,
+особые кнопки — id кнопок каталога. Шаг с max_attachments принимает фото, документы и
+голосовые (см. attachments); части альбома, пришедшие после перехода к следующему шагу,
+дописываются к заявке без ответа.
+"""
+import html
+import inspect
+import logging
+from datetime import datetime
+from functools import partial
+
+from telegram.ext import ConversationHandler, MessageHandler, filters
+
+import attachments
+import dedup
+import i18n
+import metrics
+import sla
+import ui
+from contacts import contact_phone
+from delivery import TICKET_KEY
+
+logger = logging.getLogger(__name__)
+
+# id кнопок каталога
+BACK = 'back'
+SKIP = 'skip'
+# Цель перехода «остаться на текущем шаге»
+STAY = object()
+# Описание проблемы, если пользователь прислал только голосовое сообщение
+VOICE_VALUE = 'Голосовое сообщение'
+MEDIA_FILTER = filters.PHOTO | filters.Document.ALL | filters.VOICE
+
+
+class StepError(Exception):
+    """Ввод не прошел проверку: пользователь получает текст text (ключ каталога с полями fields) и остается на шаге"""
+
+    def __init__(self, text, keyboard=None, parse_mode=None, **fields):
+        super().__init__(text)
+        self.text = text
+        self.keyboard = keyboard
+        self.parse_mode = parse_mode
+        self.fields = fields
+
+
+class Reply:
+    """Особая кнопка шага: ответить text (ключ каталога) с клавиатурой keyboard и перейти в goto"""
+
+    def __init__(self, text, keyboard=None, goto=STAY, resize=False, value=None):
+        self.text = text
+        self.keyboard = keyboard
+        self.resize = resize
+        self.goto = goto
+        # Если задано, кнопка работает как ввод этого значения (например, «Пропустить»)
+        self.value = value
+
+    def markup(self, locale):
+        return ui.markup(self.keyboard, self.resize, locale=locale) if self.keyboard else None
+
+
+class Step:
+    """Один вопрос диалога; prompt — ключ каталога"""
+
+    def __init__(self, state, prompt, keyboard, field, validator=None, resize=False, actions=None,
+                 accepts_contact=False, max_attachments=0):
+        self.state = state
+        self.prompt = prompt
+        self.keyboard = keyboard
+        self.resize = resize
+        self.field = field
+        self.validator = validator
+        self.actions = dict(actions or {})
+        # Шаг принимает номер из «Поделиться контактом» вместо текста
+        self.accepts_contact = accepts_contact
+        # Сколько вложений принимает шаг; подпись к фото или документу считается ответом
+        self.max_attachments = max_attachments
+        self.flow = None
+        self.next = None
+        self.index = None
+
+    def markup(self, locale):
+        return ui.markup(self.keyboard, self.resize, locale=locale)
+
+
+class Flow:
+    """Диалог одной услуги: вход по кнопке главного меню, шаги и отправка заявки в канал
+
+    Кнопка главного меню — кнопка каталога с id name; intro, success и menu_prompt — ключи
+    каталога. Текст заявки для канала не переводится: шаблон компилируется один раз.
+    """
+
+    def __init__(self, name, intro, steps, channel, request_template, success,
+                 menu_prompt, menu_keyboard, defaults=None):
+        self.name = name
+        self.intro = intro
+        self.steps = steps
+        self.channel = channel
+        self.request_template = i18n.Template(request_template, defaults, missing='Не указано')
+        self.success = success
+        self.max_attachments = max(step.max_attachments for step in steps)
+        to_menu = Reply(menu_prompt, menu_keyboard, goto=ConversationHandler.END, resize=True)
+
+        previous = None
+        for index, step in enumerate(steps):
+            step.flow = self
+            step.index = index
+            if previous is None:
+                back = to_menu
+            else:
+                back = Reply(previous.prompt, previous.keyboard, goto=previous.state, resize=previous.resize)
+                previous.next = step
+            step.actions.setdefault(BACK, back)
+            previous = step
+
+    @property
+    def label(self):
+        """Надпись кнопки услуги на основном языке"""
+        return i18n.default().label(self.name)
+
+    async def enter(self, update, context):
+        """Точка входа: запоминает услугу и задает первый вопрос"""
+        context.user_data.service_type = self.name
+        context.user_data.funnel_step = 0
+        metrics.FUNNEL_REACHED.inc(self.name, self.steps[0].field)
+        first = self.steps[0]
+        lang = i18n.for_user(update.message.from_user)
+        await update.message.reply_text(lang.text(self.intro), parse_mode='HTML', reply_markup=first.markup(lang.locale))
+        return first.state
+
+    def render_request(self, user_data, user):
+        fields = dict(user_data)
+        fields['username'] = user.username or 'Не указан'
+        fields['first_name'] = user.first_name or 'Не указано'
+        fields['time'] = datetime.now().strftime('%Y-%m-%d %H:%M')
+        text = self.request_template.render(fields)
+        if fields.get('attachments'):
+            text += f"\n📎 Вложения: {attachments.describe(fields['attachments'])}"
+        return text
+
+    async def submit(self, update, context, respond=None):
+        """Последний шаг пройден: заявка ставится в очередь отправки в канал
+
+        Если подключен реестр ИНН, пользователь получает подтверждение сразу, а заявка
+        уходит в канал после запроса к реестру (он ограничен таймаутом). Повторы и
+        слишком частые заявки отсекаются submission_guard (см. dedup). Ответ пользователю
+        отправляет respond(text, parse_mode=...): по умолчанию — новым сообщением (reply),
+        инлайн-режим (см. inline) вместо этого редактирует сообщение формы.
+        """
+        if respond is None:
+            respond = partial(reply, update)
+        fields = context.user_data.to_dict()
+        # Данные заявки больше не нужны в сессии (и в хранилище состояний)
+        context.user_data.clear()
+        fields['chat_id'] = update.effective_chat.id
+        user = update.effective_user
+        guard = context.bot_data.get('submission_guard')
+        if guard is not None:
+            inn = fields.get('inn', '')
+            key = dedup.fingerprint(self.name, fields.get('phone'), inn if inn.isdigit() else '',
+                                    fields.get('equipment_model'))
+            verdict = await guard.check(key, user.id)
+            if verdict != dedup.ACCEPTED:
+                logger.info(f"Заявка {self.name} от {user.id} не отправлена: {verdict}")
+                await respond(i18n.for_user(user).text(verdict))
+                return ConversationHandler.END
+        metrics.FUNNEL_REACHED.inc(self.name, 'submitted')
+        events = context.bot_data.get('events')
+        if events is not None:
+            events.submit(self.name, fields.get('equipment_type'))
+        if context.bot_data.get('inn_enricher') is None or not fields.get('inn', '').isdigit():
+            self.dispatch(context, fields, user)
+        else:
+            context.application.create_task(self.enrich_and_dispatch(context, fields, user))
+        await respond(i18n.for_user(user).text(self.success), parse_mode='HTML')
+        return ConversationHandler.END
+
+    async def enrich_and_dispatch(self, context, fields, user):
+        info = await context.bot_data['inn_enricher'].enrich(fields['inn'])
+        if info is not None:
+            fields['organization'] = info.name
+            fields['organization_description'] = info.describe()
+        self.dispatch(context, fields, user)
+
+    def dispatch(self, context, fields, user):
+        """Сохраняет заявку в хранилище и ставит ее в очередь отправки в чаты по правилам маршрутизации"""
+        display = dict(fields)
+        if fields.get('organization_description'):
+            display['inn'] = f"{fields['inn']} ({fields['organization_description']})"
+        router = context.bot_data.get('router')
+        targets = router.route(self.name, fields.get('equipment_type'), fields.get('inn')) if router is not None else []
+        if not targets:
+            targets = [(None, self.channel)]
+        files = fields.get('attachments') or ()
+        extra = {}
+        tracker = context.bot_data.get('sla')
+        if tracker is not None:
+            ticket = tracker.open(self.name, [chat_id for _, chat_id in targets])
+            extra = {TICKET_KEY: ticket, 'reply_markup': sla.ack_markup(ticket)}
+        context.bot_data['delivery'].enqueue_many(
+            targets, self.render_request(display, user), followups=attachments.media_payloads(files), **extra
+        )
+        archiver = context.bot_data.get('archiver')
+        if archiver is not None and files:
+            context.application.create_task(archiver.archive(context.bot, user.id, files))
+
+        store = context.bot_data.get('request_store')
+        if store is not None:
+            inn = fields.get('inn', '')
+            store.add({
+                'service_type': self.name,
+                'user_id': user.id,
+                'chat_id': fields['chat_id'],
+                'username': user.username,
+                'first_name': user.first_name,
+                'equipment_type': fields.get('equipment_type'),
+                'equipment_model': fields.get('equipment_model'),
+                'problem_description': fields.get('problem_description'),
+                'purpose': fields.get('purpose'),
+                'phone': fields.get('phone'),
+                'email': fields.get('email'),
+                'inn': inn if inn.isdigit() else None,
+                'organization': fields.get('organization'),
+                'channel': ','.join(chat_id for _, chat_id in targets),
+            })
+
+
+async def reply(update, text, parse_mode=None):
+    """Ответ новым сообщением со скрытием клавиатуры"""
+    await update.message.reply_text(text, parse_mode=parse_mode, reply_markup=ui.REMOVE)
+
+
+async def handle_step(step, update, context):
+    """Общий обработчик всех шагов всех услуг"""
+    lang = i18n.for_user(update.message.from_user)
+    text = update.message.text
+    if text is None and update.message.contact is not None:
+        text = contact_phone(update.message.contact)
+    action = step.actions.get(lang.action(text))
+    if action is not None and action.value is None:
+        await update.message.reply_text(lang.text(action.text), reply_markup=action.markup(lang.locale))
+        return step.state if action.goto is STAY else action.goto
+
+    if action is not None:
+        value = action.value
+    else:
+        # Надпись кнопки-варианта (например, тип оборудования) сохраняется на основном языке
+        value = lang.value(text)
+        if step.validator is not None:
+            try:
+                value = step.validator(value)
+                if inspect.isawaitable(value):
+                    value = await value
+            except StepError as e:
+                markup = ui.markup(e.keyboard, locale=lang.locale) if e.keyboard else step.markup(lang.locale)
+                await update.message.reply_text(lang.text(e.text, **e.fields), parse_mode=e.parse_mode, reply_markup=markup)
+                return step.state
+    return await advance(step, value, update, context, lang)
+
+
+async def handle_media(step, update, context):
+    """Фото, документ или голосовое на шаге диалога
+
+    Первая часть альбома (или одиночный файл) на шаге с вложениями добавляется к заявке;
+    подпись или голосовое сообщение служат ответом на шаг, иначе бот просит описать
+    проблему текстом. Остальные части альбома дописываются молча, даже если диалог уже
+    перешел к следующему шагу.
+    """
+    message = update.message
+    session = context.user_data
+    lang = i18n.for_user(message.from_user)
+    group = message.media_group_id
+    continues_album = group is not None and group == session.media_group
+    if not continues_album and not step.max_attachments:
+        await message.reply_text(lang.text('text_expected'), reply_markup=step.markup(lang.locale))
+        return step.state
+    session.media_group = group
+
+    if session.attachments is None:
+        session.attachments = []
+    accepted = len(session.attachments) < step.flow.max_attachments
+    if accepted:
+        session.attachments.append(attachments.from_message(message))
+
+    if step.max_attachments and (message.caption or message.voice is not None):
+        return await advance(step, message.caption or VOICE_VALUE, update, context, lang)
+    if not continues_album:
+        if accepted:
+            await message.reply_text(lang.text('attachment_received'), reply_markup=step.markup(lang.locale))
+        else:
+            await message.reply_text(lang.text('attachments_full', limit=step.flow.max_attachments),
+                                     reply_markup=step.markup(lang.locale))
+    return step.state
+
+
+async def advance(step, value, update, context, lang):
+    """Сохраняет ответ на шаг и задает следующий вопрос (или отправляет заявку)"""
+    setattr(context.user_data, step.field, value)
+
+    if step.next is None:
+        return await step.flow.submit(update, context)
+    # В воронке учитываем только первый приход на шаг, возвраты «Назад» не в счет
+    if context.user_data.funnel_step < step.next.index:
+        context.user_data.funnel_step = step.next.index
+        metrics.FUNNEL_REACHED.inc(step.flow.name, step.next.field)
+    await update.message.reply_text(lang.text(step.next.prompt), reply_markup=step.next.markup(lang.locale))
+    return step.next.state
+
+
+class TrackedConversationHandler(ConversationHandler):
+    """ConversationHandler, который пишет переходы состояний в EventLog (см. analytics)
+
+    flow — имя услуги в событиях, state_names — {состояние: имя шага} в порядке шагов.
+    Перехватывается _update_state: через него проходят и переходы по ответам обработчиков,
+    и завершение диалогов извне (SessionSweeper, см. session.end_conversations).
+    """
+
+    __slots__ = ('events', 'flow', 'state_names')
+
+    def __init__(self, *args, events=None, flow='', state_names=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = events
+        self.flow = flow
+        self.state_names = state_names or {}
+
+    def _update_state(self, new_state, key, handler=None):
+        old_state = self._conversations.get(key)
+        super()._update_state(new_state, key, handler)
+        if self.events is None or new_state is None or new_state == old_state:
+            return
+        # Состояние неблокирующего обработчика еще не известно
+        if not isinstance(new_state, (int, str)):
+            return
+        self.events.transition(self.flow, self.state_names, getattr(old_state, 'old_state', old_state), new_state)
+
+
+def build_conversation(flow, fallbacks, persistent=False, events=None):
+    """Собирает ConversationHandler услуги из описания Flow; переходы по шагам пишутся в events"""
+    text_filter = filters.TEXT & ~filters.COMMAND
+    contact_filter = text_filter | filters.CONTACT
+    return TrackedConversationHandler(
+        entry_points=[MessageHandler(filters.Text(i18n.labels(flow.name)), metrics.timed(flow.enter, flow.name, 'enter'))],
+        states={
+            step.state: [
+                MessageHandler(
+                    contact_filter if step.accepts_contact else text_filter,
+                    metrics.timed(partial(handle_step, step), flow.name, step.field)
+                ),
+                MessageHandler(MEDIA_FILTER, metrics.timed(partial(handle_media, step), flow.name, step.field)),
+            ]
+            for step in flow.steps
+        },
+        fallbacks=fallbacks,
+        name=f'{flow.name}_conv',
+        persistent=persistent,
+        events=events,
+        flow=flow.name,
+        state_names={step.state: step.field for step in flow.steps}
+    )
+
+
+def escape(text):
+    """Экранирует пользовательский ввод для сообщений с parse_mode='HTML'"""
+    return html.escape(text, quote=False)
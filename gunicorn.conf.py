@@ -0,0 +1,29 @@
+"""Настройки gunicorn для продакшена.
+
+Запуск: gunicorn 'app:create_app()' -c gunicorn.conf.py (прежний 'app:app' тоже работает)
+
+Каждый воркер обслуживает веб-маршруты; бот работает только в воркере, захватившем
+LEADER_LOCK, остальные передают ему webhook-обновления через BOT_INBOX и отвечают на
+/health и /metrics по отметке и снимку метрик, которые лидер публикует там же.
+"""
+import os
+
+# Только нужное значение: имена уровня модуля gunicorn читает как свои настройки (config — одна из них)
+from config import SHUTDOWN_TIMEOUT
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Потоки внутри воркера: медленная выгрузка /admin не блокирует /health и webhook
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '4'))
+# Потоки не переживают fork, поэтому приложение (и поток бота) создается в каждом воркере
+preload_app = False
+# Воркер с ботом должен успеть дообработать обновления и отправить очередь
+graceful_timeout = int(SHUTDOWN_TIMEOUT) + 5
+timeout = 60
+
+
+def worker_exit(server, worker):
+    """Останавливает бота в воркере-лидере перед выходом"""
+    import app
+    app.stop_bot()
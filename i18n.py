@@ -0,0 +1,166 @@
+"""Локализация: каталоги сообщений и кнопок из LOCALES_DIR/<язык>.json.
+
+Формат каталога:
+    {"texts": {"welcome": "...", "urgent_unsupported": "... <b>{equipment}</b> ..."},
+     "buttons": {"back": "Назад", "urgent": "⚡️ СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ"}}
+
+Язык пользователя берется из language_code Telegram ('en-US' → 'en'); для неизвестных
+языков и отсутствующих в каталоге ключей используется основной каталог (ru). Каталоги
+загружаются один раз: тексты разбираются в Template, а для кнопок строится обратный
+индекс «надпись → id кнопки», так что разбор нажатия — один поиск в dict. Значения
+кнопок-вариантов сохраняются в заявке на основном языке (см. Catalog.value).
+"""
+import json
+import logging
+import os
+import string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCALE = 'ru'
+
+_parser = string.Formatter()
+
+
+class Template:
+    """Шаблон в синтаксисе str.format, разобранный один раз.
+
+    Поддерживаются простые имена полей, спецификация формата и преобразования !s, !r
+    и !u (верхний регистр). Отсутствующее или пустое поле берется из defaults, затем
+    missing; если и его нет — KeyError, как у str.format.
+    """
+
+    __slots__ = ('source', '_parts', '_defaults', '_missing')
+
+    def __init__(self, source, defaults=None, missing=None):
+        self.source = source
+        self._defaults = defaults or {}
+        self._missing = missing
+        self._parts = []
+        for literal, name, spec, conversion in _parser.parse(source):
+            if name is not None and not name.isidentifier():
+                raise ValueError(f'неподдерживаемое поле {{{name}}} в шаблоне {source!r}')
+            if conversion not in (None, 's', 'r', 'u'):
+                raise ValueError(f'неизвестное преобразование !{conversion} в шаблоне {source!r}')
+            self._parts.append((literal, name, spec, conversion))
+
+    def render(self, fields=None):
+        if len(self._parts) == 1 and self._parts[0][1] is None:
+            return self.source
+        fields = fields or {}
+        out = []
+        for literal, name, spec, conversion in self._parts:
+            out.append(literal)
+            if name is None:
+                continue
+            value = fields.get(name)
+            if value is None:
+                value = self._defaults.get(name, self._missing)
+                if value is None:
+                    raise KeyError(name)
+            if conversion == 'u':
+                value = str(value).upper()
+            elif conversion == 'r':
+                value = repr(value)
+            elif conversion == 's':
+                value = str(value)
+            out.append(format(value, spec) if spec else str(value))
+        return ''.join(out)
+
+
+class Catalog:
+    """Тексты и кнопки одного языка"""
+
+    __slots__ = ('locale', 'texts', 'buttons', 'actions', 'values')
+
+    def __init__(self, locale, data, fallback=None):
+        self.locale = locale
+        texts = dict(fallback.texts) if fallback else {}
+        texts.update((key, Template(text)) for key, text in data.get('texts', {}).items())
+        self.texts = texts
+        self.buttons = {**(fallback.buttons if fallback else {}), **data.get('buttons', {})}
+
+        # Обратный индекс: надписи основного языка тоже узнаются (клавиатура, открытая до
+        # смены языка в Telegram), но свои надписи языка важнее
+        actions = dict(fallback.actions) if fallback else {}
+        own = {}
+        for button_id, label in self.buttons.items():
+            if label in own:
+                raise ValueError(f'{locale}: надпись {label!r} у кнопок {own[label]} и {button_id}')
+            own[label] = button_id
+        actions.update(own)
+        self.actions = actions
+        # Надпись → значение для заявки: надпись той же кнопки на основном языке
+        base = fallback.buttons if fallback else self.buttons
+        self.values = {label: base[button_id] for label, button_id in actions.items()}
+
+    def text(self, key, **fields):
+        return self.texts[key].render(fields)
+
+    def label(self, button_id):
+        return self.buttons[button_id]
+
+    def action(self, label):
+        """id нажатой кнопки или None, если это не надпись кнопки"""
+        return self.actions.get(label)
+
+    def value(self, label):
+        """Ввод для сохранения в заявке: надпись кнопки переводится на основной язык"""
+        return self.values.get(label, label)
+
+
+_catalogs = None
+# language_code Telegram → Catalog
+_by_language = {}
+
+
+def load(path):
+    """Загружает все каталоги из каталога path; основной язык обязателен"""
+    with open(os.path.join(path, f'{DEFAULT_LOCALE}.json'), encoding='utf-8') as f:
+        default = Catalog(DEFAULT_LOCALE, json.load(f))
+    catalogs = {DEFAULT_LOCALE: default}
+    for filename in sorted(os.listdir(path)):
+        locale, ext = os.path.splitext(filename)
+        if ext != '.json' or locale == DEFAULT_LOCALE:
+            continue
+        with open(os.path.join(path, filename), encoding='utf-8') as f:
+            data = json.load(f)
+        missing = (default.texts.keys() - data.get('texts', {}).keys()) | (default.buttons.keys() - data.get('buttons', {}).keys())
+        if missing:
+            logger.warning(f"В каталоге {locale} нет переводов (будут на {DEFAULT_LOCALE}): {', '.join(sorted(missing))}")
+        catalogs[locale] = Catalog(locale, data, fallback=default)
+    logger.info(f"Загружены каталоги: {', '.join(catalogs)}")
+    return catalogs
+
+
+def catalogs():
+    """Каталоги из LOCALES_DIR (загружаются при первом обращении)"""
+    global _catalogs
+    if _catalogs is None:
+        import config
+        _catalogs = load(config.LOCALES_DIR)
+    return _catalogs
+
+
+def catalog(language_code=None):
+    """Каталог для language_code Telegram; неизвестный язык — основной каталог"""
+    cached = _by_language.get(language_code)
+    if cached is None:
+        available = catalogs()
+        locale = (language_code or DEFAULT_LOCALE).split('-')[0].lower()
+        cached = _by_language[language_code] = available.get(locale, available[DEFAULT_LOCALE])
+    return cached
+
+
+def for_user(user):
+    """Каталог на языке пользователя Telegram"""
+    return catalog(user.language_code if user is not None else None)
+
+
+def default():
+    return catalogs()[DEFAULT_LOCALE]
+
+
+def labels(button_id):
+    """Надписи кнопки на всех языках — для filters.Text точек входа"""
+    return frozenset(catalog.buttons[button_id] for catalog in catalogs().values())
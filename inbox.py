@@ -0,0 +1,160 @@
+"""Передача webhook-обновлений от веб-процессов процессу бота.
+
+Webhook может прийти в любой процесс gunicorn, а бот работает только в лидере
+(см. leader). Веб-маршрут проверяет обновление, записывает его в SQLite-таблицу inbox и
+сразу отвечает Telegram; InboxRelay в процессе бота забирает записи пачками в порядке
+поступления и кладет их в update_queue. Inbox ограничен max_size записями: если бот не
+успевает, маршрут отвечает 503 и Telegram повторяет доставку позже, а не копит очередь
+на диске. Заодно InboxRelay раз в секунду отмечает в той же базе, что бот жив, и
+публикует снимок его метрик — по ним /health и /metrics отвечают в процессах без бота.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Inbox:
+    """Таблица входящих обновлений и отметка жизни лидера"""
+
+    def __init__(self, path, max_size=None):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS inbox (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS heartbeat (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, ts REAL)'
+        )
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS metrics (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, ts REAL, body TEXT)'
+        )
+        self._conn.commit()
+
+    def put(self, data):
+        """Добавляет обновление; False, если в inbox уже max_size необработанных записей"""
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._lock, self._conn:
+            if self.max_size is None:
+                self._conn.execute('INSERT INTO inbox (payload) VALUES (?)', (payload,))
+                return True
+            # Подсчет и вставка в одной транзакции: другие процессы не превысят лимит между ними
+            cursor = self._conn.execute(
+                'INSERT INTO inbox (payload) SELECT ? WHERE (SELECT COUNT(*) FROM inbox) < ?',
+                (payload, self.max_size)
+            )
+            return cursor.rowcount == 1
+
+    def take(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, payload FROM inbox ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def delete(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM inbox WHERE id = ?', [(row_id,) for row_id in ids])
+
+    def beat(self, metrics_text=None):
+        """Отметка, что бот жив, и (если передан) снимок его метрик для /metrics других процессов"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO heartbeat (id, pid, ts) VALUES (1, ?, ?)', (os.getpid(), now))
+            if metrics_text is not None:
+                self._conn.execute('INSERT OR REPLACE INTO metrics (id, pid, ts, body) VALUES (1, ?, ?, ?)',
+                                   (os.getpid(), now, metrics_text))
+
+    def last_beat(self):
+        """(pid лидера, время последней отметки) или None"""
+        with self._lock:
+            return self._conn.execute('SELECT pid, ts FROM heartbeat WHERE id = 1').fetchone()
+
+    def leader_metrics(self):
+        """(pid лидера, время снимка, метрики в формате Prometheus) или None"""
+        with self._lock:
+            return self._conn.execute('SELECT pid, ts, body FROM metrics WHERE id = 1').fetchone()
+
+    def close(self):
+        self._conn.close()
+
+
+class InboxRelay:
+    """Фоновая задача бота: переносит обновления из Inbox в update_queue"""
+
+    def __init__(self, inbox, application, interval=0.1, batch_size=100, beat_interval=1.0):
+        self.inbox = inbox
+        self.application = application
+        self.interval = interval
+        self.batch_size = batch_size
+        self.beat_interval = beat_interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    @property
+    def alive(self):
+        """Задача переноса работает (для /health)"""
+        return self._task is not None and not self._task.done()
+
+    def _beat(self):
+        self.inbox.beat(metrics.render())
+
+    async def _run(self):
+        # Импорт здесь: веб-процессы без бота создают только Inbox и не загружают telegram
+        from telegram import Update
+        beaten = 0.0
+        while True:
+            try:
+                if time.monotonic() - beaten >= self.beat_interval:
+                    await asyncio.to_thread(self._beat)
+                    beaten = time.monotonic()
+                rows = await asyncio.to_thread(self.inbox.take, self.batch_size)
+                await self._relay(rows, Update)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения inbox: {e}")
+                rows = None
+            except Exception:
+                logger.exception("Ошибка переноса обновлений из inbox")
+                rows = None
+            if not rows:
+                await asyncio.sleep(self.interval)
+
+    async def _relay(self, rows, update_class):
+        """Передает записи в update_queue и удаляет из inbox все, что уже передано"""
+        done = []
+        try:
+            for row_id, data in rows:
+                try:
+                    update = update_class.de_json(data, self.application.bot)
+                except Exception as e:
+                    # Маршрут проверяет обновления, но запись могла попасть в inbox и раньше:
+                    # одна такая запись не должна останавливать перенос остальных
+                    logger.error(f"Запись inbox {row_id} не разобрана и удалена: {e!r}; {str(data)[:500]}")
+                    done.append(row_id)
+                    continue
+                # put, а не put_nowait: при заполненной очереди ждем, записи остаются в inbox
+                await self.application.update_queue.put(update)
+                done.append(row_id)
+        finally:
+            # И при остановке посреди пачки (put ждет места в очереди), и при ошибке переданные
+            # записи удаляются, иначе после перезапуска они придут повторно. Синхронно, чтобы
+            # повторная отмена задачи не прервала удаление
+            if done:
+                self.inbox.delete(done)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.inbox.close()
@@ -0,0 +1,375 @@
+"""Инлайн-режим диалогов (UI_MODE=inline): один экран, который редактируется на месте.
+
+Заявка строится из тех же описаний Flow, что и обычный режим (см. flows), но вопросы
+не задаются по одному:
+  * меню услуг — инлайн-кнопки под приветствием;
+  * все шаги с выбором из вариантов (тип оборудования, цель аренды) собраны на одном
+    экране выбора; выбранное отмечается ✅, экран сменяется, когда выбраны все;
+  * остальные поля (модель, описание, телефон, email, ИНН) заполняются формой: одно
+    сообщение, каждое поле с новой строки. Ошибочные поля остаются в форме, верные
+    сохраняются; необязательные поля в конце формы можно не указывать.
+
+Нажатие кнопки стоит двух вызовов Bot API (answerCallbackQuery и editMessageText),
+которые идут параллельно, а не нового сообщения на каждый шаг. Особая кнопка шага без
+значения (например, «Другое» при срочной подмене) переносит шаг в форму. Нажатия на устаревших экранах получают всплывающее уведомление.
+"""
+import asyncio
+import inspect
+import logging
+import warnings
+from functools import partial
+
+from telegram.error import BadRequest
+from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler, filters
+
+import attachments
+import i18n
+import metrics
+import ui
+from contacts import contact_phone
+from flows import BACK, MEDIA_FILTER, SKIP, STAY, VOICE_VALUE, StepError, TrackedConversationHandler, escape
+
+logger = logging.getLogger(__name__)
+
+# Состояния диалога (не пересекаются с состояниями обычного режима)
+MENU, CHOOSE, FORM = range(100, 103)
+
+
+def options(step):
+    """Ряды кнопок шага для экрана выбора: (id кнопки, своя ли это кнопка) без «Назад» и контакта"""
+    rows = []
+    for row in ui.KEYBOARDS[step.keyboard]:
+        buttons = []
+        for button in row:
+            action = step.actions.get(button)
+            if action is None and button not in ui.CONTACT_BUTTONS:
+                buttons.append((button, False))
+            elif action is not None and action.value is None and action.goto is STAY:
+                buttons.append((button, True))
+        if buttons:
+            rows.append(tuple(buttons))
+    return tuple(rows)
+
+
+def choice_steps(flow):
+    """Шаги услуги с вариантами выбора"""
+    return [step for step in flow.steps if any(not own for row in options(step) for _, own in row)]
+
+
+def services_markup(locale):
+    return ui.inline_markup(tuple(
+        tuple((button, f'svc:{button}', False) for button in row) for row in ui.KEYBOARDS['main_menu']
+    ), locale)
+
+
+def choice_markup(flow, session, locale):
+    default = i18n.default()
+    rows = []
+    for step in choice_steps(flow):
+        value = getattr(session, step.field)
+        for row in options(step):
+            rows.append(tuple(
+                (button, f'own:{step.index}', step.field in session.form) if own
+                else (button, f'opt:{step.index}:{button}', value is not None and value == default.label(button))
+                for button, own in row
+            ))
+    rows.append(((BACK, 'back', False),))
+    return ui.inline_markup(tuple(rows), locale)
+
+
+def optional(step):
+    """Значение, которым заполняется пропущенный необязательный шаг, или None"""
+    action = step.actions.get(SKIP)
+    return action.value if action is not None else None
+
+
+def form_text(flow, session, lang, errors=()):
+    """Текст формы: заполненные поля, ошибки и список полей, которые осталось ввести"""
+    lines = []
+    for step in flow.steps:
+        value = getattr(session, step.field)
+        if value is not None:
+            lines.append(f"✅ {lang.text('field_' + step.field)}: {escape(value)}")
+    if session.attachments:
+        lines.append(lang.text('form_attached', count=len(session.attachments)))
+    if lines:
+        lines.append('')
+    if errors:
+        lines += [f'⚠️ {error}' for error in errors] + ['']
+    lines.append(lang.text('form_rest' if lines else 'form_intro'))
+    steps = {step.field: step for step in flow.steps}
+    for number, field in enumerate(session.form, 1):
+        label = lang.text('field_' + field)
+        if optional(steps[field]) is not None:
+            label += f" ({lang.text('optional')})"
+        lines.append(f'{number}. {label}')
+    if any(steps[field].max_attachments for field in session.form):
+        lines += ['', lang.text('form_attachments')]
+    return '\n'.join(lines)
+
+
+def form_markup(locale):
+    return ui.inline_markup((((BACK, 'back', False),),), locale)
+
+
+def reach(flow, session):
+    """Воронка: отмечает шаги до первого незаполненного, как если бы их проходили по одному"""
+    index = next((step.index for step in flow.steps if getattr(session, step.field) is None), len(flow.steps) - 1)
+    for step in flow.steps[session.funnel_step + 1:index + 1]:
+        metrics.FUNNEL_REACHED.inc(flow.name, step.field)
+    session.funnel_step = max(session.funnel_step, index)
+
+
+async def show(context, chat_id, text, markup=None, message_id=None, parse_mode='HTML'):
+    """Редактирует экран message_id или, если это невозможно, отправляет новый; возвращает id экрана"""
+    if message_id is not None:
+        try:
+            await context.bot.edit_message_text(text, chat_id, message_id, parse_mode=parse_mode, reply_markup=markup)
+            return message_id
+        except BadRequest as e:
+            if 'not modified' in e.message:
+                return message_id
+            logger.info(f"Экран {message_id} в чате {chat_id} не отредактирован ({e.message}), отправляем новый")
+    message = await context.bot.send_message(chat_id, text, parse_mode=parse_mode, reply_markup=markup)
+    return message.message_id
+
+
+class Inline:
+    """Обработчики инлайн-режима для набора услуг"""
+
+    def __init__(self, flows):
+        self.flows = {flow.name: flow for flow in flows}
+
+    async def start(self, update, context):
+        """/start: приветствие с кнопками услуг"""
+        session = context.user_data
+        session.clear()
+        lang = i18n.for_user(update.effective_user)
+        session.form_message = await show(context, update.effective_chat.id, lang.text('welcome'),
+                                          services_markup(lang.locale))
+        return MENU
+
+    async def retry(self, update, context):
+        """Текст вместо нажатия кнопки: экран отправляется заново под сообщением пользователя"""
+        session = context.user_data
+        lang = i18n.for_user(update.effective_user)
+        flow = self.flows.get(session.service_type)
+        if flow is None:
+            text, markup, state = lang.text('menu_retry'), services_markup(lang.locale), MENU
+        else:
+            text, markup, state = lang.text(flow.intro), choice_markup(flow, session, lang.locale), CHOOSE
+        session.form_message = await show(context, update.effective_chat.id, text, markup)
+        return state
+
+    async def on_callback(self, handler, update, context):
+        """Общая часть нажатий: проверка экрана, ответ на callback параллельно с правкой экрана"""
+        query = update.callback_query
+        session = context.user_data
+        lang = i18n.for_user(update.effective_user)
+        if query.message is None or query.message.message_id != session.form_message:
+            await query.answer(lang.text('screen_expired'), show_alert=True)
+            return None
+        text, markup, state = await handler(query.data, session, lang)
+        _, session.form_message = await asyncio.gather(
+            query.answer(),
+            show(context, query.message.chat.id, text, markup, message_id=session.form_message),
+        )
+        return state
+
+    async def select_service(self, data, session, lang):
+        flow = self.flows[data.split(':', 1)[1]]
+        reset(session)
+        session.service_type = flow.name
+        session.form = []
+        metrics.FUNNEL_REACHED.inc(flow.name, flow.steps[0].field)
+        return self.next_screen(flow, session, lang)
+
+    async def select_option(self, data, session, lang):
+        flow = self.flows[session.service_type]
+        _, index, button = data.split(':', 2)
+        step = flow.steps[int(index)]
+        if step.field in session.form:
+            session.form.remove(step.field)
+        try:
+            value = await validate(step, i18n.default().label(button))
+        except StepError as e:
+            return lang.text(e.text, **e.fields), choice_markup(flow, session, lang.locale), CHOOSE
+        setattr(session, step.field, value)
+        return self.next_screen(flow, session, lang)
+
+    async def select_own(self, data, session, lang):
+        """«Свой вариант»: значение шага будет введено в форме"""
+        flow = self.flows[session.service_type]
+        step = flow.steps[int(data.split(':', 1)[1])]
+        setattr(session, step.field, None)
+        if step.field not in session.form:
+            session.form.append(step.field)
+        return self.next_screen(flow, session, lang)
+
+    async def back_to_menu(self, data, session, lang):
+        reset(session)
+        return lang.text('menu_prompt'), services_markup(lang.locale), MENU
+
+    async def back_to_choice(self, data, session, lang):
+        """«Назад» с формы: к экрану выбора, а если его у услуги нет — в меню услуг"""
+        flow = self.flows[session.service_type]
+        steps = choice_steps(flow)
+        if not steps:
+            return await self.back_to_menu(data, session, lang)
+        for step in steps:
+            setattr(session, step.field, None)
+        session.form = []
+        return lang.text(flow.intro), choice_markup(flow, session, lang.locale), CHOOSE
+
+    def in_form(self, flow, session):
+        return all(getattr(session, step.field) is not None or step.field in session.form for step in choice_steps(flow))
+
+    def next_screen(self, flow, session, lang):
+        """Экран выбора, пока не выбраны все варианты, затем форма остальных полей"""
+        reach(flow, session)
+        if not self.in_form(flow, session):
+            return lang.text(flow.intro), choice_markup(flow, session, lang.locale), CHOOSE
+        session.form = [step.field for step in flow.steps if getattr(session, step.field) is None]
+        return form_text(flow, session, lang), form_markup(lang.locale), FORM
+
+    async def fill(self, update, context, text=None, errors=()):
+        """Ответ на форму: строки сообщения по порядку заполняют оставшиеся поля"""
+        message = update.message
+        session = context.user_data
+        flow = self.flows[session.service_type]
+        lang = i18n.for_user(update.effective_user)
+        steps = {step.field: step for step in flow.steps}
+        if message.contact is not None:
+            pairs = [(steps[field], contact_phone(message.contact)) for field in session.form
+                     if steps[field].accepts_contact][:1]
+        else:
+            lines = [line.strip() for line in (text if text is not None else message.text).splitlines()]
+            pairs = list(zip((steps[field] for field in session.form), (line for line in lines if line)))
+
+        errors = list(errors)
+        for step, line in pairs:
+            action = step.actions.get(lang.action(line))
+            try:
+                value = action.value if action is not None and action.value is not None \
+                    else await validate(step, lang.value(line))
+            except StepError as e:
+                if e.keyboard:
+                    # Ошибка с вариантами ответа (например, перейти ли в ремонт) — ответ кнопками меню услуг
+                    reset(session)
+                    session.form_message = await show(context, update.effective_chat.id, lang.text(e.text, **e.fields),
+                                                      services_markup(lang.locale), message_id=session.form_message)
+                    return MENU
+                errors.append(lang.text(e.text, **e.fields))
+                continue
+            setattr(session, step.field, value)
+        session.form = [field for field in session.form if getattr(session, field) is None]
+        if not errors and all(optional(steps[field]) is not None for field in session.form):
+            for field in session.form:
+                setattr(session, field, optional(steps[field]))
+            session.form = []
+        reach(flow, session)
+
+        chat_id = update.effective_chat.id
+        if not session.form:
+            respond = partial(show, context, chat_id, message_id=session.form_message)
+            return await flow.submit(update, context, respond=respond)
+        session.form_message = await show(context, chat_id, form_text(flow, session, lang, errors),
+                                          form_markup(lang.locale), message_id=session.form_message)
+        return FORM
+
+    async def attach(self, update, context):
+        """Фото, документ или голосовое в форме: вложение к описанию проблемы, подпись — ответ на форму"""
+        message = update.message
+        session = context.user_data
+        flow = self.flows[session.service_type]
+        lang = i18n.for_user(update.effective_user)
+        step = next((step for step in flow.steps if step.max_attachments and step.field in session.form), None)
+        group = message.media_group_id
+        continues_album = group is not None and group == session.media_group
+        if step is None and not continues_album:
+            session.form_message = await show(context, update.effective_chat.id,
+                                              form_text(flow, session, lang, [lang.text('text_expected')]),
+                                              form_markup(lang.locale), message_id=session.form_message)
+            return FORM
+        session.media_group = group
+        if session.attachments is None:
+            session.attachments = []
+        errors = []
+        if len(session.attachments) < flow.max_attachments:
+            session.attachments.append(attachments.from_message(message))
+        else:
+            errors.append(lang.text('attachments_full', limit=flow.max_attachments))
+        if message.voice is not None and not message.caption and step is not None:
+            # Голосовое без подписи заменяет текстовое описание проблемы
+            setattr(session, step.field, VOICE_VALUE)
+            session.form.remove(step.field)
+        if message.caption or message.voice is not None:
+            return await self.fill(update, context, message.caption or '', errors)
+        if continues_album:
+            return FORM
+        session.form_message = await show(context, update.effective_chat.id, form_text(flow, session, lang, errors),
+                                          form_markup(lang.locale), message_id=session.form_message)
+        return FORM
+
+
+async def expired(update, context):
+    """Нажатие на экране, который больше не обслуживается (диалог завершен или сменился)"""
+    lang = i18n.for_user(update.effective_user)
+    await update.callback_query.answer(lang.text('screen_expired'), show_alert=True)
+
+
+def reset(session):
+    """Сбрасывает заявку, сохраняя id экрана: следующий экран редактирует тот же message"""
+    message = session.form_message
+    session.clear()
+    session.form_message = message
+
+
+async def validate(step, value):
+    if step.validator is None:
+        return value
+    value = step.validator(value)
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+def build_conversation(flows, fallbacks, persistent=False, events=None):
+    """Собирает ConversationHandler инлайн-режима для всех услуг; переходы экранов пишутся в events"""
+    inline = Inline(flows)
+    text_filter = filters.TEXT & ~filters.COMMAND
+
+    def callback(handler, pattern, name):
+        return CallbackQueryHandler(metrics.timed(partial(inline.on_callback, handler), 'inline', name), pattern=pattern)
+
+    choose_service = callback(inline.select_service, '^svc:', 'service')
+    # per_message=False: состояние хранится на пользователя, а не на сообщение (экран у
+    # пользователя один, устаревшие экраны отсекает on_callback). PTB предупреждает об этом
+    # при создании ConversationHandler с CallbackQueryHandler
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message=".*per_message=False.*")
+        return TrackedConversationHandler(
+            entry_points=[CommandHandler('start', metrics.timed(inline.start, 'inline', 'start')), choose_service],
+            states={
+                MENU: [MessageHandler(text_filter, metrics.timed(inline.retry, 'inline', 'menu'))],
+                CHOOSE: [
+                    callback(inline.select_option, '^opt:', 'option'),
+                    callback(inline.select_own, '^own:', 'own'),
+                    callback(inline.back_to_menu, '^back$', 'back'),
+                    MessageHandler(text_filter, metrics.timed(inline.retry, 'inline', 'choose')),
+                ],
+                FORM: [
+                    callback(inline.back_to_choice, '^back$', 'back'),
+                    MessageHandler(text_filter | filters.CONTACT, metrics.timed(inline.fill, 'inline', 'form')),
+                    MessageHandler(MEDIA_FILTER, metrics.timed(inline.attach, 'inline', 'attach')),
+                ],
+            },
+            fallbacks=fallbacks + [CallbackQueryHandler(expired)],
+            name='inline_conv',
+            persistent=persistent,
+            allow_reentry=True,
+            events=events,
+            flow='inline',
+            state_names={MENU: 'menu', CHOOSE: 'choose', FORM: 'form'}
+        )
+
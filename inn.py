@@ -0,0 +1,149 @@
+"""Проверка ИНН и получение сведений об организации из реестра.
+
+Реестр подключается через клиента с методом lookup(inn) -> OrgInfo | None:
+HttpRegistryClient ходит в HTTP API (INN_REGISTRY_URL), StaticRegistryClient отвечает
+из словаря (для локального запуска и проверок). InnEnricher ограничивает запрос по
+времени, кэширует ответы (TTL + LRU) и не делает параллельных запросов одного ИНН.
+"""
+import asyncio
+import logging
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+_WEIGHTS_10 = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+_WEIGHTS_11 = (7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+_WEIGHTS_12 = (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+
+
+def _check_digit(digits, weights):
+    return sum(d * w for d, w in zip(digits, weights)) % 11 % 10
+
+
+def validate_inn(inn):
+    """Проверяет валидность ИНН: 10 цифр (организация) или 12 (ИП) и контрольные цифры"""
+    if not inn.isdigit() or len(inn) not in (10, 12):
+        return False
+    digits = [int(ch) for ch in inn]
+    if len(digits) == 10:
+        return _check_digit(digits, _WEIGHTS_10) == digits[9]
+    return _check_digit(digits, _WEIGHTS_11) == digits[10] and _check_digit(digits, _WEIGHTS_12) == digits[11]
+
+
+def region_code(inn):
+    """Код региона налоговой, выдавшей ИНН (первые две цифры)"""
+    return inn[:2] if validate_inn(inn) else None
+
+
+class OrgInfo:
+    """Сведения об организации из реестра"""
+
+    __slots__ = ('name', 'region')
+
+    def __init__(self, name, region=None):
+        self.name = name
+        self.region = region
+
+    def describe(self):
+        return f'{self.name}, {self.region}' if self.region else self.name
+
+
+class StaticRegistryClient:
+    """Реестр из словаря {ИНН: OrgInfo}"""
+
+    def __init__(self, organizations=None):
+        self.organizations = dict(organizations or {})
+        self.lookups = 0
+
+    async def lookup(self, inn):
+        self.lookups += 1
+        return self.organizations.get(inn)
+
+    async def close(self):
+        pass
+
+
+class HttpRegistryClient:
+    """Реестр по HTTP: GET url_template.format(inn=...) возвращает JSON с полями name и region"""
+
+    def __init__(self, url_template, token=None, timeout=2.0):
+        self.url_template = url_template
+        self.token = token
+        self.timeout = timeout
+        self._client = None
+
+    @property
+    def client(self):
+        """httpx-клиент создается при первом запросе, а не при запуске бота (загрузка TLS-контекста небыстрая)"""
+        if self._client is None:
+            import httpx
+            headers = {'Authorization': f'Token {self.token}'} if self.token else {}
+            self._client = httpx.AsyncClient(headers=headers, timeout=self.timeout)
+        return self._client
+
+    async def lookup(self, inn):
+        response = await self.client.get(self.url_template.format(inn=inn))
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        data = response.json()
+        if not data or not data.get('name'):
+            return None
+        return OrgInfo(data['name'], data.get('region'))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class InnEnricher:
+    """Кэширующая обертка над клиентом реестра"""
+
+    def __init__(self, client, timeout=2.0, cache=None):
+        self.client = client
+        self.timeout = timeout
+        self.cache = cache if cache is not None else TTLCache()
+        self._inflight = {}
+
+    async def enrich(self, inn):
+        """Возвращает OrgInfo или None; ошибки и таймауты реестра не пробрасываются"""
+        if not validate_inn(inn):
+            return None
+        found, value = self.cache.get(inn)
+        if found:
+            return value
+        task = self._inflight.get(inn)
+        if task is None:
+            task = self._inflight[inn] = asyncio.ensure_future(self._lookup(inn))
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._inflight.pop(inn, None)
+
+    async def _lookup(self, inn):
+        try:
+            value = await asyncio.wait_for(self.client.lookup(inn), self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Реестр не ответил за {self.timeout} с для ИНН {inn}")
+            return None
+        except Exception as e:
+            logger.warning(f"Ошибка запроса к реестру для ИНН {inn}: {e}")
+            return None
+        self.cache.set(inn, value)
+        return value
+
+    async def close(self):
+        await self.client.close()
+
+
+def build_enricher(url_template, token=None, timeout=2.0, cache_size=10000, cache_ttl=86400):
+    """Создает InnEnricher для HTTP-реестра или возвращает None, если реестр не настроен"""
+    if not url_template:
+        return None
+    return InnEnricher(
+        HttpRegistryClient(url_template, token=token, timeout=timeout),
+        timeout=timeout,
+        cache=TTLCache(cache_size, cache_ttl)
+    )
@@ -0,0 +1,55 @@
+"""Выбор единственного процесса, в котором работает бот.
+
+Веб-сервер запускается в нескольких процессах (gunicorn), а бот должен быть один:
+два getUpdates с одним токеном мешают друг другу, два DeliveryQueue дублируют отправку.
+Процессы соревнуются за блокировку файла (flock); победитель запускает бота, остальные
+ждут в фоне и подхватывают роль, если лидер завершится (ОС снимает блокировку сама).
+"""
+import fcntl
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FileLeaderLock:
+    """Эксклюзивная блокировка файла на время жизни процесса"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def try_acquire(self):
+        """Пытается стать лидером, не блокируясь; True при успехе"""
+        if self._file is not None:
+            return True
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def acquire(self, stop_event, poll_interval=1.0):
+        """Ждет блокировку, пока не установлен stop_event (threading.Event); True при успехе"""
+        while not stop_event.is_set():
+            if self.try_acquire():
+                return True
+            stop_event.wait(poll_interval)
+        return False
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
@@ -1,9 +1,37 @@
+# Первым импортом: при STARTUP_PROFILE замеряет время всех следующих
+import startup
+
 import logging
 import os
+import ssl
 import asyncio
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, ConversationHandler, filters, ContextTypes
-from datetime import datetime
+
+import certifi
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, ConversationHandler, TypeHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+
+import analytics
+import broadcast
+import config
+import i18n
+import inline
+import metrics
+import sla
+import ui
+from concurrency import ChatOrderedProcessor
+from contacts import default_checker as default_email_checker, normalize_email, normalize_phone
+from dedup import build_guard
+from delivery import DeliveryQueue
+from equipment import default_matcher
+from inbox import Inbox, InboxRelay
+from inn import build_enricher, validate_inn
+from attachments import build_archiver
+from flows import SKIP, Flow, Reply, Step, StepError, TrackedConversationHandler, build_conversation, escape
+from persistence import build_persistence
+from routing import build_router
+from session import Session, SessionSweeper, touch as touch_session
+from storage import RequestStore
 
 # Настройка логирования
 logging.basicConfig(
@@ -12,7 +40,7 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ID каналов для заявок
+# Каналы услуг по умолчанию: если ни одно правило маршрутизации (ROUTES_FILE) не подошло
 CHANNEL_URGENT = "-1003409869914"
 CHANNEL_REPAIR = "-1003435204867"  
 CHANNEL_RENTAL = "-1003334937024"
@@ -24,523 +52,461 @@ REPAIR_TYPE, REPAIR_MODEL, REPAIR_PROBLEM, REPAIR_PHONE, REPAIR_EMAIL, REPAIR_IN
 RENTAL_PURPOSE, RENTAL_TYPE, RENTAL_MODEL, RENTAL_PHONE, RENTAL_EMAIL, RENTAL_INN = range(13, 19)
 AUDIT_PHONE, AUDIT_EMAIL, AUDIT_INN = range(19, 22)
 
-# Разрешенное оборудование для срочной подмены
-ALLOWED_EQUIPMENT = {
-    'узи': ['узи', 'ультразвук', 'ультразвуковой'],
-    'ивл': ['ивл', 'искусственная вентиляция легких', 'вентиляция легких'],
-    'эндоскопия': ['эндоскопия', 'эндоскоп', 'гастроскоп', 'бронхоскоп', 'колоноскоп'],
-    'нда': ['нда', 'наркозно дыхательный аппарат', 'анестезиологический', 'наркозный аппарат']
-}
-
-# Клавиатуры
-main_menu_keyboard = [['⚡️ СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ'], ['🔧 РЕМОНТ', '🧪 АРЕНДА ОБОРУДОВАНИЯ'], ['📊 БЕСПЛАТНЫЙ АУДИТ ОБОРУДОВАНИЯ']]
-urgent_type_keyboard = [['УЗИ', 'ИВЛ'], ['Эндоскопия', 'НДА'], ['Другое', 'Назад']]
-repair_type_keyboard = [['КТ', 'МРТ', 'Рентген'], ['УЗИ', 'ИВЛ', 'Эндоскопия'], ['НДА', 'Другое оборудование'], ['Назад']]
-rental_purpose_keyboard = [['Тестирование нового направления'], ['Для лицензии'], ['Временная подмена'], ['Назад']]
-back_only_keyboard = [['Назад']]
-yes_no_keyboard = [['Да', 'Нет'], ['Назад']]
-skip_keyboard = [['Пропустить'], ['Назад']]
-
 def check_equipment_type(user_input):
     """Проверяет, является ли оборудование разрешенным для срочной подмены"""
-    user_input = user_input.lower().strip()
-    for main_type, variants in ALLOWED_EQUIPMENT.items():
-        if any(variant in user_input for variant in variants):
-            return main_type
-    return None
-
-def validate_inn(inn):
-    """Проверяет валидность ИНН"""
-    if not inn.isdigit():
-        return False
-    if len(inn) not in [10, 12]:
-        return False
-    return True
+    return default_matcher().match(user_input)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = context.user_data
     user_data.clear()
-    await update.message.reply_text(
-        '🏥 <b>Аварийная МедТехника</b>\n\n'
-        '⚡️ Срочная подмена оборудования\n'
-        '🔧 Ремонт любой сложности\n'
-        '🧪 Аренда для развития клиники\n'
-        '📊 Бесплатный аудит оборудования\n\n'
-        'Решаем проблемы с оборудованием за 24 часа!\n\n'
-        'Выберите нужную услугу:',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True)
-    )
+    lang = i18n.for_user(update.message.from_user)
+    await update.message.reply_text(lang.text('welcome'), parse_mode='HTML', reply_markup=ui.markup('main_menu', resize=True, locale=lang.locale))
     return MAIN_MENU
 
-# ===== СРОЧНАЯ ПОДМЕНА =====
-async def urgent_replace(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    user_data['service_type'] = 'urgent'
-    await update.message.reply_text(
-        '⚡️ <b>СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ</b>\n\n'
-        'Мы предоставляем подмену на время ремонта:\n• УЗИ\n• ИВЛ\n• Эндоскопия\n• НДА\n\n'
-        'Выберите тип оборудования:',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(urgent_type_keyboard, one_time_keyboard=True, resize_keyboard=True)
-    )
-    return URGENT_TYPE
-
-async def urgent_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите услугу:', reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return MAIN_MENU
-    if text == 'Другое':
-        await update.message.reply_text('Укажите, какое именно оборудование вас интересует:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_TYPE
+def urgent_equipment(text):
+    """Валидатор шага выбора оборудования для срочной подмены"""
     equipment_type = check_equipment_type(text)
-    if equipment_type:
-        user_data['equipment_type'] = equipment_type
-        await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_MODEL
-    else:
-        if text not in ['УЗИ', 'ИВЛ', 'Эндоскопия', 'НДА']:
-            await update.message.reply_text(
-                f'К сожалению, мы не предоставляем срочную подмену для <b>{text}</b>. Но можем помочь с ремонтом или найти запчасти.\n\nХотите перейти в раздел ремонта?',
-                parse_mode='HTML',
-                reply_markup=ReplyKeyboardMarkup(yes_no_keyboard, one_time_keyboard=True)
-            )
-            return URGENT_TYPE
-        else:
-            user_data['equipment_type'] = text.lower()
-            await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-            return URGENT_MODEL
-
-async def urgent_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите тип оборудования:', reply_markup=ReplyKeyboardMarkup(urgent_type_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return URGENT_TYPE
-    user_data['equipment_model'] = text
-    await update.message.reply_text('Опишите проблему с оборудованием:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return URGENT_PROBLEM
-
-async def urgent_problem(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_MODEL
-    user_data['problem_description'] = text
-    await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return URGENT_PHONE
-
-async def urgent_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Опишите проблему с оборудованием:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_PROBLEM
-    user_data['phone'] = text
-    await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return URGENT_EMAIL
-
-async def urgent_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_PHONE
-    user_data['email'] = text
-    await update.message.reply_text('Введите ИНН вашей организации (необязательно):', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-    return URGENT_INN
-
-async def urgent_inn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return URGENT_EMAIL
-    if text == 'Пропустить':
-        user_data['inn'] = 'Не указан'
-    else:
-        if validate_inn(text):
-            user_data['inn'] = text
-        else:
-            await update.message.reply_text('ИНН должен содержать 10 или 12 цифр. Введите корректный ИНН или нажмите "Пропустить":', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-            return URGENT_INN
-    # Формируем заявку
-    username = update.message.from_user.username or "Не указан"
-    first_name = update.message.from_user.first_name or "Не указано"
-    request_text = (
-        f"🚨 СРОЧНАЯ ПОДМЕНА\n"
-        f"👤 Пользователь: @{username} ({first_name})\n"
-        f"📋 Оборудование: {user_data['equipment_type'].upper()}, {user_data.get('equipment_model', 'Не указано')}\n"
-        f"📝 Проблема: {user_data.get('problem_description', 'Не указано')}\n"
-        f"📞 Телефон: {user_data.get('phone', 'Не указан')}\n"
-        f"📧 Email: {user_data.get('email', 'Не указан')}\n"
-        f"🔢 ИНН: {user_data.get('inn', 'Не указан')}\n"
-        f"🕒 Время: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    )
-    await context.bot.send_message(chat_id=CHANNEL_URGENT, text=request_text)
-    await update.message.reply_text(
-        '✅ <b>Заявка принята!</b>\n\n📞 Консультант свяжется с вами в течение 15 минут для подбора модели и расчета персональных условий.\n\nДля новой заявки отправьте /start',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return ConversationHandler.END
-
-# ===== РЕМОНТ =====
-async def repair_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    user_data['service_type'] = 'repair'
-    await update.message.reply_text(
-        '🔧 <b>РЕМОНТ ОБОРУДОВАНИЯ</b>\n\n'
-        'Мы поможем с ремонтом любого медицинского оборудования:\n'
-        '• КТ, МРТ, Рентген\n• УЗИ, ИВЛ, Эндоскопия\n• НДА и другое оборудование\n\n'
-        'Выберите тип оборудования:',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(repair_type_keyboard, one_time_keyboard=True, resize_keyboard=True)
-    )
-    return REPAIR_TYPE
+    if equipment_type is None:
+        raise StepError('urgent_unsupported', keyboard='yes_no', parse_mode='HTML', equipment=escape(text))
+    return equipment_type
+
+def inn_field(text):
+    """Валидатор шага ввода ИНН"""
+    if not validate_inn(text):
+        raise StepError('inn_invalid')
+    return text
+
+def phone_field(text):
+    """Валидатор шага ввода телефона: приводит номер к E.164 (+7XXXXXXXXXX для России и Казахстана)"""
+    phone = normalize_phone(text)
+    if phone is None:
+        raise StepError('phone_invalid')
+    return phone
+
+async def email_field(text):
+    """Валидатор шага ввода email: синтаксис и, если включено, MX-запись домена"""
+    email = normalize_email(text)
+    if email is None:
+        raise StepError('email_invalid')
+    checker = default_email_checker()
+    if checker is not None and not await checker.domain_accepts_mail(email.rsplit('@', 1)[1]):
+        raise StepError('email_no_mx')
+    return email
+
+# ===== ОПИСАНИЕ УСЛУГ =====
+# Тексты вопросов и ответов — ключи каталогов data/locales (см. i18n), кнопка услуги — кнопка каталога с id услуги
+# Значения полей заявки, если пользователь их не заполнил
+REQUEST_DEFAULTS = {
+    'equipment_model': 'Не указано',
+    'problem_description': 'Не указано',
+    'phone': 'Не указан',
+    'email': 'Не указан',
+    'inn': 'Не указан',
+}
 
-async def repair_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите услугу:', reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return MAIN_MENU
-    user_data['equipment_type'] = text
-    await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return REPAIR_MODEL
-
-async def repair_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите тип оборудования:', reply_markup=ReplyKeyboardMarkup(repair_type_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return REPAIR_TYPE
-    user_data['equipment_model'] = text
-    await update.message.reply_text('Опишите проблему с оборудованием:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return REPAIR_PROBLEM
-
-async def repair_problem(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return REPAIR_MODEL
-    user_data['problem_description'] = text
-    await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return REPAIR_PHONE
-
-async def repair_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Опишите проблему с оборудованием:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return REPAIR_PROBLEM
-    user_data['phone'] = text
-    await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return REPAIR_EMAIL
-
-async def repair_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return REPAIR_PHONE
-    user_data['email'] = text
-    await update.message.reply_text('Введите ИНН вашей организации (необязательно):', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-    return REPAIR_INN
-
-async def repair_inn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return REPAIR_EMAIL
-    if text == 'Пропустить':
-        user_data['inn'] = 'Не указан'
-    else:
-        if validate_inn(text):
-            user_data['inn'] = text
-        else:
-            await update.message.reply_text('ИНН должен содержать 10 или 12 цифр. Введите корректный ИНН или нажмите "Пропустить":', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-            return REPAIR_INN
-    # Формируем заявку
-    username = update.message.from_user.username or "Не указан"
-    first_name = update.message.from_user.first_name or "Не указано"
-    request_text = (
-        f"🔧 ЗАЯВКА НА РЕМОНТ\n"
-        f"👤 Пользователь: @{username} ({first_name})\n"
-        f"📋 Оборудование: {user_data['equipment_type']}, {user_data.get('equipment_model', 'Не указано')}\n"
-        f"📝 Проблема: {user_data.get('problem_description', 'Не указано')}\n"
-        f"📞 Телефон: {user_data.get('phone', 'Не указан')}\n"
-        f"📧 Email: {user_data.get('email', 'Не указан')}\n"
-        f"🔢 ИНН: {user_data.get('inn', 'Не указан')}\n"
-        f"🕒 Время: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    )
-    await context.bot.send_message(chat_id=CHANNEL_REPAIR, text=request_text)
-    await update.message.reply_text(
-        '✅ <b>Заявка принята!</b>\n\n📞 Консультант свяжется с вами в течение 15 минут для уточнения деталей.\n\nДля новой заявки отправьте /start',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return ConversationHandler.END
+def contact_steps(phone_state, email_state, inn_state):
+    """Общие для всех услуг шаги: телефон, email и ИНН"""
+    return [
+        Step(phone_state, 'ask_phone', 'phone', 'phone',
+             validator=phone_field, accepts_contact=True),
+        Step(email_state, 'ask_email', 'back_only', 'email', validator=email_field),
+        Step(inn_state, 'ask_inn', 'skip', 'inn',
+             validator=inn_field, actions={SKIP: Reply(None, value='Не указан')}),
+    ]
+
+URGENT_FLOW = Flow(
+    name='urgent',
+    intro='urgent_intro',
+    steps=[
+        Step(URGENT_TYPE, 'ask_equipment_type', 'urgent_type', 'equipment_type',
+             validator=urgent_equipment, resize=True, actions={
+                 'other': Reply('ask_other_equipment', 'back_only'),
+                 'yes': Reply('choose_repair', 'main_menu', goto=ConversationHandler.END, resize=True),
+                 'no': Reply('ask_equipment_type', 'urgent_type', resize=True),
+             }),
+        Step(URGENT_MODEL, 'ask_model', 'back_only', 'equipment_model'),
+        Step(URGENT_PROBLEM, 'ask_problem', 'back_only', 'problem_description',
+             max_attachments=config.ATTACHMENTS_LIMIT),
+        *contact_steps(URGENT_PHONE, URGENT_EMAIL, URGENT_INN),
+    ],
+    channel=CHANNEL_URGENT,
+    request_template=(
+        "🚨 СРОЧНАЯ ПОДМЕНА\n"
+        "👤 Пользователь: @{username} ({first_name})\n"
+        "📋 Оборудование: {equipment_type!u}, {equipment_model}\n"
+        "📝 Проблема: {problem_description}\n"
+        "📞 Телефон: {phone}\n"
+        "📧 Email: {email}\n"
+        "🔢 ИНН: {inn}\n"
+        "🕒 Время: {time}"
+    ),
+    success='urgent_success',
+    menu_prompt='menu_prompt',
+    menu_keyboard='main_menu',
+    defaults=REQUEST_DEFAULTS
+)
 
-# ===== АРЕНДА =====
-async def rental_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    user_data['service_type'] = 'rental'
-    await update.message.reply_text(
-        '🧪 <b>АРЕНДА ОБОРУДОВАНИЯ</b>\n\n'
-        'Аренда оборудования для:\n• Тестирования нового направления\n• Для лицензии\n• Временной подмены\n\n'
-        'Выберите цель аренды:',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(rental_purpose_keyboard, one_time_keyboard=True, resize_keyboard=True)
-    )
-    return RENTAL_PURPOSE
+REPAIR_FLOW = Flow(
+    name='repair',
+    intro='repair_intro',
+    steps=[
+        Step(REPAIR_TYPE, 'ask_equipment_type', 'repair_type', 'equipment_type', resize=True),
+        Step(REPAIR_MODEL, 'ask_model', 'back_only', 'equipment_model'),
+        Step(REPAIR_PROBLEM, 'ask_problem', 'back_only', 'problem_description',
+             max_attachments=config.ATTACHMENTS_LIMIT),
+        *contact_steps(REPAIR_PHONE, REPAIR_EMAIL, REPAIR_INN),
+    ],
+    channel=CHANNEL_REPAIR,
+    request_template=(
+        "🔧 ЗАЯВКА НА РЕМОНТ\n"
+        "👤 Пользователь: @{username} ({first_name})\n"
+        "📋 Оборудование: {equipment_type}, {equipment_model}\n"
+        "📝 Проблема: {problem_description}\n"
+        "📞 Телефон: {phone}\n"
+        "📧 Email: {email}\n"
+        "🔢 ИНН: {inn}\n"
+        "🕒 Время: {time}"
+    ),
+    success='repair_success',
+    menu_prompt='menu_prompt',
+    menu_keyboard='main_menu',
+    defaults=REQUEST_DEFAULTS
+)
 
-async def rental_purpose(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите услугу:', reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return MAIN_MENU
-    user_data['purpose'] = text
-    await update.message.reply_text('Введите тип оборудования:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return RENTAL_TYPE
-
-async def rental_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите цель аренды:', reply_markup=ReplyKeyboardMarkup(rental_purpose_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return RENTAL_PURPOSE
-    user_data['equipment_type'] = text
-    await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return RENTAL_MODEL
-
-async def rental_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите тип оборудования:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return RENTAL_TYPE
-    user_data['equipment_model'] = text
-    await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return RENTAL_PHONE
-
-async def rental_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите модель аппарата:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return RENTAL_MODEL
-    user_data['phone'] = text
-    await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return RENTAL_EMAIL
-
-async def rental_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return RENTAL_PHONE
-    user_data['email'] = text
-    await update.message.reply_text('Введите ИНН вашей организации (необязательно):', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-    return RENTAL_INN
-
-async def rental_inn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return RENTAL_EMAIL
-    if text == 'Пропустить':
-        user_data['inn'] = 'Не указан'
-    else:
-        if validate_inn(text):
-            user_data['inn'] = text
-        else:
-            await update.message.reply_text('ИНН должен содержать 10 или 12 цифр. Введите корректный ИНН или нажмите "Пропустить":', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-            return RENTAL_INN
-    # Формируем заявку
-    username = update.message.from_user.username or "Не указан"
-    first_name = update.message.from_user.first_name or "Не указано"
-    request_text = (
-        f"🧪 ЗАЯВКА НА АРЕНДУ\n"
-        f"👤 Пользователь: @{username} ({first_name})\n"
-        f"🎯 Цель: {user_data['purpose']}\n"
-        f"📋 Оборудование: {user_data['equipment_type']}, {user_data.get('equipment_model', 'Не указано')}\n"
-        f"📞 Телефон: {user_data.get('phone', 'Не указан')}\n"
-        f"📧 Email: {user_data.get('email', 'Не указан')}\n"
-        f"🔢 ИНН: {user_data.get('inn', 'Не указан')}\n"
-        f"🕒 Время: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    )
-    await context.bot.send_message(chat_id=CHANNEL_RENTAL, text=request_text)
-    await update.message.reply_text(
-        '✅ <b>Заявка принята!</b>\n\n📞 Консультант свяжется с вами в течение 15 минут для подбора оборудования.\n\nДля новой заявки отправьте /start',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return ConversationHandler.END
+RENTAL_FLOW = Flow(
+    name='rental',
+    intro='rental_intro',
+    steps=[
+        Step(RENTAL_PURPOSE, 'ask_purpose', 'rental_purpose', 'purpose', resize=True),
+        Step(RENTAL_TYPE, 'ask_rental_equipment', 'back_only', 'equipment_type'),
+        Step(RENTAL_MODEL, 'ask_model', 'back_only', 'equipment_model'),
+        *contact_steps(RENTAL_PHONE, RENTAL_EMAIL, RENTAL_INN),
+    ],
+    channel=CHANNEL_RENTAL,
+    request_template=(
+        "🧪 ЗАЯВКА НА АРЕНДУ\n"
+        "👤 Пользователь: @{username} ({first_name})\n"
+        "🎯 Цель: {purpose}\n"
+        "📋 Оборудование: {equipment_type}, {equipment_model}\n"
+        "📞 Телефон: {phone}\n"
+        "📧 Email: {email}\n"
+        "🔢 ИНН: {inn}\n"
+        "🕒 Время: {time}"
+    ),
+    success='rental_success',
+    menu_prompt='menu_prompt',
+    menu_keyboard='main_menu',
+    defaults=REQUEST_DEFAULTS
+)
 
-# ===== АУДИТ =====
-async def audit_service(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    user_data['service_type'] = 'audit'
-    await update.message.reply_text(
-        '📊 <b>БЕСПЛАТНЫЙ АУДИТ ОБОРУДОВАНИЯ</b>\n\n'
-        'Мы проведем анализ:\n• Рисков простоя оборудования\n• Планов по замене\n• Оптимизации парка\n\n'
-        'Введите ваш телефон для связи:',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True)
-    )
-    return AUDIT_PHONE
+AUDIT_FLOW = Flow(
+    name='audit',
+    intro='audit_intro',
+    steps=contact_steps(AUDIT_PHONE, AUDIT_EMAIL, AUDIT_INN),
+    channel=CHANNEL_AUDIT,
+    request_template=(
+        "📊 ЗАЯВКА НА АУДИТ\n"
+        "👤 Пользователь: @{username} ({first_name})\n"
+        "📞 Телефон: {phone}\n"
+        "📧 Email: {email}\n"
+        "🔢 ИНН: {inn}\n"
+        "🕒 Время: {time}"
+    ),
+    success='audit_success',
+    menu_prompt='menu_prompt',
+    menu_keyboard='main_menu',
+    defaults=REQUEST_DEFAULTS
+)
 
-async def audit_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Выберите услугу:', reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return MAIN_MENU
-    user_data['phone'] = text
-    await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-    return AUDIT_EMAIL
-
-async def audit_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш телефон для связи:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return AUDIT_PHONE
-    user_data['email'] = text
-    await update.message.reply_text('Введите ИНН вашей организации (необязательно):', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-    return AUDIT_INN
-
-async def audit_inn(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_data = context.user_data
-    text = update.message.text
-    if text == 'Назад':
-        await update.message.reply_text('Введите ваш email:', reply_markup=ReplyKeyboardMarkup(back_only_keyboard, one_time_keyboard=True))
-        return AUDIT_EMAIL
-    if text == 'Пропустить':
-        user_data['inn'] = 'Не указан'
-    else:
-        if validate_inn(text):
-            user_data['inn'] = text
-        else:
-            await update.message.reply_text('ИНН должен содержать 10 или 12 цифр. Введите корректный ИНН или нажмите "Пропустить":', reply_markup=ReplyKeyboardMarkup(skip_keyboard, one_time_keyboard=True))
-            return AUDIT_INN
-    # Формируем заявку
-    username = update.message.from_user.username or "Не указан"
-    first_name = update.message.from_user.first_name or "Не указано"
-    request_text = (
-        f"📊 ЗАЯВКА НА АУДИТ\n"
-        f"👤 Пользователь: @{username} ({first_name})\n"
-        f"📞 Телефон: {user_data.get('phone', 'Не указан')}\n"
-        f"📧 Email: {user_data.get('email', 'Не указан')}\n"
-        f"🔢 ИНН: {user_data.get('inn', 'Не указан')}\n"
-        f"🕒 Время: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    )
-    await context.bot.send_message(chat_id=CHANNEL_AUDIT, text=request_text)
-    await update.message.reply_text(
-        '✅ <b>Заявка принята!</b>\n\n📞 Консультант свяжется с вами в течение 15 минут для проведения аудита.\n\nДля новой заявки отправьте /start',
-        parse_mode='HTML',
-        reply_markup=ReplyKeyboardRemove()
-    )
-    return ConversationHandler.END
+# Порядок важен: обработчики услуг регистрируются в этом порядке
+FLOWS = [URGENT_FLOW, REPAIR_FLOW, RENTAL_FLOW, AUDIT_FLOW]
 
 # ===== ОБРАБОТКА ГЛАВНОГО МЕНЮ =====
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = update.message.text
-    if text == '⚡️ СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ':
-        return await urgent_replace(update, context)
-    elif text == '🔧 РЕМОНТ':
-        return await repair_service(update, context)
-    elif text == '🧪 АРЕНДА ОБОРУДОВАНИЯ':
-        return await rental_service(update, context)
-    elif text == '📊 БЕСПЛАТНЫЙ АУДИТ ОБОРУДОВАНИЯ':
-        return await audit_service(update, context)
-    else:
-        await update.message.reply_text('Пожалуйста, выберите вариант из меню:', reply_markup=ReplyKeyboardMarkup(main_menu_keyboard, one_time_keyboard=True, resize_keyboard=True))
-        return MAIN_MENU
+    # Кнопки услуг перехватывают ConversationHandler'ы услуг, сюда попадает только прочий текст
+    lang = i18n.for_user(update.message.from_user)
+    await update.message.reply_text(lang.text('menu_retry'), reply_markup=ui.markup('main_menu', resize=True, locale=lang.locale))
+    return MAIN_MENU
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text('Диалог прерван. Для начала отправьте /start', reply_markup=ReplyKeyboardRemove())
+async def restart(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/start посреди заявки: прерывает текущий диалог услуги и показывает меню"""
+    await start(update, context)
     return ConversationHandler.END
 
-async def main_async():
-    """Асинхронная версия основной функции"""
-    TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
-    application = Application.builder().token(TOKEN).build()
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(i18n.for_user(update.message.from_user).text('cancelled'), reply_markup=ui.REMOVE)
+    return ConversationHandler.END
 
-    # Обработчики для каждого типа услуг
-    urgent_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Text('⚡️ СРОЧНАЯ ПОДМЕНА ОБОРУДОВАНИЯ'), urgent_replace)],
-        states={
-            URGENT_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_type)],
-            URGENT_MODEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_model)],
-            URGENT_PROBLEM: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_problem)],
-            URGENT_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_phone)],
-            URGENT_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_email)],
-            URGENT_INN: [MessageHandler(filters.TEXT & ~filters.COMMAND, urgent_inn)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)]
+async def start_services(application):
+    """Запускает контроль event loop, очередь отправки заявок, контроль SLA, хранилище заявок,
+    клиента реестра ИНН, маршрутизацию, архив вложений, аналитику диалогов и рассылки"""
+    delivery = DeliveryQueue(
+        application.bot,
+        config.DELIVERY_SPOOL,
+        chat_rate=config.DELIVERY_CHAT_PER_MINUTE / 60,
+        chat_burst=config.DELIVERY_CHAT_BURST,
+        max_attempts=config.DELIVERY_MAX_ATTEMPTS
     )
-
-    repair_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Text('🔧 РЕМОНТ'), repair_service)],
-        states={
-            REPAIR_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_type)],
-            REPAIR_MODEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_model)],
-            REPAIR_PROBLEM: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_problem)],
-            REPAIR_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_phone)],
-            REPAIR_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_email)],
-            REPAIR_INN: [MessageHandler(filters.TEXT & ~filters.COMMAND, repair_inn)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)]
+    application.bot_data['loop_monitor'] = metrics.LoopMonitor(config.LOOP_MONITOR_INTERVAL).start()
+    if config.SESSION_TIMEOUT:
+        application.bot_data['session_sweeper'] = SessionSweeper(
+            application, config.SESSION_TIMEOUT, interval=config.SESSION_SWEEP_INTERVAL
+        ).start()
+    # Контроль SLA подключается до запуска очереди: восстановленные из буфера заявки тоже отмечаются
+    tracker = sla.build_tracker(config.SLA_DB, application, delivery, config.SLA_SECONDS, config.SLA_SERVICES,
+                                escalation_chat=config.SLA_ESCALATION_CHAT)
+    if tracker is not None:
+        delivery.on_sent = tracker.posted
+        application.bot_data['sla'] = tracker.start()
+    delivery.start()
+    application.bot_data['delivery'] = delivery
+    request_store = RequestStore(config.REQUESTS_DB, batch_size=config.REQUESTS_BATCH_SIZE)
+    request_store.start()
+    application.bot_data['request_store'] = request_store
+    application.bot_data['submission_guard'] = build_guard(
+        config.DEDUP_URL,
+        window=config.DEDUP_WINDOW,
+        user_limit=config.SUBMIT_LIMIT,
+        user_period=config.SUBMIT_PERIOD,
     )
-
-    rental_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Text('🧪 АРЕНДА ОБОРУДОВАНИЯ'), rental_service)],
-        states={
-            RENTAL_PURPOSE: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_purpose)],
-            RENTAL_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_type)],
-            RENTAL_MODEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_model)],
-            RENTAL_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_phone)],
-            RENTAL_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_email)],
-            RENTAL_INN: [MessageHandler(filters.TEXT & ~filters.COMMAND, rental_inn)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)]
+    application.bot_data['inn_enricher'] = build_enricher(
+        config.INN_REGISTRY_URL,
+        token=config.INN_REGISTRY_TOKEN,
+        timeout=config.INN_REGISTRY_TIMEOUT,
+        cache_size=config.INN_CACHE_SIZE,
+        cache_ttl=config.INN_CACHE_TTL
     )
-
-    audit_conv = ConversationHandler(
-        entry_points=[MessageHandler(filters.Text('📊 БЕСПЛАТНЫЙ АУДИТ ОБОРУДОВАНИЯ'), audit_service)],
-        states={
-            AUDIT_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, audit_phone)],
-            AUDIT_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, audit_email)],
-            AUDIT_INN: [MessageHandler(filters.TEXT & ~filters.COMMAND, audit_inn)],
-        },
-        fallbacks=[CommandHandler('cancel', cancel)]
+    application.bot_data['router'] = build_router(config.ROUTES_FILE, check_interval=config.ROUTES_RELOAD_INTERVAL)
+    application.bot_data['archiver'] = build_archiver(config.ATTACHMENTS_DIR, config.ATTACHMENTS_MAX_BYTES)
+    broadcaster = broadcast.build_broadcaster(
+        config.BROADCAST_DB,
+        application.bot,
+        config.REQUESTS_DB,
+        rate=config.BROADCAST_RATE,
+        burst=config.BROADCAST_BURST,
+        concurrency=config.BROADCAST_CONCURRENCY,
+        progress_interval=config.BROADCAST_PROGRESS_INTERVAL
     )
+    if broadcaster is not None:
+        application.bot_data['broadcaster'] = broadcaster.start()
+    events = application.bot_data.get('events')
+    if events is not None:
+        events.start()
+        aggregator = analytics.build_aggregator(config.EVENTS_LOG, config.ANALYTICS_DB, config.ANALYTICS_INTERVAL)
+        if aggregator is not None:
+            application.bot_data['analytics'] = aggregator.start()
+    # Каталог оборудования нужен только на шаге выбора срочной подмены: загружаем его в фоне
+    asyncio.get_running_loop().run_in_executor(None, default_matcher)
+    startup.mark('сервисы запущены')
+
+async def stop_services(application):
+    """Дожидается отправки очереди, дописывает заявки в хранилище и закрывает клиента реестра"""
+    # Рассылки первыми: начатые отправки дожидаются, прогресс сохраняется для продолжения после запуска
+    broadcaster = application.bot_data.pop('broadcaster', None)
+    if broadcaster is not None:
+        await broadcaster.stop()
+    enricher = application.bot_data.pop('inn_enricher', None)
+    if enricher is not None:
+        await enricher.close()
+    guard = application.bot_data.pop('submission_guard', None)
+    if guard is not None:
+        await guard.close()
+    archiver = application.bot_data.pop('archiver', None)
+    if archiver is not None:
+        await archiver.close()
+    delivery = application.bot_data.pop('delivery', None)
+    if delivery is not None:
+        await delivery.stop(config.DELIVERY_DRAIN_TIMEOUT)
+    # После очереди: доставленные при остановке заявки еще записываются в тикеты
+    tracker = application.bot_data.pop('sla', None)
+    if tracker is not None:
+        await tracker.stop()
+    request_store = application.bot_data.pop('request_store', None)
+    if request_store is not None:
+        await request_store.stop()
+    sweeper = application.bot_data.pop('session_sweeper', None)
+    if sweeper is not None:
+        await sweeper.stop()
+    # Журнал событий — после SessionSweeper (он тоже завершает диалоги), агрегатор — после журнала
+    events = application.bot_data.get('events')
+    if events is not None:
+        await events.stop()
+    aggregator = application.bot_data.pop('analytics', None)
+    if aggregator is not None:
+        await aggregator.stop()
+    monitor = application.bot_data.pop('loop_monitor', None)
+    if monitor is not None:
+        await monitor.stop()
+
+def build_application(persistence=None, request=None):
+    """Создает Application и регистрирует все обработчики
+
+    persistence по умолчанию берется из PERSISTENCE_URL; request позволяет подменить
+    HTTP-клиент Bot API (используется в бенчмарках).
+    """
+    startup.mark('модули бота загружены')
+    if config.UI_MODE not in ('reply', 'inline'):
+        raise ValueError(f'Неизвестный UI_MODE: {config.UI_MODE}')
+    TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
+    builder = Application.builder().token(TOKEN)
+    if config.BOT_API_URL:
+        builder = builder.base_url(f'{config.BOT_API_URL}/bot').base_file_url(f'{config.BOT_API_URL}/file/bot')
+    if persistence is None:
+        persistence = build_persistence(
+            config.PERSISTENCE_URL,
+            update_interval=config.PERSISTENCE_INTERVAL,
+            debounce=config.PERSISTENCE_DEBOUNCE
+        )
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if request is None:
+        # Оба HTTP-клиента Bot API используют один TLS-контекст: загрузка корневых
+        # сертификатов — заметная часть холодного старта. Размеры пулов — как в PTB по умолчанию
+        tls = ssl.create_default_context(cafile=certifi.where())
+        request = HTTPXRequest(connection_pool_size=256, httpx_kwargs={'verify': tls})
+        updates_request = HTTPXRequest(connection_pool_size=1, httpx_kwargs={'verify': tls})
+    else:
+        updates_request = request
+    builder = builder.request(request).get_updates_request(updates_request)
+    # Обновления разных чатов обрабатываются параллельно, одного чата — по порядку
+    builder = builder.concurrent_updates(ChatOrderedProcessor(config.UPDATE_WORKERS, config.UPDATE_QUEUE_SIZE))
+    builder = builder.update_queue(asyncio.Queue(config.UPDATE_QUEUE_SIZE))
+    builder = builder.post_init(start_services).post_stop(stop_services)
+    # user_data каждого пользователя — Session со слотами, а не dict
+    builder = builder.context_types(ContextTypes(user_data=Session))
+    application = builder.build()
+    ui.prebuild()
+    persistent = application.persistence is not None
+    # Журнал переходов диалогов для аналитики; запись в файл запускает start_services
+    events = analytics.build_log(config.EVENTS_LOG)
+    application.bot_data['events'] = events
+
+    # Подсчет всех входящих обновлений для /metrics (группа -1 не мешает остальным)
+    application.add_handler(TypeHandler(Update, metrics.count_update), group=-1)
+    # Время последней активности пользователя — по нему SessionSweeper удаляет брошенные заявки
+    application.add_handler(TypeHandler(Update, touch_session), group=-1)
+
+    # Подтверждение заявок сотрудниками в каналах: кнопка под заявкой или ответ на нее
+    application.add_handler(CallbackQueryHandler(sla.on_button, pattern=f'^{sla.ACK_PREFIX}'))
+    application.add_handler(MessageHandler(filters.REPLY & ~filters.ChatType.PRIVATE, sla.on_reply))
+    # Рассылки клиентам: команда только для администраторов и только в личном чате
+    if config.BROADCAST_ADMINS:
+        admins = filters.User(user_id=config.BROADCAST_ADMINS) & filters.ChatType.PRIVATE
+        application.add_handler(CommandHandler('broadcast', broadcast.on_command, filters=admins))
+
+    if config.UI_MODE == 'inline':
+        # Все услуги обслуживает один диалог на инлайн-кнопках; нажатия вне него — на устаревших экранах
+        application.add_handler(inline.build_conversation(FLOWS, [CommandHandler('cancel', cancel)],
+                                                          persistent=persistent, events=events))
+        application.add_handler(CallbackQueryHandler(inline.expired))
+        startup.mark('Application собран')
+        return application
+
+    # Обработчики для каждого типа услуг строятся из описаний FLOWS
+    service_fallbacks = [CommandHandler('cancel', cancel), CommandHandler('start', restart)]
+    for flow in FLOWS:
+        application.add_handler(build_conversation(flow, service_fallbacks, persistent=persistent, events=events))
 
     # Главный обработчик
-    main_conv = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+    main_conv = TrackedConversationHandler(
+        entry_points=[CommandHandler('start', metrics.timed(start, 'main', 'start'))],
         states={
-            MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)],
+            MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, metrics.timed(main_menu_handler, 'main', 'menu'))],
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[CommandHandler('cancel', cancel)],
+        name='main_conv',
+        persistent=persistent,
+        allow_reentry=True,
+        events=events,
+        flow='main',
+        state_names={MAIN_MENU: 'menu'}
     )
-
-    application.add_handler(urgent_conv)
-    application.add_handler(repair_conv)
-    application.add_handler(rental_conv)
-    application.add_handler(audit_conv)
     application.add_handler(main_conv)
-    
-    await application.run_polling()
+    startup.mark('Application собран')
+    return application
+
+async def start_application(application):
+    """Запускает уже инициализированное приложение с хуками, как это делает run_polling
+
+    Если задан BOT_INBOX, запускается перенос webhook-обновлений, принятых другими
+    процессами веб-сервера (см. inbox).
+    """
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    startup.mark('Application запущен')
+    if config.BOT_INBOX:
+        application.bot_data['inbox_relay'] = InboxRelay(
+            Inbox(config.BOT_INBOX), application, interval=config.INBOX_POLL_INTERVAL
+        ).start()
+
+async def stop_application(application):
+    """Останавливает приложение и вызывает post_stop
+
+    Порядок важен для корректного перезапуска: сначала останавливаются источники обновлений
+    (inbox и updater; updater.stop подтверждает Telegram offset полученных обновлений),
+    затем полученное дообрабатывается (не дольше UPDATES_DRAIN_TIMEOUT), post_stop
+    отправляет очередь в каналы, а выход из async with сохраняет состояние.
+    """
+    relay = application.bot_data.pop('inbox_relay', None)
+    if relay is not None:
+        await relay.stop()
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+        # Application.stop не ждет обновлений, уже переданных в processor
+        if isinstance(application.update_processor, ChatOrderedProcessor):
+            if not await application.update_processor.join(config.UPDATES_DRAIN_TIMEOUT):
+                logger.warning(f"Не все обновления обработаны за {config.UPDATES_DRAIN_TIMEOUT:.0f} с")
+    # post_stop вызывается и после неудачного запуска: stop_services закрывает только то, что успело запуститься
+    if application.post_stop:
+        await application.post_stop(application)
+
+async def start_updates(application):
+    """Подключает источник обновлений: webhook в Telegram или long-polling"""
+    if config.BOT_MODE == 'webhook':
+        await application.bot.set_webhook(
+            url=config.WEBHOOK_URL,
+            secret_token=config.WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook установлен: {config.WEBHOOK_URL}")
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        logger.info("Запущен long-polling")
+
+async def main_async(application=None, stop_event=None):
+    """Асинхронная версия основной функции
+
+    Получает обновления через getUpdates (BOT_MODE=polling) или ждет их в update_queue,
+    куда их кладет webhook-маршрут Flask (BOT_MODE=webhook). Работает до установки stop_event.
+    """
+    if config.BOT_MODE not in ('polling', 'webhook'):
+        raise ValueError(f'Неизвестный BOT_MODE: {config.BOT_MODE}')
+    if config.BOT_MODE == 'webhook' and not config.WEBHOOK_URL:
+        raise ValueError('Для BOT_MODE=webhook нужно указать WEBHOOK_URL')
+    if application is None:
+        application = build_application()
+    if stop_event is None:
+        stop_event = asyncio.Event()
+
+    async with application:
+        startup.mark('Application инициализирован (getMe, состояние диалогов)')
+        try:
+            # Сервисы и источник обновлений запускаются параллельно: полученные обновления
+            # ждут в update_queue, пока application.start не запустит их обработку
+            async with asyncio.TaskGroup() as group:
+                group.create_task(start_application(application))
+                group.create_task(start_updates(application))
+            startup.mark('бот готов принимать обновления')
+            startup.report()
+
+            await stop_event.wait()
+            logger.info("Останавливаем бота...")
+        finally:
+            # Останавливаемся и при ошибке, иначе выход из async with не сохранит состояние
+            await stop_application(application)
 
 def main():
     """Синхронная обертка для обратной совместимости"""
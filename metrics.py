@@ -0,0 +1,194 @@
+"""Метрики бота в текстовом формате Prometheus (маршрут /metrics).
+
+Счетчики и гистограммы пишутся из потока бота, читаются из потока Flask, поэтому
+каждая метрика защищена своей блокировкой. Метки передаются позиционно в порядке
+labelnames: HANDLER_SECONDS.observe(0.01, 'urgent', 'phone').
+
+Воронка: FUNNEL_REACHED считает пользователей, впервые дошедших до шага в текущей
+заявке; отток на шаге = reached(шаг) - reached(следующий шаг).
+"""
+import asyncio
+import bisect
+import threading
+import time
+from functools import wraps
+
+REGISTRY = []
+
+# Границы корзин гистограмм задержек, сек
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _format_labels(self, labels, extra=()):
+        pairs = [*zip(self.labelnames, labels), *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _render_value(self, labels, value):
+        return [f'{self.name}{self._format_labels(labels)} {value}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [счетчики по корзинам (последняя — +Inf), сумма, количество]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels):
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+    def _render_value(self, labels, value):
+        counts, total, count = value[0][:], value[1], value[2]
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip((*self.buckets, '+Inf'), counts):
+            cumulative += bucket
+            lines.append(f'{self.name}_bucket{self._format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{self._format_labels(labels)} {total}')
+        lines.append(f'{self.name}_count{self._format_labels(labels)} {count}')
+        return lines
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+UPDATES = Counter('bot_updates_total', 'Полученные обновления по типу', ['type'])
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Время обработки сообщения по услуге и шагу', ['flow', 'state'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Исключения в обработчиках по услуге и шагу', ['flow', 'state'])
+FUNNEL_REACHED = Counter('bot_funnel_reached_total', 'Пользователи, дошедшие до шага заявки', ['flow', 'step'])
+SEND_SECONDS = Histogram('bot_send_seconds', 'Время отправки сообщения в канал', ['channel'])
+SEND_ERRORS = Counter('bot_send_errors_total', 'Ошибки отправки сообщения в канал', ['channel', 'error'])
+LOOP_LAG = Histogram('bot_event_loop_lag_seconds', 'Задержка event loop бота относительно расписания')
+LOOP_HEARTBEAT = Gauge('bot_event_loop_heartbeat_timestamp', 'Время последней проверки event loop (unix)')
+ROUTE_MATCHED = Counter('bot_route_matched_total', 'Заявки, подошедшие под правило маршрутизации', ['rule'])
+ROUTE_SENT = Counter('bot_route_sent_total', 'Доставленные сообщения по правилу маршрутизации', ['rule'])
+ROUTE_FAILED = Counter('bot_route_failed_total', 'Недоставленные сообщения по правилу маршрутизации', ['rule'])
+SESSIONS = Gauge('bot_sessions', 'Сессии пользователей в памяти (на момент последней очистки)')
+SESSIONS_EXPIRED = Counter('bot_sessions_expired_total', 'Сессии, удаленные из-за неактивности')
+SLA_PENDING = Gauge('bot_sla_pending', 'Заявки с SLA, еще не взятые в работу')
+SLA_ACK_SECONDS = Histogram('bot_sla_ack_seconds', 'Время от заявки до подтверждения сотрудником', ['flow'],
+                            buckets=(60, 300, 600, 900, 1800, 3600, 7200, 14400, 43200, 86400))
+SLA_ESCALATED = Counter('bot_sla_escalated_total', 'Заявки, не взятые в работу за SLA', ['flow'])
+BROADCAST_MESSAGES = Counter('bot_broadcast_messages_total', 'Отправки сообщений рассылок по результату', ['result'])
+
+
+def timed(callback, flow, state):
+    """Оборачивает обработчик: время выполнения и исключения пишутся в метрики"""
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(flow, state)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, flow, state)
+    return wrapper
+
+
+async def count_update(update, context):
+    """Обработчик группы -1: считает все входящие обновления"""
+    if update.message is not None:
+        kind = 'message'
+    elif update.callback_query is not None:
+        kind = 'callback_query'
+    else:
+        kind = 'other'
+    UPDATES.inc(kind)
+
+
+class LoopMonitor:
+    """Периодически засыпает на interval и измеряет, насколько позже loop его разбудил"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last_beat = None
+        self._task = None
+
+    def start(self):
+        self.last_beat = time.time()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - started - self.interval))
+            self.last_beat = time.time()
+            LOOP_HEARTBEAT.set(self.last_beat)
+
+    def alive(self, max_age):
+        """Loop просыпался не позже max_age секунд назад"""
+        return self.last_beat is not None and time.time() - self.last_beat <= max_age
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
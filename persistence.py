@@ -0,0 +1,215 @@
+"""Хранение состояний диалогов и user_data между перезапусками.
+
+Бэкенд выбирается по PERSISTENCE_URL:
+    sqlite:///state.db      — локальный файл SQLite в режиме WAL
+    redis://host:6379/0     — Redis-совместимое хранилище (нужен пакет redis)
+Пустое значение отключает хранение.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from session import Session
+
+logger = logging.getLogger(__name__)
+
+# Виды записей в хранилище
+USER_DATA = 'user_data'
+CHAT_DATA = 'chat_data'
+BOT_DATA = 'bot_data'
+CONVERSATION = 'conversation'
+
+
+class SQLiteStore:
+    """Таблица ключ-значение в SQLite; пакет записей пишется одной транзакцией"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            'kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'PRIMARY KEY (kind, key))'
+        )
+        self._conn.commit()
+
+    async def load(self, kind):
+        rows = self._conn.execute('SELECT key, value FROM state WHERE kind = ?', (kind,)).fetchall()
+        return dict(rows)
+
+    async def write_batch(self, items):
+        """items: {(kind, key): value или None для удаления}"""
+        await asyncio.to_thread(self._write_batch, items)
+
+    def _write_batch(self, items):
+        upserts = [(kind, key, value) for (kind, key), value in items.items() if value is not None]
+        deletes = [(kind, key) for (kind, key), value in items.items() if value is None]
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    'INSERT INTO state (kind, key, value) VALUES (?, ?, ?) '
+                    'ON CONFLICT(kind, key) DO UPDATE SET value = excluded.value',
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany('DELETE FROM state WHERE kind = ? AND key = ?', deletes)
+
+    async def close(self):
+        self._conn.close()
+
+
+class RedisStore:
+    """Хранилище в Redis: по одному hash на вид записей, пакет пишется одним pipeline"""
+
+    def __init__(self, url, prefix='clinic_bot'):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError('Для PERSISTENCE_URL=redis://... установите пакет redis') from e
+        self._client = redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+
+    def _hash(self, kind):
+        return f'{self._prefix}:{kind}'
+
+    async def load(self, kind):
+        return await self._client.hgetall(self._hash(kind))
+
+    async def write_batch(self, items):
+        pipe = self._client.pipeline(transaction=True)
+        for (kind, key), value in items.items():
+            if value is None:
+                pipe.hdel(self._hash(kind), key)
+            else:
+                pipe.hset(self._hash(kind), key, value)
+        await pipe.execute()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class StorePersistence(BasePersistence):
+    """Persistence для Application поверх SQLiteStore/RedisStore.
+
+    Изменения не пишутся в хранилище сразу: они копятся в буфере (повторные изменения
+    одного ключа схлопываются) и сбрасываются одной транзакцией через debounce секунд
+    после первого изменения. Сам Application передает данные не чаще update_interval.
+    """
+
+    def __init__(self, store, update_interval=5, debounce=1.0):
+        super().__init__(
+            # bot_data хранит служебные объекты процесса (очередь отправки и т.п.), его не сохраняем;
+            # chat_data бот не использует — без него Application не заводит словарь на каждый чат
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        self.debounce = debounce
+        self._pending = {}
+        self._flush_task = None
+        # Записи в хранилище идут по одной: flush при остановке дожидается начатой
+        self._write_lock = asyncio.Lock()
+        self._conversations = {}
+
+    # ----- загрузка -----
+    async def _load_ints(self, kind):
+        return {int(key): json.loads(value) for key, value in (await self.store.load(kind)).items()}
+
+    async def get_user_data(self):
+        return {user_id: Session.from_dict(data) for user_id, data in (await self._load_ints(USER_DATA)).items()}
+
+    async def get_chat_data(self):
+        return await self._load_ints(CHAT_DATA)
+
+    async def get_bot_data(self):
+        value = (await self.store.load(BOT_DATA)).get('bot')
+        return json.loads(value) if value else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        if not self._conversations:
+            for key, value in (await self.store.load(CONVERSATION)).items():
+                conv_name, *conv_key = json.loads(key)
+                self._conversations.setdefault(conv_name, {})[tuple(conv_key)] = json.loads(value)
+        return self._conversations.get(name, {}).copy()
+
+    # ----- запись -----
+    def _schedule(self, kind, key, value):
+        self._pending[(kind, key)] = value
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.debounce)
+        # shield: отмена из flush не должна прерывать уже начатую запись (пакет потерялся бы)
+        await asyncio.shield(self._write_pending())
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            if not self._pending:
+                return
+            items, self._pending = self._pending, {}
+            try:
+                await self.store.write_batch(items)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояние ({len(items)} записей): {e}")
+                # Возвращаем записи в буфер, не затирая более свежие изменения
+                items.update(self._pending)
+                self._pending = items
+
+    async def update_user_data(self, user_id, data):
+        self._schedule(USER_DATA, str(user_id), json.dumps(data.to_dict(), ensure_ascii=False))
+
+    async def update_chat_data(self, chat_id, data):
+        self._schedule(CHAT_DATA, str(chat_id), json.dumps(data, ensure_ascii=False))
+
+    async def update_bot_data(self, data):
+        self._schedule(BOT_DATA, 'bot', json.dumps(data, ensure_ascii=False))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        store_key = json.dumps([name, *key])
+        self._schedule(CONVERSATION, store_key, None if new_state is None else json.dumps(new_state))
+
+    async def drop_user_data(self, user_id):
+        self._schedule(USER_DATA, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._schedule(CHAT_DATA, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+        await self.store.close()
+
+
+def build_persistence(url, update_interval=5, debounce=1.0):
+    """Создает persistence по URL хранилища или возвращает None, если хранение отключено"""
+    if not url:
+        return None
+    if url.startswith('sqlite:///'):
+        store = SQLiteStore(url[len('sqlite:///'):])
+    elif url.startswith(('redis://', 'rediss://', 'unix://')):
+        store = RedisStore(url)
+    else:
+        raise ValueError(f'Неподдерживаемый PERSISTENCE_URL: {url}')
+    return StorePersistence(store, update_interval=update_interval, debounce=debounce)
@@ -0,0 +1,199 @@
+"""Маршрутизация заявок по чатам: правила из JSON-файла, перечитываемого при изменении.
+
+Формат файла (ROUTES_FILE):
+    {
+      "on_call": {
+        "engineers": {"start": "2026-01-05T09:00", "shift_hours": 24, "chats": ["-100...", "-100..."]}
+      },
+      "rules": [
+        {"name": "urgent-night", "service": "urgent", "hours": "20:00-08:00", "on_call": "engineers"},
+        {"name": "moscow-ct", "service": "repair", "equipment": ["КТ", "МРТ"], "regions": ["77", "50"],
+         "chats": ["-100..."], "final": true},
+        {"name": "repair", "service": "repair", "chats": ["-1003435204867"]}
+      ]
+    }
+
+Все условия правила необязательны: service (строка или список), equipment (тип оборудования
+из заявки), regions (код региона по ИНН, см. inn.region_code), hours («ЧЧ:ММ-ЧЧ:ММ», через
+полночь тоже можно) и weekdays (1 — понедельник). Заявка уходит во все chats всех
+подходящих правил и дежурному из on_call (смена — shift_hours от start по кругу; start без
+смещения UTC — местное время сервера, со смещением, например «+03:00», — как указано);
+"final": true останавливает перебор. Если не подошло ни одно правило, заявка уходит в канал
+услуги по умолчанию (Flow.channel).
+
+При загрузке правила раскладываются в таблицу услуга → тип оборудования → список
+кандидатов в порядке файла, так что на заявку проверяются только регион и время
+нескольких правил. Ошибка в файле не ломает работу: остаются прежние правила.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from equipment import normalize
+from inn import region_code
+
+logger = logging.getLogger(__name__)
+
+
+def _as_set(value, convert=str):
+    if value is None:
+        return None
+    if isinstance(value, (str, int)):
+        value = [value]
+    return frozenset(convert(item) for item in value)
+
+
+def _minutes(text):
+    hours, minutes = text.strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+class _Rule:
+    __slots__ = ('name', 'services', 'equipment', 'regions', 'hours', 'weekdays', 'chats', 'on_call', 'final')
+
+    def __init__(self, data, rotations):
+        self.name = data['name']
+        self.services = _as_set(data.get('service'))
+        self.equipment = _as_set(data.get('equipment'), normalize)
+        self.regions = _as_set(data.get('regions'))
+        self.hours = None
+        if data.get('hours'):
+            start, end = data['hours'].split('-')
+            self.hours = (_minutes(start), _minutes(end))
+        self.weekdays = _as_set(data.get('weekdays'), int)
+        self.chats = tuple(str(chat) for chat in data.get('chats', ()))
+        self.on_call = rotations[data['on_call']] if data.get('on_call') else None
+        self.final = bool(data.get('final'))
+        if not self.chats and self.on_call is None:
+            raise ValueError(f'в правиле {self.name} не указаны chats или on_call')
+
+    def matches(self, region, now):
+        if self.regions is not None and region not in self.regions:
+            return False
+        if self.weekdays is not None and now.isoweekday() not in self.weekdays:
+            return False
+        if self.hours is not None:
+            minute = now.hour * 60 + now.minute
+            start, end = self.hours
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if not inside:
+                return False
+        return True
+
+    def targets(self, now):
+        if self.on_call is None:
+            return self.chats
+        return self.chats + (self.on_call.current(now),)
+
+
+class _Rotation:
+    """Дежурство: чаты сменяют друг друга каждые shift_hours часов начиная со start"""
+
+    __slots__ = ('start', 'shift', 'chats')
+
+    def __init__(self, data):
+        # Время со смещением: start с указанием UTC и без него сравниваются с текущим одинаково
+        self.start = datetime.fromisoformat(data['start']).astimezone()
+        self.shift = float(data.get('shift_hours', 24)) * 3600
+        self.chats = tuple(str(chat) for chat in data['chats'])
+        if not self.chats:
+            raise ValueError('пустой список дежурных чатов')
+
+    def current(self, now):
+        # naive now — местное время, как и naive start
+        shifts = int((now.astimezone() - self.start).total_seconds() // self.shift)
+        return self.chats[shifts % len(self.chats)]
+
+
+def compile_rules(config):
+    """Таблица {услуга или None: {тип оборудования или None: [правила]}}"""
+    rotations = {name: _Rotation(data) for name, data in config.get('on_call', {}).items()}
+    rules = [_Rule(data, rotations) for data in config.get('rules', [])]
+    services = {service for rule in rules if rule.services for service in rule.services}
+
+    table = {}
+    for service in [None, *services]:
+        candidates = [rule for rule in rules
+                      if rule.services is None or (service is not None and service in rule.services)]
+        kinds = {kind for rule in candidates if rule.equipment for kind in rule.equipment}
+        by_equipment = {None: [rule for rule in candidates if rule.equipment is None]}
+        for kind in kinds:
+            by_equipment[kind] = [rule for rule in candidates if rule.equipment is None or kind in rule.equipment]
+        table[service] = by_equipment
+    return table, len(rules)
+
+
+class Router:
+    """Скомпилированные правила маршрутизации с перезагрузкой при изменении файла"""
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = 0.0
+        self._table = {None: {None: []}}
+        self.reload()
+
+    def reload(self):
+        """Перечитывает файл правил; при ошибке остаются прежние правила"""
+        try:
+            # mtime запоминается и при ошибке: исправленный файл подхватится при следующем изменении
+            self._mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding='utf-8') as f:
+                config = json.load(f)
+            self._table, count = compile_rules(config)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Не удалось загрузить правила маршрутизации из {self.path}: {e}")
+            return
+        logger.info(f"Правила маршрутизации загружены: {count} из {self.path}")
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                logger.error(f"Не удалось проверить файл правил маршрутизации: {e}")
+                return
+            if mtime != self._mtime:
+                self.reload()
+
+    def route(self, service, equipment=None, inn=None, now=None):
+        """[(правило, chat_id)] без повторов чатов; пустой список — ни одно правило не подошло"""
+        self._maybe_reload()
+        by_equipment = self._table.get(service) or self._table[None]
+        kind = normalize(equipment) if equipment else None
+        rules = by_equipment[kind] if kind in by_equipment else by_equipment[None]
+        region = region_code(inn) if inn else None
+        now = now or datetime.now()
+
+        targets = []
+        seen = set()
+        for rule in rules:
+            if not rule.matches(region, now):
+                continue
+            metrics.ROUTE_MATCHED.inc(rule.name)
+            for chat_id in rule.targets(now):
+                if chat_id not in seen:
+                    seen.add(chat_id)
+                    targets.append((rule.name, chat_id))
+            if rule.final:
+                break
+        return targets
+
+
+def build_router(path, check_interval=5.0):
+    """Создает Router или возвращает None, если файл правил не задан"""
+    if not path:
+        return None
+    return Router(path, check_interval=check_interval)
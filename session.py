@@ -0,0 +1,141 @@
+"""Сессия пользователя: данные незаконченной заявки в context.user_data.
+
+Application создает для каждого пользователя Session (ContextTypes(user_data=Session))
+вместо dict: набор полей заявки известен заранее, а объект со __slots__ в несколько раз
+меньше словаря с теми же ключами. Незаполненные поля равны None.
+
+Пользователь может бросить заявку на любом шаге. SessionSweeper раз в interval находит
+сессии, не обновлявшиеся дольше ttl, завершает диалоги этих пользователей во всех
+ConversationHandler и удаляет сессии. Встроенный conversation_timeout не используется:
+он держит задачу JobQueue с последним обновлением и контекстом на каждый открытый
+диалог, это в несколько раз больше самой сессии.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram.ext import ConversationHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Поля заявки в порядке заполнения
+FIELDS = (
+    'service_type', 'funnel_step', 'equipment_type', 'equipment_model', 'problem_description',
+    'purpose', 'phone', 'email', 'inn', 'attachments', 'media_group', 'form', 'form_message',
+)
+
+
+class Session:
+    """Данные заявки одного пользователя и время его последнего обновления"""
+
+    __slots__ = FIELDS + ('touched',)
+
+    service_type: Optional[str]
+    # Дальний шаг, до которого пользователь дошел в текущей заявке (для воронки)
+    funnel_step: int
+    equipment_type: Optional[str]
+    equipment_model: Optional[str]
+    problem_description: Optional[str]
+    purpose: Optional[str]
+    phone: Optional[str]
+    email: Optional[str]
+    inn: Optional[str]
+    # Вложения к описанию проблемы (см. attachments.from_message) и media_group_id последнего альбома
+    attachments: Optional[list]
+    media_group: Optional[str]
+    # Инлайн-режим (см. inline): поля, которые пользователь вводит текстом, и id сообщения текущего экрана
+    form: Optional[list]
+    form_message: Optional[int]
+    # time.time() последнего обновления от пользователя
+    touched: float
+
+    def __init__(self):
+        self.clear()
+        self.touched = time.time()
+
+    def clear(self):
+        """Сбрасывает поля заявки (время обновления не меняется)"""
+        for name in FIELDS:
+            setattr(self, name, None)
+        self.funnel_step = 0
+
+    def to_dict(self):
+        """Заполненные поля и время обновления"""
+        data = {name: getattr(self, name) for name in FIELDS if getattr(self, name) is not None}
+        data['touched'] = self.touched
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Обратно к to_dict; неизвестные ключи (например, из старого формата user_data) пропускаются"""
+        session = cls()
+        for name in FIELDS:
+            if data.get(name) is not None:
+                setattr(session, name, data[name])
+        if data.get('touched'):
+            session.touched = data['touched']
+        return session
+
+    def __repr__(self):
+        return f'Session({self.to_dict()!r})'
+
+
+async def touch(update, context):
+    """Обработчик группы -1: отмечает активность пользователя"""
+    if context.user_data is not None:
+        context.user_data.touched = time.time()
+
+
+def end_conversations(application, user_ids):
+    """Завершает диалоги пользователей user_ids во всех ConversationHandler приложения"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not isinstance(handler, ConversationHandler) or not handler.per_user:
+                continue
+            position = 1 if handler.per_chat else 0
+            # Публичного способа завершить диалог извне в PTB нет. _update_state(END) делает то же,
+            # что сам ConversationHandler по таймауту; для persistent-диалогов удаление попадет в хранилище
+            for key in [key for key in handler._conversations if key[position] in user_ids]:
+                handler._update_state(handler.END, key)
+
+
+class SessionSweeper:
+    """Фоновая задача: раз в interval завершает диалоги и удаляет сессии, не обновлявшиеся дольше ttl"""
+
+    def __init__(self, application, ttl, interval=60.0, clock=time.time):
+        self.application = application
+        self.ttl = ttl
+        self.interval = interval
+        self.clock = clock
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.sweep()
+
+    def sweep(self):
+        """Удаляет просроченные сессии (и из persistence); возвращает их количество"""
+        deadline = self.clock() - self.ttl
+        expired = {user_id for user_id, session in self.application.user_data.items() if session.touched < deadline}
+        if expired:
+            end_conversations(self.application, expired)
+        for user_id in expired:
+            self.application.drop_user_data(user_id)
+        metrics.SESSIONS.set(len(self.application.user_data))
+        if expired:
+            metrics.SESSIONS_EXPIRED.inc(amount=len(expired))
+            logger.info(f"Удалено неактивных сессий: {len(expired)}")
+        return len(expired)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -0,0 +1,251 @@
+"""Контроль обещанного времени ответа на заявки (SLA).
+
+Каждая отправленная заявка получает номер (тикет) в SQLite (SLA_DB), а ее сообщение в
+канале — кнопку «Взять в работу». Сотрудник подтверждает заявку этой кнопкой или
+ответом (reply) на сообщение заявки. Если заявка услуги из SLA_SERVICES не подтверждена
+за SLA_SECONDS, в чаты заявки (ответом на ее сообщение) и в SLA_ESCALATION_CHAT уходит
+напоминание.
+
+Сроки неподтвержденных заявок лежат в куче (heapq) в памяти, а в JobQueue приложения
+стоит одна задача — на ближайший срок. Добавление и срабатывание стоят O(log n) и не
+требуют просмотра всех таймеров; подтвержденные заявки удаляются из кучи лениво, когда
+до них доходит очередь. Сроки хранятся в SQLite и после перезапуска загружаются в кучу
+заново; просроченные за время простоя срабатывают сразу.
+"""
+import heapq
+import logging
+import sqlite3
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
+
+import i18n
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Префикс callback_data кнопки подтверждения
+ACK_PREFIX = 'ack:'
+ACK_LABEL = '🙋 Взять в работу'
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS tickets ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, service_type TEXT NOT NULL, chats TEXT NOT NULL, '
+    'created REAL NOT NULL, deadline REAL, acked REAL, acked_by TEXT, escalated REAL)',
+    # Только ожидающие: по этому индексу заполняется куча при запуске
+    'CREATE INDEX IF NOT EXISTS tickets_pending ON tickets (deadline) '
+    'WHERE deadline IS NOT NULL AND acked IS NULL AND escalated IS NULL',
+    'CREATE TABLE IF NOT EXISTS posts ('
+    'chat_id TEXT NOT NULL, message_id INTEGER NOT NULL, ticket INTEGER NOT NULL, '
+    'PRIMARY KEY (chat_id, message_id))',
+    'CREATE INDEX IF NOT EXISTS posts_ticket ON posts (ticket)',
+)
+
+
+def ack_markup(ticket):
+    """Кнопка подтверждения для payload DeliveryQueue (dict, чтобы payload оставался JSON)"""
+    return {'inline_keyboard': [[{'text': ACK_LABEL, 'callback_data': f'{ACK_PREFIX}{ticket}'}]]}
+
+
+class SlaTracker:
+    """Тикеты заявок, их подтверждение сотрудниками и напоминания о просроченных"""
+
+    def __init__(self, path, job_queue, delivery, sla_seconds, services, escalation_chat='', clock=time.time):
+        self.job_queue = job_queue
+        self.delivery = delivery
+        self.sla_seconds = sla_seconds
+        self.services = frozenset(services)
+        self.escalation_chat = escalation_chat
+        self.clock = clock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        self._conn.commit()
+        # (срок, тикет); pending — срок еще не подтвержденных тикетов
+        self._heap = []
+        self._pending = {}
+        self._job = None
+        self._job_deadline = None
+
+    def start(self):
+        """Загружает сроки неподтвержденных заявок и ставит задачу на ближайший"""
+        rows = self._conn.execute(
+            'SELECT deadline, id FROM tickets WHERE deadline IS NOT NULL AND acked IS NULL AND escalated IS NULL'
+        ).fetchall()
+        self._heap = [(deadline, ticket) for deadline, ticket in rows]
+        heapq.heapify(self._heap)
+        self._pending = {ticket: deadline for deadline, ticket in rows}
+        if rows:
+            logger.info(f"Восстановлено заявок, ожидающих подтверждения: {len(rows)}")
+        metrics.SLA_PENDING.set(len(self._pending))
+        self._schedule()
+        return self
+
+    def open(self, service_type, chats):
+        """Регистрирует заявку перед отправкой в чаты chats; возвращает номер тикета"""
+        now = self.clock()
+        deadline = now + self.sla_seconds if service_type in self.services and self.sla_seconds else None
+        with self._conn:
+            ticket = self._conn.execute(
+                'INSERT INTO tickets (service_type, chats, created, deadline) VALUES (?, ?, ?, ?)',
+                (service_type, ','.join(str(chat_id) for chat_id in chats), now, deadline)
+            ).lastrowid
+        if deadline is not None:
+            heapq.heappush(self._heap, (deadline, ticket))
+            self._pending[ticket] = deadline
+            metrics.SLA_PENDING.set(len(self._pending))
+            if self._job_deadline is None or deadline < self._job_deadline:
+                self._schedule()
+        return ticket
+
+    def posted(self, ticket, chat_id, message_id):
+        """Сообщение заявки доставлено (вызывает DeliveryQueue): по нему находится reply сотрудника"""
+        with self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO posts (chat_id, message_id, ticket) VALUES (?, ?, ?)',
+                               (str(chat_id), message_id, ticket))
+
+    def ticket_of(self, chat_id, message_id):
+        row = self._conn.execute('SELECT ticket FROM posts WHERE chat_id = ? AND message_id = ?',
+                                 (str(chat_id), message_id)).fetchone()
+        return row[0] if row else None
+
+    def acknowledge(self, ticket, who):
+        """Подтверждает заявку; возвращает None или имя того, кто подтвердил ее раньше"""
+        row = self._conn.execute('SELECT service_type, created, acked_by FROM tickets WHERE id = ?', (ticket,)).fetchone()
+        if row is None:
+            return None
+        service_type, created, acked_by = row
+        if acked_by is not None:
+            return acked_by
+        now = self.clock()
+        with self._conn:
+            self._conn.execute('UPDATE tickets SET acked = ?, acked_by = ? WHERE id = ?', (now, who, ticket))
+        # Из кучи тикет уйдет, когда до него дойдет очередь
+        if self._pending.pop(ticket, None) is not None:
+            metrics.SLA_PENDING.set(len(self._pending))
+        metrics.SLA_ACK_SECONDS.observe(now - created, service_type)
+        logger.info(f"Заявка #{ticket} взята в работу: {who}")
+        return None
+
+    def _schedule(self):
+        """Ставит задачу JobQueue на ближайший срок (одна задача на все таймеры)"""
+        while self._heap and self._heap[0][1] not in self._pending:
+            heapq.heappop(self._heap)
+        deadline = self._heap[0][0] if self._heap else None
+        if deadline == self._job_deadline:
+            return
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+        self._job_deadline = deadline
+        if deadline is not None:
+            self._job = self.job_queue.run_once(self._fire, max(0.0, deadline - self.clock()), name='sla')
+
+    async def _fire(self, context=None):
+        self._job = self._job_deadline = None
+        now = self.clock()
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, ticket = heapq.heappop(self._heap)
+            if self._pending.pop(ticket, None) is not None:
+                expired.append(ticket)
+        if expired:
+            self.escalate(expired, now)
+            metrics.SLA_PENDING.set(len(self._pending))
+        self._schedule()
+
+    def escalate(self, tickets, now=None):
+        """Напоминания о неподтвержденных заявках: ответом на сообщение заявки и в чат эскалации"""
+        now = now or self.clock()
+        minutes = round(self.sla_seconds / 60)
+        with self._conn:
+            for ticket in tickets:
+                self._conn.execute('UPDATE tickets SET escalated = ? WHERE id = ?', (now, ticket))
+        for ticket in tickets:
+            service_type, chats = self._conn.execute(
+                'SELECT service_type, chats FROM tickets WHERE id = ?', (ticket,)
+            ).fetchone()
+            posts = dict(self._conn.execute('SELECT chat_id, message_id FROM posts WHERE ticket = ?', (ticket,)))
+            text = f"⏰ Заявка #{ticket} ({i18n.default().label(service_type)}) не взята в работу за {minutes} мин"
+            for chat_id in chats.split(','):
+                if chat_id in posts:
+                    self.delivery.enqueue(chat_id, text, reply_to_message_id=posts[chat_id],
+                                          allow_sending_without_reply=True)
+                else:
+                    self.delivery.enqueue(chat_id, text)
+            if self.escalation_chat:
+                self.delivery.enqueue(self.escalation_chat, text)
+            metrics.SLA_ESCALATED.inc(service_type)
+            logger.warning(f"Заявка #{ticket} не подтверждена за {minutes} мин, отправлено напоминание")
+
+    def pending(self):
+        return len(self._pending)
+
+    async def stop(self):
+        # Задачу снимать не нужно: JobQueue останавливается вместе с Application раньше
+        self._job = self._job_deadline = None
+        self._conn.close()
+
+
+def who(update):
+    """Кто подтвердил: пользователь, подпись автора поста канала или название чата"""
+    user = update.effective_user
+    if user is not None:
+        return f'@{user.username}' if user.username else user.full_name
+    message = update.effective_message
+    if message is not None and message.author_signature:
+        return message.author_signature
+    return update.effective_chat.title or str(update.effective_chat.id)
+
+
+async def on_button(update, context):
+    """Нажатие «Взять в работу» под заявкой в канале"""
+    query = update.callback_query
+    tracker = context.bot_data.get('sla')
+    if tracker is None:
+        await query.answer()
+        return
+    ticket = int(query.data[len(ACK_PREFIX):])
+    name = who(update)
+    earlier = tracker.acknowledge(ticket, name)
+    if earlier is not None:
+        await query.answer(f'Заявка #{ticket} уже в работе: {earlier}')
+        return
+    await query.answer(f'Заявка #{ticket} взята в работу')
+    await mark_taken(context.bot, query.message.chat.id, query.message.message_id, ticket, name)
+
+
+async def on_reply(update, context):
+    """Ответ (reply) сотрудника на сообщение заявки в канале или группе"""
+    tracker = context.bot_data.get('sla')
+    message = update.effective_message
+    if tracker is None or message.reply_to_message is None:
+        return
+    ticket = tracker.ticket_of(message.chat.id, message.reply_to_message.message_id)
+    if ticket is None:
+        return
+    name = who(update)
+    if tracker.acknowledge(ticket, name) is None:
+        await mark_taken(context.bot, message.chat.id, message.reply_to_message.message_id, ticket, name)
+
+
+async def mark_taken(bot, chat_id, message_id, ticket, name):
+    """Заменяет кнопку под заявкой отметкой, кто взял ее в работу"""
+    markup = InlineKeyboardMarkup([[InlineKeyboardButton(f'✅ В работе: {name}', callback_data=f'{ACK_PREFIX}{ticket}')]])
+    try:
+        await bot.edit_message_reply_markup(chat_id, message_id, reply_markup=markup)
+    except TelegramError as e:
+        logger.warning(f"Не удалось отметить заявку #{ticket} в {chat_id}: {e}")
+
+
+def build_tracker(path, application, delivery, sla_seconds, services, escalation_chat=''):
+    """Создает SlaTracker или возвращает None, если контроль SLA не включен"""
+    if not path:
+        return None
+    if application.job_queue is None:
+        logger.error("Контроль SLA отключен: нет JobQueue (нужен python-telegram-bot[job-queue])")
+        return None
+    return SlaTracker(path, application.job_queue, delivery, sla_seconds, services, escalation_chat)
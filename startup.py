@@ -0,0 +1,88 @@
+"""Профиль холодного старта: время импорта модулей и этапов запуска бота.
+
+Включается STARTUP_PROFILE=1. Модуль импортируется первым в app.py и main.py и с этого
+момента подменяет builtins.__import__: для каждого впервые загружаемого модуля
+запоминается собственное время и время вместе с вложенными импортами (как python -X
+importtime). Этапы запуска отмечаются mark('...'); report() пишет сводку в журнал, когда
+бот готов принимать обновления. Без STARTUP_PROFILE mark и report ничего не делают.
+"""
+import builtins
+import logging
+import sys
+import threading
+import time
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Момент импорта модуля — начало отсчета для этапов запуска
+STARTED = time.perf_counter()
+
+
+class ImportProfiler:
+    """Замеряет время первого импорта каждого модуля"""
+
+    def __init__(self):
+        self.times = {}
+        self._local = threading.local()
+        self._original = None
+
+    def install(self):
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        # Стек времени вложенных импортов; у каждого потока свой
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.times[name] = (elapsed - nested, elapsed)
+
+    def top(self, limit):
+        """[(модуль, собственное время, полное время)] по убыванию полного времени"""
+        items = sorted(self.times.items(), key=lambda item: item[1][1], reverse=True)
+        return [(name, own, total) for name, (own, total) in items[:limit]]
+
+
+profiler = ImportProfiler()
+_marks = []
+
+
+def mark(name):
+    """Отмечает завершение этапа запуска"""
+    if config.STARTUP_PROFILE:
+        _marks.append((name, time.perf_counter() - STARTED))
+
+
+def report(limit=25):
+    """Пишет в журнал этапы запуска и самые долгие импорты"""
+    if not config.STARTUP_PROFILE:
+        return
+    lines = ['Профиль запуска', 'Этапы (от импорта startup, мс):']
+    previous = 0.0
+    for name, offset in _marks:
+        lines.append(f'  {offset * 1000:8.1f}  +{(offset - previous) * 1000:7.1f}  {name}')
+        previous = offset
+    lines.append(f'Импорты (собственное / с вложенными, мс), {limit} самых долгих из {len(profiler.times)}:')
+    for name, own, total in profiler.top(limit):
+        lines.append(f'  {own * 1000:8.1f}  {total * 1000:8.1f}  {name}')
+    logger.info('\n'.join(lines))
+
+
+if config.STARTUP_PROFILE:
+    profiler.install()
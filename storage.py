@@ -0,0 +1,174 @@
+"""Хранилище отправленных заявок (SQLite).
+
+Бот пишет заявки пачками через RequestStore; веб-приложение читает их своим
+соединением (WAL позволяет читать во время записи): постраничный поиск по курсору
+и потоковая выгрузка в CSV/JSONL без загрузки всей таблицы в память.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Колонки заявки в порядке выгрузки
+COLUMNS = (
+    'id', 'created', 'service_type', 'user_id', 'chat_id', 'username', 'first_name',
+    'equipment_type', 'equipment_model', 'problem_description', 'purpose',
+    'phone', 'email', 'inn', 'organization', 'channel',
+)
+# Фильтры поиска: параметр запроса -> условие SQL
+FILTERS = {
+    'service_type': 'service_type = ?',
+    'inn': 'inn = ?',
+    'phone': 'phone = ?',
+    'equipment_type': 'equipment_type = ?',
+    'user_id': 'user_id = ?',
+    'since': 'created >= ?',
+    'until': 'created < ?',
+}
+# Первые символы ячейки, с которых Excel начинает формулу
+_FORMULA_PREFIXES = ('=', '+', '-', '@')
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS requests ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, service_type TEXT NOT NULL, '
+    'user_id INTEGER, chat_id INTEGER, username TEXT, first_name TEXT, '
+    'equipment_type TEXT, equipment_model TEXT, problem_description TEXT, purpose TEXT, '
+    'phone TEXT, email TEXT, inn TEXT, organization TEXT, channel TEXT)',
+    'CREATE INDEX IF NOT EXISTS requests_inn ON requests (inn)',
+    'CREATE INDEX IF NOT EXISTS requests_phone ON requests (phone)',
+    'CREATE INDEX IF NOT EXISTS requests_service_created ON requests (service_type, created)',
+    'CREATE INDEX IF NOT EXISTS requests_created ON requests (created)',
+)
+
+
+def connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in _SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+class RequestStore:
+    """Пишет заявки в SQLite пачками: по batch_size штук или раз в flush_interval секунд"""
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = connect(path)
+        self._buffer = []
+        self._flusher = None
+        self._flushes = set()
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    def add(self, record):
+        """Добавляет заявку (dict с ключами из COLUMNS) в буфер записи"""
+        record = dict(record)
+        record.setdefault('created', time.time())
+        self._buffer.append(tuple(record.get(column) for column in COLUMNS[1:]))
+        if len(self._buffer) >= self.batch_size:
+            task = asyncio.get_running_loop().create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._insert, rows)
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось записать {len(rows)} заявок: {e}")
+            self._buffer = rows + self._buffer
+
+    def _insert(self, rows):
+        placeholders = ', '.join('?' * (len(COLUMNS) - 1))
+        with self._conn:
+            self._conn.executemany(
+                f'INSERT INTO requests ({", ".join(COLUMNS[1:])}) VALUES ({placeholders})', rows
+            )
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, *self._flushes, return_exceptions=True)
+        await self.flush()
+        self._conn.close()
+
+
+def _where(filters):
+    clauses, params = [], []
+    for name, value in filters.items():
+        if name in FILTERS and value not in (None, ''):
+            clauses.append(FILTERS[name])
+            params.append(value)
+    return clauses, params
+
+
+def search(conn, filters, before_id=None, limit=50):
+    """Страница заявок от новых к старым; before_id — курсор из предыдущей страницы"""
+    clauses, params = _where(filters)
+    if before_id is not None:
+        clauses.append('id < ?')
+        params.append(before_id)
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    cursor = conn.execute(
+        f'SELECT {", ".join(COLUMNS)} FROM requests {where} ORDER BY id DESC LIMIT ?', (*params, limit)
+    )
+    items = [dict(zip(COLUMNS, row)) for row in cursor]
+    next_cursor = items[-1]['id'] if items and len(items) == limit else None
+    return items, next_cursor
+
+
+def iter_rows(conn, filters, chunk_size=500):
+    """Все заявки по фильтрам порциями по chunk_size, не загружая таблицу целиком"""
+    clauses, params = _where(filters)
+    where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+    cursor = conn.execute(f'SELECT {", ".join(COLUMNS)} FROM requests {where} ORDER BY id', params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def _csv_cell(value):
+    """Текст, который Excel принял бы за формулу (=, +, -, @), экранируется апострофом"""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def export_csv(conn, filters):
+    """Генератор строк CSV (с заголовком); поля пользователя защищены от CSV-инъекции формул"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for row in iter_rows(conn, filters):
+        writer.writerow([_csv_cell(value) for value in row])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_jsonl(conn, filters):
+    """Генератор строк JSON Lines"""
+    for row in iter_rows(conn, filters):
+        yield json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n'
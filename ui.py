@@ -0,0 +1,100 @@
+"""Клавиатуры, подготовленные один раз при старте.
+
+Раскладки задаются id кнопок, надписи берутся из каталога языка (см. i18n).
+Обработчики берут готовые объекты через markup(keyboard_id, ..., locale=...) вместо
+создания ReplyKeyboardMarkup на каждое сообщение; инлайн-клавиатуры (см. inline) так же
+кэшируются через inline_markup.
+"""
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup,
+                      ReplyKeyboardRemove)
+
+import i18n
+
+# Раскладки клавиатур: id кнопок каталога
+KEYBOARDS = {
+    'main_menu': (('urgent',), ('repair', 'rental'), ('audit',)),
+    'urgent_type': (('ultrasound', 'ventilator'), ('endoscopy', 'anesthesia'), ('other', 'back')),
+    'repair_type': (('ct', 'mri', 'xray'), ('ultrasound', 'ventilator', 'endoscopy'), ('anesthesia', 'other_equipment'), ('back',)),
+    'rental_purpose': (('purpose_testing',), ('purpose_license',), ('purpose_replacement',), ('back',)),
+    'back_only': (('back',),),
+    'yes_no': (('yes', 'no'), ('back',)),
+    'skip': (('skip',), ('back',)),
+    'phone': (('share_phone',), ('back',)),
+}
+# Кнопки, отправляющие контакт пользователя вместо текста
+CONTACT_BUTTONS = frozenset({'share_phone'})
+# Отметка выбранного варианта на инлайн-клавиатуре
+CHECKED = '✅ '
+
+
+def keyboard(keyboard_id, locale=i18n.DEFAULT_LOCALE):
+    """Ряды кнопок клавиатуры с надписями на языке locale"""
+    catalog = i18n.catalogs()[locale]
+    return tuple(
+        tuple(KeyboardButton(catalog.label(button), request_contact=True) if button in CONTACT_BUTTONS
+              else catalog.label(button) for button in row)
+        for row in KEYBOARDS[keyboard_id]
+    )
+
+
+def _cached(markup_class):
+    """Подкласс markup_class, сериализованный в dict один раз при создании.
+
+    Объекты Telegram неизменяемы, поэтому один экземпляр безопасно переиспользовать
+    во всех ответах; Bot API-клиент получает готовый dict вместо обхода дерева кнопок.
+    """
+    class Cached(markup_class):
+        __slots__ = ('_serialized',)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            with self._unfrozen():
+                self._serialized = super().to_dict()
+
+        def to_dict(self, recursive=True):
+            return self._serialized
+
+    Cached.__name__ = Cached.__qualname__ = f'Cached{markup_class.__name__}'
+    return Cached
+
+
+CachedMarkup = _cached(ReplyKeyboardMarkup)
+CachedInlineMarkup = _cached(InlineKeyboardMarkup)
+
+
+_markups = {}
+_inline_markups = {}
+REMOVE = ReplyKeyboardRemove()
+
+
+def markup(keyboard_id, resize=False, one_time=True, locale=i18n.DEFAULT_LOCALE):
+    """Возвращает общий экземпляр клавиатуры с заданными параметрами"""
+    key = (keyboard_id, resize, one_time, locale)
+    cached = _markups.get(key)
+    if cached is None:
+        cached = _markups[key] = CachedMarkup(
+            keyboard(keyboard_id, locale), one_time_keyboard=one_time, resize_keyboard=resize
+        )
+    return cached
+
+
+def inline_markup(rows, locale=i18n.DEFAULT_LOCALE):
+    """Общий экземпляр инлайн-клавиатуры; rows — ряды (id кнопки, callback_data, отмечена ли)"""
+    key = (rows, locale)
+    cached = _inline_markups.get(key)
+    if cached is None:
+        catalog = i18n.catalogs()[locale]
+        cached = _inline_markups[key] = CachedInlineMarkup(tuple(
+            tuple(InlineKeyboardButton((CHECKED if checked else '') + catalog.label(button), callback_data=data)
+                  for button, data, checked in row)
+            for row in rows
+        ))
+    return cached
+
+
+def prebuild():
+    """Создает все клавиатуры всех языков заранее, чтобы первый ответ не тратил на это время"""
+    for locale in i18n.catalogs():
+        for keyboard_id in KEYBOARDS:
+            for resize in (False, True):
+                markup(keyboard_id, resize, locale=locale)